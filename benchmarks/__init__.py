@@ -0,0 +1,10 @@
+'''
+pogo: benchmarks module.
+
+Meant for use with py.test and the pytest-benchmark plugin:
+    py.test benchmarks
+Organize benchmarks into files, each named xxx_test.py
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
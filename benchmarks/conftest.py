@@ -0,0 +1,52 @@
+'''
+pogo: shared fixtures for the benchmarks.
+
+Set POGO_BENCH_SCALE to make the HonSSH trees bigger (the default, 1,
+gives about 2 MB of data per tree), and POGO_BENCH_ES_LATENCY to the
+seconds the stand-in Elasticsearch server takes to answer each request
+(0.005 by default).
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import os
+
+import pytest
+
+from benchmarks.fake_es import FakeElasticsearch
+from benchmarks.honssh_data import generate
+from pogo.dao.local_db_access import LocalDBAccessor
+
+
+def bench_scale():
+    return int(os.environ.get('POGO_BENCH_SCALE', '1'))
+
+
+@pytest.fixture(scope='session', params=['SINGLE', 'MULTI'])
+def honssh_tree(request, tmpdir_factory):
+    top_dir = tmpdir_factory.mktemp('honssh_' + request.param.lower())
+    generate(str(top_dir), request.param, bench_scale())
+    return request.param, top_dir
+
+
+@pytest.fixture(scope='session')
+def single_tree(tmpdir_factory):
+    top_dir = tmpdir_factory.mktemp('honssh_records')
+    generate(str(top_dir), 'SINGLE', bench_scale())
+    return top_dir
+
+
+@pytest.fixture
+def new_dba(tmpdir):
+    count = [0]
+    def make():
+        count[0] += 1
+        return LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo%d.db' % count[0]))})
+    return make
+
+
+@pytest.fixture(scope='session')
+def fake_es():
+    latency = float(os.environ.get('POGO_BENCH_ES_LATENCY', '0.005'))
+    with FakeElasticsearch(latency=latency) as fake:
+        yield fake
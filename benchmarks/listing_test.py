@@ -0,0 +1,32 @@
+'''
+pogo: benchmarks for finding HonSSH's files, in both directory layouts.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from pogo.dao.file_state_dao_local import FileStateDaoLocal
+from pogo.file.file_lister import (AttemptFileLister, LogFileLister, SessionLogFileLister,
+                                   SessionRecordingFileLister, SessionDownloadFileLister)
+
+LISTERS = [ (AttemptFileLister, 'logs'), (LogFileLister, 'logs'), (SessionLogFileLister, 'sessions'),
+            (SessionRecordingFileLister, 'sessions'), (SessionDownloadFileLister, 'sessions') ]
+
+
+@pytest.mark.benchmark(group='listing')
+@pytest.mark.parametrize('lister_class,subdir', LISTERS, ids=[ l[0].__name__ for l in LISTERS ])
+def test_load_file_name_lists(benchmark, honssh_tree, new_dba, lister_class, subdir):
+    (layout, top_dir) = honssh_tree
+    dao = FileStateDaoLocal(new_dba())
+    # A new lister, and so a new DirectoryWalker, each round, so
+    # that every round reads the directories afresh:
+    def setup():
+        return (lister_class(str(top_dir.join(subdir)), layout, dao), ), {}
+    def load(lister):
+        lister.load_file_name_lists()
+        return lister
+    lister = benchmark.pedantic(load, setup=setup, rounds=10)
+    assert lister._pending_file_names
@@ -0,0 +1,76 @@
+'''
+pogo: benchmarks for parsing HonSSH's files into records, and for
+the geoip and time zone conversions done for each record.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.honssh_data import find_files, read_lines
+from pogo.dto.record import AttemptRecord, SessionLogRecord
+from pogo.file.stretch_file import LogFile
+from pogo.util.util import LocalTimeConverter, configure_geo_cache, get_geo_cache
+
+
+@pytest.fixture
+def fresh_geo_cache():
+    saved = get_geo_cache()
+    yield
+    configure_geo_cache(saved.max_size)
+
+
+@pytest.mark.benchmark(group='parse')
+def test_attempt_records(benchmark, single_tree):
+    lines = [ l.rstrip() for l in read_lines(single_tree, 'logs', '2*') ]
+    records = benchmark(lambda: [ AttemptRecord(l) for l in lines ])
+    assert len(records) == len(lines)
+
+
+@pytest.mark.benchmark(group='parse')
+def test_log_records(benchmark, single_tree):
+    names = find_files(single_tree, 'logs', 'honssh.log*')
+    records = benchmark(lambda: [ r for n in names for r in LogFile(n).iter_records() ])
+    # Continuation lines are folded into the record before them:
+    assert 0 < len(records) < len(read_lines(single_tree, 'logs', 'honssh.log*'))
+
+
+@pytest.mark.benchmark(group='parse')
+def test_session_log_records(benchmark, single_tree):
+    lines = read_lines(single_tree, 'sessions', '*', '*.log')
+    records = benchmark(lambda: [ SessionLogRecord(l) for l in lines ])
+    assert len(records) == len(lines)
+
+
+@pytest.mark.benchmark(group='geo')
+def test_geo_lookups_cold(benchmark, single_tree, fresh_geo_cache):
+    ips = [ l.split(',')[1] for l in read_lines(single_tree, 'logs', '2*') ]
+    # An empty cache each round, so every address is looked up in GeoLite2:
+    def setup():
+        return (configure_geo_cache(), ), {}
+    benchmark.pedantic(lambda cache: [ cache.get(ip) for ip in ips ], setup=setup, rounds=5)
+    assert get_geo_cache().misses == len(set(ips))
+
+
+@pytest.mark.benchmark(group='geo')
+def test_geo_lookups_warm(benchmark, single_tree, fresh_geo_cache):
+    ips = [ l.split(',')[1] for l in read_lines(single_tree, 'logs', '2*') ]
+    cache = configure_geo_cache()
+    benchmark(lambda: [ cache.get(ip) for ip in ips ])
+    assert cache.hit_rate() > 0.9
+
+
+@pytest.mark.benchmark(group='time')
+def test_local_times_to_utc(benchmark, single_tree):
+    timestamps = [ l[0:19] for l in read_lines(single_tree, 'logs', '2*') ]
+    converted = benchmark(lambda: LocalTimeConverter().to_utc_many(timestamps))
+    assert len(converted) == len(timestamps)
+
+
+@pytest.mark.benchmark(group='time')
+def test_log_timestamps_to_utc(benchmark, single_tree):
+    timestamps = [ l[0:24] for l in read_lines(single_tree, 'logs', 'honssh.log*') if not l.startswith('\t') ]
+    converted = benchmark(lambda: LocalTimeConverter().timestamp_to_utc_many(timestamps))
+    assert len(converted) == len(timestamps)
@@ -0,0 +1,69 @@
+'''
+pogo: benchmarks for shipping records to Elasticsearch -- here, the
+stand-in server in benchmarks.fake_es -- for each type of record, _bulk
+batch size and number of batches in flight.
+
+Besides pytest-benchmark's timings, each benchmark's extra_info (in the
+--benchmark-json output) holds the documents shipped per round and the
+best documents per second.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import time
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.honssh_data import find_files
+from pogo.dao.record_dao_es import (AttemptRecordDaoES, LogRecordDaoES, SessionLogDaoES,
+                                    SessionRecordingDaoES, SessionDownloadDaoES)
+from pogo.file.stretch_file import (AttemptFile, LogFile, SessionLogFile, SessionRecordingFile,
+                                    SessionDownloadFile)
+from pogo.service.bulk_shipper import BulkShipper
+
+RECORD_TYPES = {
+    'attempts': (AttemptRecordDaoES, AttemptFile, ('logs', '2*')),
+    'logs': (LogRecordDaoES, LogFile, ('logs', 'honssh.log*')),
+    'session_logs': (SessionLogDaoES, SessionLogFile, ('sessions', '*', '*.log')),
+    'recordings': (SessionRecordingDaoES, SessionRecordingFile, ('sessions', '*', '*.tty')),
+    'downloads': (SessionDownloadDaoES, SessionDownloadFile, ('sessions', '*', 'downloads', '*')),
+    }
+
+_records = {}
+
+def records_of_type(top_dir, record_type):
+    if record_type not in _records:
+        (dao_class, file_class, pattern) = RECORD_TYPES[record_type]
+        _records[record_type] = [ r for n in find_files(top_dir, *pattern) for r in file_class(n).iter_records() ]
+    return _records[record_type]
+
+
+def batches_of(records, size):
+    for i in range(0, len(records), size):
+        yield (range(i, i + size), records[i:i + size])
+
+
+@pytest.mark.benchmark(group='shipping')
+@pytest.mark.parametrize('in_flight', [ 1, 4, 8 ])
+@pytest.mark.parametrize('batch_size', [ 100, 500, 2000 ])
+@pytest.mark.parametrize('record_type', sorted(RECORD_TYPES.keys()))
+def test_ship(benchmark, single_tree, fake_es, record_type, batch_size, in_flight):
+    records = records_of_type(single_tree, record_type)
+    dao = RECORD_TYPES[record_type][0](fake_es.es_cfg(es_bulk_docs=batch_size))
+    shipper = BulkShipper(dao, in_flight)
+    timings = []
+    def ship():
+        counts = [0, 0]
+        def on_results(keys, results):
+            for (ok, result) in results:
+                counts[0 if ok else 1] += 1
+        started = time.time()
+        shipper.ship(batches_of(records, batch_size), on_results)
+        timings.append(time.time() - started)
+        return counts
+    (shipped, failed) = benchmark.pedantic(ship, rounds=3)
+    assert (shipped, failed) == (len(records), 0)
+    benchmark.extra_info['docs'] = len(records)
+    benchmark.extra_info['docs_per_second'] = round(len(records) / min(timings), 1)
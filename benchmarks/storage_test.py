@@ -0,0 +1,45 @@
+'''
+pogo: benchmarks for writing records to the local database and
+archiving HonSSH's files.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import itertools
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmarks.honssh_data import find_files
+from pogo.dao.record_dao_local import AttemptRecordDaoLocal, SessionLogDaoLocal
+from pogo.file.stretch_file import AttemptFile, SessionLogFile
+from pogo.util.archive import CODECS
+from pogo.util.util import archive_file_list
+
+
+@pytest.mark.benchmark(group='sqlite')
+@pytest.mark.parametrize('dao_class,file_class,pattern', [
+    (AttemptRecordDaoLocal, AttemptFile, ('logs', '2*')),
+    (SessionLogDaoLocal, SessionLogFile, ('sessions', '*', '*.log')) ],
+    ids=['attempts', 'session_logs'])
+@pytest.mark.parametrize('commit_every', [ 0, 1000 ])
+def test_insert_bulk(benchmark, single_tree, new_dba, dao_class, file_class, pattern, commit_every):
+    records = [ r for n in find_files(single_tree, *pattern) for r in file_class(n).iter_records() ]
+    # Each round writes to an empty database:
+    setup = lambda: ((dao_class(new_dba()), ), {})
+    written = benchmark.pedantic(lambda dao: dao.insert_bulk(records, commit_every), setup=setup, rounds=5)
+    assert written == len(records)
+
+
+@pytest.mark.benchmark(group='archive')
+@pytest.mark.parametrize('codec', [ 'none', 'gzip', 'bz2', 'xz', 'zstd' ])
+def test_archive_file_list(benchmark, single_tree, tmpdir, codec):
+    if codec not in CODECS:
+        pytest.skip(codec + ' needs an optional package')
+    extension = CODECS[codec].extension
+    files = find_files(single_tree, 'logs', '*') + find_files(single_tree, 'sessions', '*', '*.*')
+    names = itertools.count()
+    setup = lambda: ((str(tmpdir.join('archive%d%s' % (next(names), extension))), ), {})
+    benchmark.pedantic(lambda name: archive_file_list(name, files), setup=setup, rounds=3)
+    assert tmpdir.listdir()
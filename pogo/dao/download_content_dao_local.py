@@ -0,0 +1,84 @@
+"""
+    Keeps the contents of downloaded files in the local database,
+    once per distinct file. Each row is keyed by the SHA-256 hash of
+    the file; session_downloads rows refer to it by that hash rather
+    than holding their own copy of the contents.
+    Once a file's contents have been shipped to Elasticsearch, pruning
+    empties the row but keeps it, so the same file downloaded again
+    later is recognized and neither stored nor shipped a second time.
+"""
+import sqlite3
+
+class DownloadContentDaoLocal(object):
+    TABLE_NAME = 'download_contents'
+
+    def __init__(self, localdbaccessor):
+        if not localdbaccessor:
+            raise ValueError("DownloadContentDaoLocal object needs a LocalDBAccessor.")
+        self._dba = localdbaccessor
+
+    """
+        Store a file's contents, unless contents with the same hash are
+        already stored (or have been, and were shipped and pruned).
+        This doesn't start or commit a transaction; it's meant to be called
+        with the cursor of the transaction that writes the download record.
+    """
+    @staticmethod
+    def store(cursor, sha256, file_size, contents):
+        sql = ("INSERT OR IGNORE INTO " + DownloadContentDaoLocal.TABLE_NAME
+               + " ( sha256, file_size, contents ) VALUES ( ?,?,? )")
+        cursor.execute(sql, (sha256, file_size, contents))
+
+    """
+        The hashes of up to limit contents not yet shipped to
+        Elasticsearch, in order, starting after the hash after_sha256.
+    """
+    def list_unshipped(self, after_sha256='', limit=500):
+        sql = ("SELECT sha256 FROM " + DownloadContentDaoLocal.TABLE_NAME
+               + " WHERE es_shipped = 0 AND sha256 > ? ORDER BY sha256 LIMIT ?")
+        with self._dba.lock:
+            cursor = self._dba.db.cursor()
+            cursor.execute(sql, (after_sha256, limit))
+            return [ row[0] for row in cursor.fetchall() ]
+
+    """
+        Return (file_size, contents) for the given hash, or None.
+    """
+    def get(self, sha256):
+        sql = "SELECT file_size, contents FROM " + DownloadContentDaoLocal.TABLE_NAME + " WHERE sha256 = ?"
+        with self._dba.lock:
+            cursor = self._dba.db.cursor()
+            cursor.execute(sql, (sha256, ))
+            return cursor.fetchone()
+
+    def mark_shipped(self, hashes):
+        sql = "UPDATE " + DownloadContentDaoLocal.TABLE_NAME + " SET es_shipped = 1 WHERE sha256 = ?"
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.executemany(sql, [ (h, ) for h in hashes ])
+                cursor.execute('COMMIT')
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
+
+    """
+        Drop the contents of everything that has been shipped,
+        keeping the (small) rows themselves. Returns the number
+        of rows emptied.
+    """
+    def prune(self):
+        sql = ("UPDATE " + DownloadContentDaoLocal.TABLE_NAME
+               + " SET contents = NULL WHERE es_shipped = 1 AND contents IS NOT NULL")
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.execute(sql)
+                count_pruned = cursor.rowcount
+                cursor.execute('COMMIT')
+                return count_pruned
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
@@ -0,0 +1,170 @@
+"""
+    Keeps track, for direct mode, of how far into each HonSSH file
+    Elasticsearch has acknowledged records, in an append-only journal
+    file instead of the local database.
+
+    Each line of the journal is a JSON object. A progress line is added
+    each time a batch of a file's records is acknowledged, and holds the
+    same things as a row of the file_state table; a line with "forget"
+    set is added when a file is deleted. The last line for a path wins.
+    Lines are flushed and synced to disk as they're written, so after a
+    crash the journal holds every acknowledged batch except, at worst,
+    the one being written, whose half-written line is dropped when the
+    journal is next opened. Records from a batch whose line was lost are
+    sent again; since their document _ids are worked out from the file
+    and the record's position in it (see document_id()), Elasticsearch
+    replaces the documents instead of adding them a second time.
+
+    FileJournal has the same methods as FileStateDaoLocal, so a FileLister
+    can use either to keep track of its files.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import socket
+import threading
+
+from pogo.dao.file_state_dao_local import FileState
+
+_HOSTNAME = socket.gethostname()
+
+class FileJournal(object):
+    # Rewrite the journal when it has more than this many lines per file it knows about:
+    COMPACT_RATIO = 4
+    COMPACT_MIN_LINES = 1000
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        # path -> (file_type, FileState, key):
+        self._states = {}
+        self._lines = 0
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        self._replay()
+        self._f = open(self._path, 'ab')
+
+    """
+        Read the journal, keeping the last state of each file. A last line
+        that can't be read (because pogo was stopped while writing it) is
+        cut off, so that new lines go after the last good one.
+    """
+    def _replay(self):
+        if not os.path.exists(self._path):
+            return
+        good = 0
+        with open(self._path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError('incomplete line')
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError, TypeError):
+                    logging.warning("Ignoring the end of journal %s, from byte %s", self._path, good)
+                    break
+                good += len(line)
+                self._lines += 1
+        if good < os.path.getsize(self._path):
+            with open(self._path, 'r+b') as f:
+                f.truncate(good)
+
+    def _apply(self, entry):
+        if entry.get('forget'):
+            self._states.pop(entry['path'], None)
+        else:
+            state = FileState(entry['inode'], entry['size'], entry['mtime'], entry['records_done'],
+                              bool(entry['done']), entry['byte_offset'])
+            self._states[entry['path']] = (entry['file_type'], state, entry['key'])
+
+    def _append(self, entries):
+        with self._lock:
+            for entry in entries:
+                self._apply(entry)
+                self._f.write(json.dumps(entry, sort_keys=True) + '\n')
+                self._lines += 1
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    """
+        Load the state of all the files of the given type.
+    """
+    def load_states(self, file_type):
+        with self._lock:
+            return dict( (p, s[1]) for (p, s) in self._states.items() if s[0] == file_type )
+
+    """
+        Save the state of a file, as FileStateDaoLocal.record_progress()
+        does. cursor isn't used.
+    """
+    def record_progress(self, cursor, path, file_type, file_stat, records_done, done, byte_offset=0):
+        self._append([ { 'path': path, 'file_type': file_type, 'key': self.file_key(path, file_stat),
+                         'inode': file_stat.st_ino, 'size': file_stat.st_size,
+                         'mtime': file_stat.st_mtime, 'records_done': records_done,
+                         'done': int(bool(done)), 'byte_offset': byte_offset } ])
+
+    """
+        Forget about files that have been deleted.
+    """
+    def delete_states(self, paths):
+        self._append([ { 'path': p, 'forget': 1 } for p in paths ])
+        return len(paths)
+
+    """
+        A string that identifies a file for as long as it's kept: made
+        from the host name and the file's path and inode when it was first
+        seen. A file that's been renamed (as honssh.log is, when it's
+        rotated) keeps the key it had under its old name.
+    """
+    def file_key(self, path, file_stat):
+        with self._lock:
+            s = self._states.get(path)
+            if s is None or s[1].inode != file_stat.st_ino:
+                s = None
+                for other in self._states.itervalues():
+                    if other[1].inode == file_stat.st_ino:
+                        s = other
+                        break
+        if s is not None:
+            return s[2]
+        return '%s:%s:%s' % (_HOSTNAME, path, file_stat.st_ino)
+
+    """
+        The _id for the document made from record number ordinal
+        (counting from 0) of the file with the given key.
+    """
+    @staticmethod
+    def document_id(key, ordinal):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return hashlib.sha1('%s#%d' % (key, ordinal)).hexdigest()
+
+    """
+        If the journal has grown to many times the number of files it
+        knows about, rewrite it with just the last line for each.
+        The new journal is written beside the old one, then renamed
+        over it, so one or the other is always complete.
+    """
+    def compact(self):
+        with self._lock:
+            if self._lines < max(FileJournal.COMPACT_MIN_LINES, FileJournal.COMPACT_RATIO * len(self._states)):
+                return False
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for (path, (file_type, state, key)) in sorted(self._states.items()):
+                    entry = dict(state._asdict(), path=path, file_type=file_type, key=key, done=int(state.done))
+                    f.write(json.dumps(entry, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._f.close()
+            os.rename(tmp_path, self._path)
+            self._f = open(self._path, 'ab')
+            logging.info("Compacted journal %s from %s lines to %s", self._path, self._lines, len(self._states))
+            self._lines = len(self._states)
+            return True
+
+    def close(self):
+        with self._lock:
+            self._f.close()
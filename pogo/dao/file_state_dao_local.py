@@ -0,0 +1,65 @@
+"""
+    Keeps track, in the local database, of which HonSSH files have
+    been scraped. Each row holds a file's path, the identity of the file
+    at that path (inode, size and mtime) and how many of its records
+    have been committed -- and, for files that are read as they grow,
+    the byte offset just past the last record committed. Rows are written
+    in the same transaction as the records they describe, so the file
+    state and the records can't get out of step, even if pogo is killed
+    part way through a file.
+"""
+import collections
+import sqlite3
+
+FileState = collections.namedtuple('FileState', 'inode size mtime records_done done byte_offset')
+
+class FileStateDaoLocal(object):
+    TABLE_NAME = 'file_state'
+
+    def __init__(self, localdbaccessor):
+        if not localdbaccessor:
+            raise ValueError("FileStateDaoLocal object needs a LocalDBAccessor.")
+        self._dba = localdbaccessor
+
+    """
+        Return a dict mapping path to FileState for all
+        the files of the given type, in one query.
+    """
+    def load_states(self, file_type):
+        sql = ("SELECT path, inode, size, mtime, records_done, done, byte_offset FROM "
+               + FileStateDaoLocal.TABLE_NAME + " WHERE file_type = ?")
+        with self._dba.lock:
+            cursor = self._dba.db.cursor()
+            cursor.execute(sql, (file_type, ))
+            rows = cursor.fetchall()
+        return dict( (row[0], FileState(row[1], row[2], row[3], row[4], bool(row[5]), row[6])) for row in rows )
+
+    """
+        Save the state of a file. This doesn't start or commit a
+        transaction; it's meant to be called with the cursor of the
+        transaction that wrote the file's records.
+        file_stat is the result of os.stat() on the file.
+    """
+    @staticmethod
+    def record_progress(cursor, path, file_type, file_stat, records_done, done, byte_offset=0):
+        sql = ("INSERT OR REPLACE INTO " + FileStateDaoLocal.TABLE_NAME
+               + " ( path, file_type, inode, size, mtime, records_done, done, byte_offset ) VALUES ( ?,?,?,?,?,?,?,? )")
+        cursor.execute(sql, (path, file_type, file_stat.st_ino, file_stat.st_size,
+                             file_stat.st_mtime, records_done, int(bool(done)), byte_offset))
+
+    """
+        Forget about files that have been deleted.
+    """
+    def delete_states(self, paths):
+        sql = "DELETE FROM " + FileStateDaoLocal.TABLE_NAME + " WHERE path = ?"
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.executemany(sql, [ (p, ) for p in paths ])
+                count_deleted = cursor.rowcount
+                cursor.execute('COMMIT')
+                return count_deleted
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
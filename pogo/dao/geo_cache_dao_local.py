@@ -0,0 +1,80 @@
+"""
+    Persistent storage, in the local database, for the results
+    of GeoLite2 lookups. Used as the store behind util.GeoInfoCache
+    so that country information survives from one run to the next.
+    Each row is tagged with a stamp identifying the GeoLite2 database
+    that produced it; rows from any other database are discarded.
+"""
+import sqlite3
+
+from pogo.util.util import PogoGeoInfo
+
+class GeoCacheDaoLocal(object):
+    TABLE_NAME = 'geo_cache'
+
+    def __init__(self, localdbaccessor, geo_db_stamp):
+        if not localdbaccessor:
+            raise ValueError("GeoCacheDaoLocal object needs a LocalDBAccessor.")
+        self._dba = localdbaccessor
+        self._stamp = geo_db_stamp
+        self._pending = {}
+        self.discard_stale()
+
+    """
+        Remove results produced by a different GeoLite2 database.
+    """
+    def discard_stale(self):
+        sql = "DELETE FROM " + GeoCacheDaoLocal.TABLE_NAME + " WHERE geo_db_stamp != ?"
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.execute(sql, (self._stamp, ))
+                count_deleted = cursor.rowcount
+                cursor.execute('COMMIT')
+                return count_deleted
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
+
+    def get(self, ipaddress):
+        gi = self._pending.get(ipaddress)
+        if gi is not None:
+            return gi
+        sql = ("SELECT country_code, country_name FROM " + GeoCacheDaoLocal.TABLE_NAME
+               + " WHERE ip = ? AND geo_db_stamp = ?")
+        with self._dba.lock:
+            cursor = self._dba.db.cursor()
+            cursor.execute(sql, (ipaddress, self._stamp))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return PogoGeoInfo.from_country(row[0], row[1])
+
+    """
+        Save a lookup result. Results are kept in memory until
+        flush() is called, since this may be called while another
+        transaction is in progress on the same connection.
+    """
+    def put(self, ipaddress, geo_info):
+        self._pending[ipaddress] = geo_info
+
+    def flush(self):
+        # Swap in a new dict first, so that other threads
+        # can go on adding entries while these are written:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        sql = ("INSERT OR REPLACE INTO " + GeoCacheDaoLocal.TABLE_NAME
+               + " ( ip, country_code, country_name, geo_db_stamp ) VALUES ( ?,?,?,? )")
+        values = [ (ip, gi.country_code, gi.country_name, self._stamp) for (ip, gi) in pending.items() ]
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.executemany(sql, values)
+                cursor.execute('COMMIT')
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
+        return len(values)
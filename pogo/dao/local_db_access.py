@@ -10,14 +10,38 @@ import sqlite3
 import os
 import os.path
 import sys
+import threading
 from pkg_resources import resource_string
 
 class LocalDBAccessor(object):
+    # Performance settings, applied with PRAGMA each time the database
+    # is opened, in this order (page_size has to come before journal_mode,
+    # since it can't be changed once the database is in WAL mode), with the
+    # values each may take. None means any integer.
+    PRAGMAS = ( ('page_size', None),
+                ('journal_mode', ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')),
+                ('synchronous', ('OFF', 'NORMAL', 'FULL', 'EXTRA', '0', '1', '2', '3')),
+                ('cache_size', None),
+                ('mmap_size', None) )
+
+    # Changes to the tables made after pogo_schema.sql was first
+    # released, in the order they must be applied. The database's
+    # user_version is the number of these that have been applied
+    # to it. Only ever add to the end of this list.
+    MIGRATIONS = ( 'data' + os.sep + 'migrations' + os.sep + '001_file_size.sql',
+                   'data' + os.sep + 'migrations' + os.sep + '002_download_contents.sql',
+                   'data' + os.sep + 'migrations' + os.sep + '003_shipping_indexes.sql',
+                   'data' + os.sep + 'migrations' + os.sep + '004_file_offsets.sql' )
+
     def __init__(self, dbconfig):
         if not dbconfig:
             raise ValueError('Must supply db configuration')
         self._dbconfig = dbconfig
         self._db = None
+        # The connection may be shared by several threads (see Pogo.main_concurrent()).
+        # Anything that uses it must hold this lock for the duration of a statement
+        # or transaction, so there is only ever one writer at a time.
+        self.lock = threading.RLock()
         self.initialize_database()
     
     """
@@ -50,35 +74,73 @@ class LocalDBAccessor(object):
             os.makedirs(dbdir)
         # Set up db file and tables:
         self.execute_sql_resource('data' + os.sep + 'pogo_schema.sql')
+        self.migrate()
+
+    """
+        Bring the tables up to date by applying any of MIGRATIONS
+        that haven't been applied yet. Each one is applied in its
+        own transaction, along with the bump of user_version.
+    """
+    def migrate(self):
+        with self.lock:
+            cursor = self.db.cursor()
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for i in range(version, len(LocalDBAccessor.MIGRATIONS)):
+                self.execute_sql_resource(LocalDBAccessor.MIGRATIONS[i],
+                                          'PRAGMA user_version = ' + str(i + 1))
     
     
     """
         Open the named resource, which should be a list
         of sql commands, separated by semicolons. Execute
-        each statement.
+        each statement, then any extra statements given,
+        all in one transaction.
     """
-    def execute_sql_resource(self, resource_name):
+    def execute_sql_resource(self, resource_name, *extra_commands):
         data = resource_string('pogo', resource_name)
         data.replace(os.linesep, '') # strip newlines
         data = data.strip() # and leading/trailing whitespace
         commands = data.split(';') # split on SQL end-of-command marker
-        cursor = self.db.cursor()
-        cursor.execute('BEGIN TRANSACTION')
-        for c in commands:
-            cursor.execute(c)
-        cursor.execute('COMMIT')
+        commands += extra_commands
+        with self.lock:
+            cursor = self.db.cursor()
+            cursor.execute('BEGIN TRANSACTION')
+            try:
+                for c in commands:
+                    cursor.execute(c)
+                cursor.execute('COMMIT')
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
 
     def db_open(self):
         if self._db is None:
             if (self._dbconfig['type'] == 'sqlite'):
-                self._db = sqlite3.connect(self._dbconfig['name'])  # @UndefinedVariable
+                self._db = sqlite3.connect(self._dbconfig['name'], check_same_thread=False)  # @UndefinedVariable
                 self._db.isolation_level = None # Do this to turn off automatic transactions.
+                self.apply_pragmas()
             else:
                 raise ValueError('Unsupported database type')
         return self._db
     
+    """
+        Apply the PRAGMAS settings given in the db configuration.
+        Settings that are missing or blank are left at sqlite's defaults.
+    """
+    def apply_pragmas(self):
+        for (name, allowed) in LocalDBAccessor.PRAGMAS:
+            value = str(self._dbconfig.get(name) or '').strip().strip("'").upper()
+            if not value:
+                continue
+            if allowed is None:
+                value = str(int(value))
+            elif value not in allowed:
+                raise ValueError('Unsupported value for ' + name + ': ' + value)
+            self._db.execute('PRAGMA ' + name + ' = ' + value)
+
     def db_close(self):
-        if self._db is not None:
-            self._db.close()
-            self._db = None
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
     
\ No newline at end of file
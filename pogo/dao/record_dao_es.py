@@ -3,10 +3,15 @@
     the ElasticSearch database on the log server.
 """
 import abc
+import json
 from elasticsearch import Elasticsearch
 
+from pogo.util.metrics import get_metrics
+
 class RecordDaoES(object):
     __metaclass__ = abc.ABCMeta
+    DEFAULT_BULK_DOCS = 500
+    DEFAULT_BULK_BYTES = 5 * 1024 * 1024
     def __init__(self, es_cfg):
         self._make_es_connection(es_cfg)
         self._assure_index()
@@ -16,11 +21,14 @@ class RecordDaoES(object):
         if es_cfg is None:
             raise ValueError("RecordDaoEs needs ElasticSearch Configuration Information")
         else:
-            self._es_index = es_cfg['es_index']
+            self._es_index = self.get_index_name(es_cfg)
             self._es_host = es_cfg['es_host']
             self._es_port = es_cfg['es_port']
             self._es_timeout = es_cfg['es_timeout']
             if not self._es_timeout: self._es_timeout = 30
+            # Limits for a single _bulk request, in documents and in bytes of request body:
+            self.bulk_docs = int(es_cfg.get('es_bulk_docs') or RecordDaoES.DEFAULT_BULK_DOCS)
+            self.bulk_bytes = int(es_cfg.get('es_bulk_bytes') or RecordDaoES.DEFAULT_BULK_BYTES)
 			# needed to work around problems in some versions of urllib3:
             port_num = int(self._es_port)
             timeout_num = float(self._es_timeout)
@@ -52,6 +60,92 @@ class RecordDaoES(object):
         r = self._es_connection.index(index=idx, doc_type=t, body=d)
         return r['_id']
 
+    """
+        Insert records using the Elasticsearch _bulk endpoint. Records
+        are sent in batches of at most bulk_docs documents and (unless a
+        single document is bigger than that) bulk_bytes bytes of request body.
+        Returns a list with one (ok, result) tuple per record, in the same
+        order as records. If ok is True, result is the _id assigned by
+        Elasticsearch; otherwise it's the error reported for that document.
+    """
+    def insert_bulk(self, records):
+        results = []
+        for batch in self._bulk_batches(records):
+            results.extend(self._send_bulk(batch))
+        return results
+
+    """
+        Split records into lists of serialized _bulk request lines,
+        respecting bulk_docs and bulk_bytes.
+    """
+    def _bulk_batches(self, records):
+        plain_action = json.dumps({'index': {}})
+        batch = []
+        batch_docs = 0
+        batch_bytes = 0
+        for record in records:
+            doc_id = self.get_document_id(record)
+            action = plain_action if doc_id is None else json.dumps({'index': {'_id': doc_id}})
+            doc = json.dumps(record.as_dict())
+            doc_bytes = len(action) + len(doc) + 2 # two newlines
+            if batch and (batch_docs >= self.bulk_docs or batch_bytes + doc_bytes > self.bulk_bytes):
+                yield batch
+                batch = []
+                batch_docs = 0
+                batch_bytes = 0
+            batch.append(action)
+            batch.append(doc)
+            batch_docs += 1
+            batch_bytes += doc_bytes
+        if batch:
+            yield batch
+
+    def _send_bulk(self, lines):
+        body = '\n'.join(lines) + '\n'
+        metrics = get_metrics()
+        doc_type = self.get_document_type()
+        with metrics.timer('es_request_seconds', doc_type=doc_type):
+            r = self._es_connection.bulk(body=body, index=self._es_index, doc_type=doc_type)
+        metrics.inc('es_request_bytes_total', len(body), doc_type=doc_type)
+        results = []
+        for item in r['items']:
+            # Each item is a dict with a single key, the name of the action ('index'):
+            res = item.values()[0]
+            if 'error' in res or res.get('status', 200) >= 300:
+                results.append( (False, res.get('error', res.get('status'))) )
+            else:
+                results.append( (True, res['_id']) )
+        failed = sum(1 for (ok, result) in results if not ok)
+        metrics.inc('es_docs_total', len(results) - failed, doc_type=doc_type)
+        if failed:
+            metrics.inc('es_docs_failed_total', failed, doc_type=doc_type)
+        return results
+
+    """
+        Of the given document _ids, return the set of those
+        that are already in this dao's index and type.
+    """
+    def existing_ids(self, ids):
+        if not ids:
+            return set()
+        r = self._es_connection.mget(body={'ids': list(ids)}, index=self._es_index,
+                                     doc_type=self.get_document_type(), _source='false')
+        return set( d['_id'] for d in r['docs'] if d.get('found') )
+
+    """
+        The index this dao's documents go into.
+    """
+    def get_index_name(self, es_cfg):
+        return es_cfg['es_index']
+
+    """
+        The _id to give a record's document, or None to let
+        Elasticsearch assign one. Records that already have an es_id
+        (given them in direct mode) are sent with it.
+    """
+    def get_document_id(self, record):
+        return record.es_id or None
+
     abc.abstractmethod
     def get_document_type(self):
         return ''
@@ -134,7 +228,8 @@ class SessionRecordingDaoES(RecordDaoES):
        "country_name": { "type": "string", "index" : "not_analyzed" },
        "country_code": { "type": "string", "index" : "not_analyzed" },
        "filename": {"type": "string", "index": "not_analyzed"},
-       "contents": {"type": "string", "index": "no"}
+       "contents": {"type": "string", "index": "no"},
+       "file_size": {"type": "long"}
        }
 
     def __init__(self, es_cfg):
@@ -156,7 +251,9 @@ class SessionDownloadDaoES(RecordDaoES):
        "country_name": { "type": "string", "index" : "not_analyzed" },
        "country_code": { "type": "string", "index" : "not_analyzed" },
        "filename": {"type": "string", "index": "not_analyzed"},
-       "contents": {"type": "string", "index": "no"}
+       "contents": {"type": "string", "index": "no"},
+       "file_size": {"type": "long"},
+       "sha256": {"type": "string", "index": "not_analyzed"}
        }
 
     def __init__(self, es_cfg):
@@ -169,5 +266,33 @@ class SessionDownloadDaoES(RecordDaoES):
         return SessionDownloadDaoES.MAPPING
 
 
+"""
+    The contents of downloaded files, one document per distinct file,
+    with the file's SHA-256 hash as the document's _id. Download documents
+    refer to these by their sha256 field. They're kept in an index of
+    their own (es_content_index), so that searches of the main index
+    don't have to wade through them.
+"""
+class DownloadContentDaoES(RecordDaoES):
+    DOCUMENT_TYPE = 'HonSSH_DownloadContent'
+    MAPPING = {
+       "bifrozt_host": {  "type": "string", "index": "not_analyzed" },
+       "sha256": {"type": "string", "index": "not_analyzed"},
+       "file_size": {"type": "long"},
+       "contents": {"type": "string", "index": "no"}
+       }
+
+    def __init__(self, es_cfg):
+        super(DownloadContentDaoES, self).__init__(es_cfg)
+
+    def get_index_name(self, es_cfg):
+        return es_cfg.get('es_content_index') or es_cfg['es_index'] + '_contents'
+
+    def get_document_id(self, record):
+        return record.sha256
 
+    def get_document_type(self):
+        return DownloadContentDaoES.DOCUMENT_TYPE
 
+    def get_mapping(self):
+        return DownloadContentDaoES.MAPPING
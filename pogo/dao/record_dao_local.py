@@ -1,14 +1,22 @@
 import abc
+import itertools
 import sqlite3
 
 import os
 import os.path
 import sys
+import time
 from pogo.dao.local_db_access import LocalDBAccessor
+from pogo.dao.download_content_dao_local import DownloadContentDaoLocal
 from pogo.util.config import StretchConfig
+from pogo.util.metrics import get_metrics
 
 class RecordDaoLocal(object):
     __metaclass__ = abc.ABCMeta
+    # Records written at a time by insert_bulk() when it's
+    # putting them all in one transaction:
+    INSERT_CHUNK_SIZE = 1000
+
     def __init__(self, localdbaccessor):
         if not localdbaccessor:
             raise ValueError("RecordDaoLocal object needs a LocalDBAccessor.")
@@ -22,6 +30,9 @@ class RecordDaoLocal(object):
         "INSERT INTO attempts ( timestamp, bifrozt_host, source_ip ) VALUES ( ?,?,? )"
     """    
     def build_insert_query(self):
+        sql = self.__class__.__dict__.get('_insert_query')
+        if sql is not None:
+            return sql
         table_name = self.get_table_name()
         insert_fields = self.get_insert_fields()
         sql = "INSERT INTO " + table_name + " ( "
@@ -30,6 +41,8 @@ class RecordDaoLocal(object):
         if sql.endswith(','):
             sql = sql.rstrip(',')
         sql += " )"
+        # The query is the same for every object of the class; build it once.
+        self.__class__._insert_query = sql
         return sql
     
     """
@@ -50,39 +63,104 @@ class RecordDaoLocal(object):
     def insert_single(self, record ):
         sql = self.build_insert_query()
         values_list = self.build_values_list(record)
-        try:
-#             self.db_open()
-            cursor = self._dba.db.cursor()
-            cursor.execute('BEGIN TRANSACTION')
-            cursor.execute(sql, values_list )
-            cursor.execute('COMMIT')
-        except sqlite3.Error as e:  # @UndefinedVariable
-            cursor.execute('ROLLBACK')
-            raise e
+        with self._dba.lock:
+            try:
+#                 self.db_open()
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.execute(sql, values_list )
+                cursor.execute('COMMIT')
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
         
     """
-        records should be a tuple of dto records, all of
+        records should be an iterable of dto records, all of
         the type appropriate for this record_dao_local object.
         That is, if this is an AttemptRecordDaoLocal, all
-        the records should be instances of AttemptRecord
+        the records should be instances of AttemptRecord.
+        records may be a generator; it's consumed one record
+        at a time. If commit_every is given, the records are
+        written in transactions of commit_every records, so that a
+        long stream of records doesn't build up one huge transaction.
+        Each chunk of records is read before the database lock is
+        taken, so other threads can use the database while a
+        generator is reading a file. Without commit_every, all the
+        records go into one transaction, still INSERT_CHUNK_SIZE at a
+        time, and the lock is held while the generator reads.
+        If on_commit is given, it's called as
+        on_commit(cursor, count_of_written, finished) inside each
+        chunk's transaction, just before the commit, so that the caller
+        can record its progress atomically with the records themselves.
+        finished is True for the last transaction, which may contain
+        no records at all.
     """
-    def insert_bulk(self, records):
+    def insert_bulk(self, records, commit_every=None, on_commit=None):
         sql = self.build_insert_query()
+        records = iter(records)
+        if not commit_every:
+            return self.write_transaction(sql, self.iter_chunks(records, RecordDaoLocal.INSERT_CHUNK_SIZE),
+                                          0, True, on_commit)
         count_of_written = 0
-        try:
-            cursor = self._dba.db.cursor()
-            cursor.execute('BEGIN TRANSACTION')
-            for r in records:
-                values_list = self.build_values_list(r)
-                cursor.execute(sql, values_list)
-                count_of_written+=1
-            cursor.execute('COMMIT')
-            return count_of_written
-        except sqlite3.Error as e:  # @UndefinedVariable
-            cursor.execute('ROLLBACK')
-            raise e
+        while True:
+            chunk = [ self.build_values_list(r) for r in itertools.islice(records, commit_every) ]
+            finished = len(chunk) < commit_every
+            if not chunk and on_commit is None:
+                break
+            count_of_written += self.write_transaction(sql, [chunk], count_of_written, finished, on_commit)
+            if finished:
+                break
+        return count_of_written
+
+    """
+        Generate the values lists of records, size records at a time.
+    """
+    def iter_chunks(self, records, size):
+        while True:
+            chunk = [ self.build_values_list(r) for r in itertools.islice(records, size) ]
+            if not chunk:
+                return
+            yield chunk
+
+    """
+        Write each of chunks, as insert_chunk() does, in a single
+        transaction, calling on_commit (if given) before the commit
+        as insert_bulk() describes. count_before is the number of
+        records insert_bulk() has already written. Returns the number
+        of records written.
+    """
+    def write_transaction(self, sql, chunks, count_before, finished, on_commit):
+        metrics = get_metrics()
+        count = 0
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                started = time.time()
+                for chunk in chunks:
+                    self.insert_chunk(cursor, sql, chunk)
+                    count += len(chunk)
+                if on_commit is not None:
+                    on_commit(cursor, count_before + count, finished)
+                inserted = time.time()
+                cursor.execute('COMMIT')
+            except Exception:
+                # Not only sqlite3.Error: reading the records can fail too,
+                # and the transaction mustn't be left open on the shared connection.
+                cursor.execute('ROLLBACK')
+                raise
+        metrics.observe('sqlite_insert_seconds', inserted - started, table=self.get_table_name())
+        metrics.observe('sqlite_commit_seconds', time.time() - inserted, table=self.get_table_name())
+        return count
+
+    """
+        Write one chunk of insert_bulk()'s records, as lists of
+        values from build_values_list(), inside the transaction
+        that cursor has open.
+    """
+    def insert_chunk(self, cursor, sql, chunk):
+        cursor.executemany(sql, chunk)
 
-    
     def list_all(self):
         return self.list_where(None)
         
@@ -90,9 +168,45 @@ class RecordDaoLocal(object):
         sql = "SELECT " + self.get_all_fields() + " FROM " + self.get_table_name()
         if where_clause:
             sql += " WHERE " + where_clause
-        cursor = self._dba.db.cursor()
-        cursor.execute(sql)
-        return cursor.fetchall()
+        with self._dba.lock:
+            cursor = self._dba.db.cursor()
+            cursor.execute(sql)
+            return cursor.fetchall()
+
+    """
+        Generate the rows matching where_clause as lists of at most
+        batch_size rows, in db_id order. Each batch is read with its own
+        query, starting after the last db_id of the one before, so only
+        one batch is ever held in memory, and the database isn't locked
+        while the caller works on a batch. The first column of
+        get_all_fields() must be db_id.
+    """
+    def iter_where(self, where_clause=None, batch_size=500):
+        sql = "SELECT " + self.get_all_fields() + " FROM " + self.get_table_name() + " WHERE db_id > ?"
+        if where_clause:
+            sql += " AND " + where_clause
+        sql += " ORDER BY db_id LIMIT ?"
+        last_id = -1
+        while True:
+            with self._dba.lock:
+                cursor = self._dba.db.cursor()
+                cursor.execute(sql, (last_id, batch_size))
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def count_where(self, where_clause=None):
+        sql = "SELECT COUNT(*) FROM " + self.get_table_name()
+        if where_clause:
+            sql += " WHERE " + where_clause
+        with self._dba.lock:
+            cursor = self._dba.db.cursor()
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
     
     """
         Meant to be used as follows:
@@ -114,31 +228,52 @@ class RecordDaoLocal(object):
                 sql = sql.rstrip(',')
         if where_clause is not None:
             sql += " WHERE " + where_clause
-        try:
-            cursor = self._dba.db.cursor()
-            cursor.execute('BEGIN TRANSACTION')
-            cursor.execute(sql, new_values)
-            cursor.execute('COMMIT')
-        except sqlite3.Error as e:  # @UndefinedVariable
-            cursor.execute('ROLLBACK')
-            raise e
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.execute(sql, new_values)
+                cursor.execute('COMMIT')
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
         
+    """
+        Record the Elasticsearch ids of many rows at once, in a single
+        transaction. es_ids is a list of (db_id, es_id) pairs.
+        Returns the number of rows updated.
+    """
+    def update_es_ids(self, es_ids):
+        sql = "UPDATE " + self.get_table_name() + " SET es_id = ? WHERE db_id = ?"
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.executemany(sql, [ (es_id, db_id) for (db_id, es_id) in es_ids ])
+                count_updated = cursor.rowcount
+                cursor.execute('COMMIT')
+                return count_updated
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
+
     def delete_where(self, where_clause):
         if not where_clause:
             raise ValueError("RecordDaoLocal.delete_where() called without where clause.")
         table_name = self.get_table_name()
         sql = "DELETE FROM " + table_name + " WHERE " + where_clause
         count_deleted = 0
-        try:
-            cursor = self._dba.db.cursor()
-            cursor.execute('BEGIN TRANSACTION')
-            cursor.execute(sql)
-            count_deleted = cursor.rowcount
-            cursor.execute('COMMIT')
-            return count_deleted # should be the number of rows changed
-        except sqlite3.Error as e:  # @UndefinedVariable
-            cursor.execute('ROLLBACK')
-            raise e
+        with self._dba.lock:
+            try:
+                cursor = self._dba.db.cursor()
+                cursor.execute('BEGIN TRANSACTION')
+                cursor.execute(sql)
+                count_deleted = cursor.rowcount
+                cursor.execute('COMMIT')
+                return count_deleted # should be the number of rows changed
+            except sqlite3.Error as e:  # @UndefinedVariable
+                cursor.execute('ROLLBACK')
+                raise e
 
 
              
@@ -211,9 +346,9 @@ class SessionLogDaoLocal(RecordDaoLocal):
 
 class SessionRecordingDaoLocal(RecordDaoLocal):
     TABLE_NAME = 'session_recordings'
-    ALL_FIELDS = ALL_FIELDS = "db_id, es_id, timestamp, bifrozt_host, source_ip, country_code, country_name, filename, contents"
+    ALL_FIELDS = ALL_FIELDS = "db_id, es_id, timestamp, bifrozt_host, source_ip, country_code, country_name, filename, contents, file_size"
     INSERT_FIELDS = ( 'timestamp',  'bifrozt_host',
-                       'source_ip', 'country_code', 'country_name', 'filename', 'contents' )
+                       'source_ip', 'country_code', 'country_name', 'filename', 'contents', 'file_size' )
         
     def __init__(self, localdbaccessor):
         super(SessionRecordingDaoLocal,self).__init__(localdbaccessor)
@@ -230,12 +365,30 @@ class SessionRecordingDaoLocal(RecordDaoLocal):
 
 class SessionDownloadDaoLocal(RecordDaoLocal):
     TABLE_NAME = 'session_downloads'
-    ALL_FIELDS = ALL_FIELDS = "db_id, es_id, timestamp, bifrozt_host, source_ip, country_code, country_name, filename, contents"
+    ALL_FIELDS = ALL_FIELDS = "db_id, es_id, timestamp, bifrozt_host, source_ip, country_code, country_name, filename, contents, file_size, sha256"
     INSERT_FIELDS = ( 'timestamp',  'bifrozt_host',
-                       'source_ip', 'country_code', 'country_name', 'filename', 'contents' )
+                       'source_ip', 'country_code', 'country_name', 'filename', 'contents', 'file_size', 'sha256' )
         
     def __init__(self, localdbaccessor):
         super(SessionDownloadDaoLocal,self).__init__(localdbaccessor)
+
+    """
+        The contents of a download with a hash are stored once, in the
+        download_contents table; the download's own row keeps just
+        the hash. Files too big to have had their contents read
+        (see max_blob_size) aren't put in download_contents, so that
+        a later run with a bigger max_blob_size can still store them.
+    """
+    def insert_chunk(self, cursor, sql, chunk):
+        i_contents = SessionDownloadDaoLocal.INSERT_FIELDS.index('contents')
+        i_size = SessionDownloadDaoLocal.INSERT_FIELDS.index('file_size')
+        i_sha256 = SessionDownloadDaoLocal.INSERT_FIELDS.index('sha256')
+        for values_list in chunk:
+            if values_list[i_sha256] and (values_list[i_contents] or not values_list[i_size]):
+                DownloadContentDaoLocal.store(cursor, values_list[i_sha256],
+                                              values_list[i_size], values_list[i_contents])
+                values_list[i_contents] = ''
+        super(SessionDownloadDaoLocal, self).insert_chunk(cursor, sql, chunk)
         
     def get_table_name(self):
         return SessionDownloadDaoLocal.TABLE_NAME
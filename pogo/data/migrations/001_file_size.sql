@@ -0,0 +1,3 @@
+ALTER TABLE session_downloads ADD COLUMN file_size INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE session_recordings ADD COLUMN file_size INTEGER NOT NULL DEFAULT 0
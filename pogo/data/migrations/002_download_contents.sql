@@ -0,0 +1,5 @@
+ALTER TABLE session_downloads ADD COLUMN sha256 TEXT NOT NULL DEFAULT '';
+
+CREATE TABLE IF NOT EXISTS download_contents (sha256 TEXT PRIMARY KEY,
+	file_size INTEGER NOT NULL DEFAULT 0, contents TEXT,
+	es_shipped INTEGER NOT NULL DEFAULT 0 )
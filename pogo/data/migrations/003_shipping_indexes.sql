@@ -0,0 +1,21 @@
+CREATE INDEX IF NOT EXISTS attempts_pending ON attempts (db_id) WHERE es_id = '';
+
+CREATE INDEX IF NOT EXISTS attempts_shipped ON attempts (db_id) WHERE es_id != '';
+
+CREATE INDEX IF NOT EXISTS log_msg_pending ON log_msg (db_id) WHERE es_id = '';
+
+CREATE INDEX IF NOT EXISTS log_msg_shipped ON log_msg (db_id) WHERE es_id != '';
+
+CREATE INDEX IF NOT EXISTS session_downloads_pending ON session_downloads (db_id) WHERE es_id = '';
+
+CREATE INDEX IF NOT EXISTS session_downloads_shipped ON session_downloads (db_id) WHERE es_id != '';
+
+CREATE INDEX IF NOT EXISTS session_recordings_pending ON session_recordings (db_id) WHERE es_id = '';
+
+CREATE INDEX IF NOT EXISTS session_recordings_shipped ON session_recordings (db_id) WHERE es_id != '';
+
+CREATE INDEX IF NOT EXISTS session_log_records_pending ON session_log_records (db_id) WHERE es_id = '';
+
+CREATE INDEX IF NOT EXISTS session_log_records_shipped ON session_log_records (db_id) WHERE es_id != '';
+
+CREATE INDEX IF NOT EXISTS download_contents_pending ON download_contents (sha256) WHERE es_shipped = 0
@@ -0,0 +1 @@
+ALTER TABLE file_state ADD COLUMN byte_offset INTEGER NOT NULL DEFAULT 0
@@ -20,5 +20,11 @@ CREATE TABLE IF NOT EXISTS session_recordings (db_id  INTEGER PRIMARY KEY AUTOIN
 CREATE TABLE IF NOT EXISTS session_log_records (db_id  INTEGER PRIMARY KEY AUTOINCREMENT,
 	 es_id TEXT NOT NULL DEFAULT '', timestamp INTEGER, bifrozt_host TEXT, source_ip TEXT, country_code TEXT, country_name TEXT, channel TEXT, message TEXT );
 
+CREATE TABLE IF NOT EXISTS geo_cache (ip TEXT PRIMARY KEY,
+	country_code TEXT, country_name TEXT, geo_db_stamp TEXT NOT NULL );
 
+CREATE TABLE IF NOT EXISTS file_state (path TEXT PRIMARY KEY, file_type TEXT NOT NULL,
+	inode INTEGER, size INTEGER, mtime REAL,
+	records_done INTEGER NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0 );
 
+CREATE INDEX IF NOT EXISTS file_state_type ON file_state (file_type);
@@ -9,25 +9,68 @@ import abc
 from pogo.util.util import local_timestamp_to_gmt, local_no_tz_to_utc, get_geo_info
 
 from socket import gethostname
+
+# The host name is the same for every record, so look it up only once:
+_HOSTNAME = gethostname()
+
+# Strings that are repeated across huge numbers of records,
+# like country names, are stored once and shared. The
+# builtin intern() only handles str, not unicode, hence this.
+_interned = {}
+def intern_string(s):
+    return _interned.setdefault(s, s)
+
+_MISSING = object()
+
+"""
+    Records use __slots__ rather than a per-instance __dict__, since
+    a single HonSSH file can turn into millions of them. Each class
+    lists only the fields it adds to its parent's.
+"""
 class Record(object):
+    __slots__ = ( 'bifrozt_host', 'db_id', 'es_id' )
+
     def __init__(self):
         __metaclass__ = abc.ABCMeta
-        self.bifrozt_host = gethostname()
+        self.bifrozt_host = _HOSTNAME
         self.db_id = ''
         self.es_id = ''
     @abc.abstractmethod    
     def as_dict(self):
         raise Exception('Abstract methods should not be called.')
     
+    """
+        Names of all the fields of this record's class,
+        including those inherited from parent classes.
+    """
+    @classmethod
+    def field_names(cls):
+        names = cls.__dict__.get('_field_names')
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                names.extend(klass.__dict__.get('__slots__', ()))
+            names = tuple(names)
+            cls._field_names = names
+        return names
+
     # Comparison operator method
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Record) or self.field_names() != other.field_names():
+            return False
+        for name in self.field_names():
+            if getattr(self, name, _MISSING) != getattr(other, name, _MISSING):
+                return False
+        return True
     
     def __ne__(self, other):
         return not (self == other)
     # end of base class
     
 class AttemptRecord(Record):
+    __slots__ = ( '_field_sep', 'timestamp', 'source_ip', 'user', 'password',
+                  'success', 'country_code', 'country_name' )
+
     def __init__(self, log_line=None, field_sep=None):
         super( AttemptRecord, self ).__init__()
         
@@ -70,8 +113,8 @@ class AttemptRecord(Record):
             self.password = self._field_sep.join(u_list[3:])
 
             gpi = get_geo_info(self.source_ip)
-            self.country_code = gpi.country_code
-            self.country_name = gpi.country_name
+            self.country_code = intern_string(gpi.country_code)
+            self.country_name = intern_string(gpi.country_name)
         else:
             # initialize fields to empty strings or null values:
             self.timestamp = ''
@@ -101,6 +144,8 @@ class AttemptRecord(Record):
     # end of AttemptRecord class  
     
 class LogRecord(Record):
+    __slots__ = ( 'timestamp', 'server_info', 'message' )
+
     def __init__(self, log_line = None):
         super( LogRecord, self ).__init__()
         if log_line is not None:
@@ -132,6 +177,8 @@ class LogRecord(Record):
 
 
 class SessionRecord(Record):
+    __slots__ = ( 'timestamp', 'source_ip', 'country_code', 'country_name' )
+
     def __init__(self):
         super( SessionRecord, self ).__init__()
 
@@ -154,11 +201,11 @@ class SessionRecord(Record):
     
     def set_country_info(self, code, name):
         if code:
-            self.country_code = code
+            self.country_code = intern_string(code)
         else:
             self.country_code = ''
         if name:
-            self.country_name = name
+            self.country_name = intern_string(name)
         else:
             self.country_name = ''
             
@@ -170,6 +217,8 @@ class SessionRecord(Record):
         
 
 class SessionLogRecord(SessionRecord):
+    __slots__ = ( 'channel', 'message' )
+
     def __init__(self, line = None):
         super( SessionLogRecord, self ).__init__()
         if line :
@@ -179,7 +228,7 @@ class SessionLogRecord(SessionRecord):
                 lb_ind = line.index('[')
                 rb_ind = line.index(']')
                 chan = line[lb_ind+1:rb_ind] # channel
-                self.channel = chan.strip()
+                self.channel = intern_string(chan.strip())
                 # Now take everything after the last ']':
                 self.message = line[rb_ind+1:] # rest of the line
             else:
@@ -204,10 +253,15 @@ class SessionLogRecord(SessionRecord):
 
 
 class SessionRecordingRecord(SessionRecord):
-    def __init__(self, filename=None, contents=None):
+    __slots__ = ( 'filename', 'contents', 'file_size' )
+
+    def __init__(self, filename=None, contents=None, file_size=0):
         super( SessionRecordingRecord, self ).__init__()
         self.set_contents(contents)
         self.set_filename(filename)
+        # Size of the file on disk. When contents is empty but file_size
+        # isn't 0, the file was too big to store (see max_blob_size).
+        self.file_size = file_size
             
     def set_filename(self, name):
         if name is not None:
@@ -226,13 +280,22 @@ class SessionRecordingRecord(SessionRecord):
         adict = super(SessionRecordingRecord,self).as_dict()
         adict['filename'] = self.filename
         adict['contents'] = self.contents
+        adict['file_size'] = self.file_size
         return adict   
 
 class SessionDownloadFileRecord(SessionRecord):
-    def __init__(self, fname=None, contents=None):
+    __slots__ = ( 'filename', 'contents', 'file_size', 'sha256' )
+
+    def __init__(self, fname=None, contents=None, file_size=0):
         super( SessionDownloadFileRecord, self ).__init__()
         self.set_contents(contents)
         self.set_filename(fname)
+        # Size of the file on disk. When contents is empty but file_size
+        # isn't 0, the file was too big to store (see max_blob_size).
+        self.file_size = file_size
+        # SHA-256 hash of the file. If set, the contents are stored once
+        # per hash, apart from the download records (see DownloadContentRecord).
+        self.sha256 = ''
             
     def set_filename(self, name):
         if name is not None:
@@ -251,9 +314,33 @@ class SessionDownloadFileRecord(SessionRecord):
         adict = super(SessionDownloadFileRecord,self).as_dict()
         adict['filename'] = self.filename
         adict['contents'] = self.contents
+        adict['file_size'] = self.file_size
+        adict['sha256'] = self.sha256
         return adict   
 
 
+"""
+    The contents of a downloaded file, shared by all the
+    downloads of that same file. Identified by its SHA-256 hash.
+"""
+class DownloadContentRecord(Record):
+    __slots__ = ( 'sha256', 'file_size', 'contents' )
+
+    def __init__(self, sha256='', file_size=0, contents=''):
+        super( DownloadContentRecord, self ).__init__()
+        self.sha256 = sha256
+        self.file_size = file_size
+        self.contents = contents or ''
+
+    def as_dict(self):
+        adict = {}
+        adict['bifrozt_host'] = self.bifrozt_host
+        adict['sha256'] = self.sha256
+        adict['file_size'] = self.file_size
+        adict['contents'] = self.contents
+        return adict
+
+
 
 
 """
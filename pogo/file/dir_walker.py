@@ -0,0 +1,163 @@
+"""
+    DirectoryWalker lists the directories HonSSH writes to, using
+    scandir() so that the file type of each entry comes from the
+    directory listing itself rather than from a separate stat() call.
+    Listings and stat results are cached, so walking the same directory
+    twice, or asking about the same file twice, costs nothing extra.
+
+    scandir() is in the os module from Python 3.5 on; for Python 2,
+    install the scandir package from PyPI. Without it, a slower
+    version based on os.listdir() and os.lstat() is used.
+"""
+import os
+import os.path
+import stat
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+"""
+    Stand-in for scandir's DirEntry, used when scandir isn't
+    available. Gets the file type with lstat(), once.
+"""
+class ListdirEntry(object):
+    __slots__ = ( 'name', 'path', '_lstat', '_stat' )
+
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self._lstat = None
+        self._stat = None
+
+    def stat(self, follow_symlinks=True):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        if not follow_symlinks or not stat.S_ISLNK(self._lstat.st_mode):
+            return self._lstat
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def inode(self):
+        return self.stat(follow_symlinks=False).st_ino
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+    def _is_type(self, test, follow_symlinks):
+        try:
+            return test(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False # e.g. a dangling symlink
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_type(stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self._is_type(stat.S_ISREG, follow_symlinks)
+
+
+def listdir_scandir(path):
+    return [ ListdirEntry(path, name) for name in os.listdir(path) ]
+
+
+"""
+    entry_stats says whether stat() may use the stat result a
+    directory entry already has; without it, every file is stat'ed
+    afresh, for when the entries come from an earlier walk.
+"""
+class DirectoryWalker(object):
+    def __init__(self, entry_stats=True):
+        self._entry_stats = entry_stats
+        self._listings = {}
+        self._stats = {}
+        self.dirs_scanned = 0
+        self.entries_scanned = 0
+        self.stats_done = 0
+
+    """
+        Return the entries of directory path, as a list of
+        scandir DirEntry (or equivalent) objects. Each directory
+        is only read once.
+    """
+    def entries(self, path):
+        listing = self._listings.get(path)
+        if listing is None:
+            if scandir is not None:
+                listing = list(scandir(path))
+            else:
+                listing = listdir_scandir(path)
+            self._listings[path] = listing
+            self.dirs_scanned += 1
+            self.entries_scanned += len(listing)
+        return listing
+
+    """
+        Forget everything, so that the next walk sees any changes.
+    """
+    def clear(self):
+        self._listings = {}
+        self._stats = {}
+
+    def subdirectories(self, path):
+        return [ e.path for e in self.entries(path) if e.is_dir() ]
+
+    """
+        path and all directories below it, like os.walk(): symlinks
+        to directories are not followed.
+    """
+    def walk(self, top):
+        dirlist = [top]
+        i = 0
+        while i < len(dirlist):
+            dirlist += [ e.path for e in self.entries(dirlist[i]) if e.is_dir(follow_symlinks=False) ]
+            i += 1
+        return dirlist
+
+    """
+        The per-source-ip session directories under source_dir:
+            SINGLE:   source_dir/source ip/
+            MULTI:    source_dir/workstation name/source ip/
+        If subdir is given (for instance 'downloads'), return
+        that subdirectory of each source ip directory instead,
+        for the ones that have it.
+    """
+    def session_directories(self, source_dir, honssh_type, subdir=None):
+        if honssh_type == 'SINGLE':
+            ip_dirs = self.subdirectories(source_dir)
+        else:
+            ip_dirs = []
+            for w in self.subdirectories(source_dir):
+                ip_dirs += self.subdirectories(w)
+        if subdir is None:
+            return ip_dirs
+        dirs = []
+        for d in ip_dirs:
+            for e in self.entries(d):
+                if e.name == subdir and e.is_dir():
+                    dirs.append(e.path)
+        return dirs
+
+    """
+        stat() an entry, following symlinks, or an arbitrary path.
+        Results are cached.
+    """
+    def stat(self, entry_or_path):
+        if isinstance(entry_or_path, basestring):
+            path = entry_or_path
+            entry = None
+        else:
+            path = entry_or_path.path
+            entry = entry_or_path
+        st = self._stats.get(path)
+        if st is None:
+            st = entry.stat() if entry is not None and self._entry_stats else os.stat(path)
+            self._stats[path] = st
+            self.stats_done += 1
+        return st
@@ -0,0 +1,175 @@
+"""
+    Watches HonSSH's directories for new and changed files, for
+    pogo's daemon mode.
+    Uses inotify, through the optional pyinotify package, if it's
+    installed; otherwise the directories are polled every poll_interval
+    seconds. Polling only re-reads directories whose modification time
+    has changed, which shows files being created, but not files being
+    added to; so the only files that are stat'ed are those directly in
+    the appended_dirs, where HonSSH adds to files all day.
+"""
+import logging
+import os
+import os.path
+import time
+
+from pogo.file.dir_walker import DirectoryWalker
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+if pyinotify is not None:
+    class _PathCollector(pyinotify.ProcessEvent):
+        def my_init(self, paths=None, closed=None):
+            self.paths = paths
+            self.closed = closed
+
+        def process_default(self, event):
+            # Files going away (pogo deleting the ones it's done with,
+            # for a start) are no reason to run again:
+            if event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+                self.closed.discard(event.pathname)
+                return
+            self.paths.add(event.pathname)
+            if event.mask & (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO):
+                self.closed.add(event.pathname)
+            else:
+                self.closed.discard(event.pathname)
+
+
+class DirectoryWatcher(object):
+    DEFAULT_POLL_INTERVAL = 10
+
+    if pyinotify is not None:
+        INOTIFY_MASK = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+                        | pyinotify.IN_CREATE | pyinotify.IN_MODIFY
+                        | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM)
+
+    """
+        dirs is a list of directories to watch, along with
+        all their subdirectories. Duplicates are ignored, as are
+        any that don't exist. appended_dirs are those of dirs whose
+        files are added to, rather than written once; when polling,
+        the files directly in them are stat'ed each time to see if
+        they've grown.
+    """
+    def __init__(self, dirs, poll_interval=None, use_inotify=True, appended_dirs=()):
+        self._dirs = sorted(set(os.path.abspath(d) for d in dirs if os.path.isdir(d)))
+        self._appended_dirs = set(os.path.abspath(d) for d in appended_dirs)
+        self.poll_interval = float(poll_interval or DirectoryWatcher.DEFAULT_POLL_INTERVAL)
+        self._paths = set()
+        self._closed = set()
+        self._notifier = None
+        # When polling: each directory's mtime, when it was last read,
+        # and the subdirectories and files found then, and the
+        # (size, mtime) of each file in the appended_dirs.
+        self._dir_mtimes = {}
+        self._listings = {}
+        self._file_stats = {}
+        self.dirs_read = 0
+        if use_inotify and pyinotify is not None:
+            self._watch_manager = pyinotify.WatchManager()
+            self._notifier = pyinotify.Notifier(self._watch_manager,
+                                                _PathCollector(paths=self._paths, closed=self._closed), timeout=0)
+            for d in self._dirs:
+                self._watch_manager.add_watch(d, DirectoryWatcher.INOTIFY_MASK, rec=True, auto_add=True)
+            logging.info("Watching %s with inotify", ', '.join(self._dirs))
+        else:
+            self.poll()
+            logging.warning("pyinotify isn't installed; polling %s every %s seconds instead. Session files "
+                            "are only processed the day after they were written.",
+                            ', '.join(self._dirs), self.poll_interval)
+
+    def uses_inotify(self):
+        return self._notifier is not None
+
+    """
+        The files that have been closed after being written (or moved
+        into place) and haven't been written to since, as far as
+        inotify can tell. Always empty without inotify.
+    """
+    def closed_files(self):
+        return frozenset(self._closed)
+
+    """
+        Look over the watched directories once, and return the set of
+        paths of files that have appeared, or (in the appended_dirs)
+        changed, since the last time. Only the directories whose mtime
+        has changed are read again. A directory modified within a second
+        of being read is read again next time too, in case its mtime
+        is too coarse to show a change made just after.
+    """
+    def poll(self):
+        changed = set()
+        first_poll = not self._listings
+        walker = DirectoryWalker()
+        dir_mtimes = {}
+        listings = {}
+        file_stats = {}
+        stack = list(self._dirs)
+        while stack:
+            d = stack.pop()
+            if d in dir_mtimes:
+                continue
+            try:
+                mtime = os.stat(d).st_mtime
+            except OSError:
+                continue
+            listing = self._listings.get(d)
+            if listing is None or self._dir_mtimes.get(d) != mtime or mtime >= listing[0] - 1:
+                try:
+                    entries = walker.entries(d)
+                except OSError:
+                    continue
+                self.dirs_read += 1
+                listing = (time.time(), [ e.path for e in entries if e.is_dir(follow_symlinks=False) ],
+                           frozenset(e.path for e in entries if not e.is_dir(follow_symlinks=False)))
+                if not first_poll:
+                    changed |= listing[2] - (self._listings[d][2] if d in self._listings else frozenset())
+            dir_mtimes[d] = mtime
+            listings[d] = listing
+            stack.extend(listing[1])
+            if d in self._appended_dirs:
+                for path in listing[2]:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    file_stats[path] = (st.st_size, st.st_mtime)
+                    if path in self._file_stats and self._file_stats[path] != file_stats[path]:
+                        changed.add(path)
+        self._dir_mtimes = dir_mtimes
+        self._listings = listings
+        self._file_stats = file_stats
+        return changed
+
+    """
+        Wait up to timeout seconds for files to be created or changed.
+        Returns the set of paths seen to change, which is empty if
+        nothing changed in that time.
+    """
+    def wait(self, timeout):
+        if self._notifier is not None:
+            if self._notifier.check_events(int(timeout * 1000)):
+                self._notifier.read_events()
+                self._notifier.process_events()
+            changed = set(self._paths)
+            self._paths.clear()
+            return changed
+        changed = set()
+        deadline = time.time() + timeout
+        while not changed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, self.poll_interval))
+            changed = self.poll()
+        return changed
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
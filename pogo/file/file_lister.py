@@ -1,11 +1,16 @@
 
 import abc
+import logging
 import os
 import os.path
 import re
 import datetime
+import itertools
+import stat
+import threading
 import time
 
+from pogo.file.dir_walker import DirectoryWalker
 from pogo.file.stretch_file import AttemptFile, LogFile
 from pogo.file.stretch_file import  SessionLogFile, SessionDownloadFile, SessionRecordingFile
 
@@ -21,6 +26,16 @@ class FileLister(object):
 
     DONE_EXTENSION = '.DONE'
 
+    # Does HonSSH keep adding to this type of file during the day? Files
+    # of such a type are read as they grow, and remember the offset they
+    # were read up to; see iter_new_records().
+    GROWING_FILES = False
+
+    # Does each record of this type of file come from its own line, so
+    # that if the file is added to after it's been read, the records
+    # already saved are still the first ones in it?
+    APPENDED_RECORDS = False
+
     # Some static methods
     @staticmethod
     def done_name(stretch_file_name):
@@ -41,6 +56,11 @@ class FileLister(object):
         # Is there another file with the same name as this one, minus DONE_EXTENSION?
         return os.path.isfile(name[0:len(name) - len(FileLister.DONE_EXTENSION)]) and name.endswith(FileLister.DONE_EXTENSION)
 
+    """
+        Mark a file as done by creating a .DONE marker file. This is
+        only used when the lister has no FileStateDaoLocal; otherwise
+        the file state table is updated by record_progress() instead.
+    """
     @staticmethod
     def mark_as_done(stretch_file_object):
         # open().close() is equivalent of 'touch' - creates
@@ -48,27 +68,62 @@ class FileLister(object):
         fname = FileLister.done_name(stretch_file_object.name())
         open(fname, 'a').close()
 
+    """
+        A file's state matches a stat result if it's
+        still the same file, unchanged since it was scraped.
+    """
+    @staticmethod
+    def state_matches(state, file_stat):
+        return (state.inode == file_stat.st_ino and state.size == file_stat.st_size
+                and state.mtime == file_stat.st_mtime)
 
 
-    def __init__(self, source_dir, honssh_type):
+    """
+        file_state_dao, if given, is a FileStateDaoLocal used to keep
+        track of which files are done. Without one, .DONE marker files
+        are used instead. Marker files left by older versions of pogo
+        are honored either way.
+        walker, if given, is a DirectoryWalker, possibly shared with
+        other listers; otherwise the lister makes its own.
+    """
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None):
         if not os.path.isdir(source_dir):
             raise ValueError(source_dir + ' is not a directory.')
         else:
             self.source_dir = source_dir
             self._honssh_type = honssh_type
+            self._file_state_dao = file_state_dao
+            self._walker = walker or DirectoryWalker()
             self._pending_file_names = []
             self._done_file_names = []
             self._pending_file_objects = []
+            self._file_states = {}
+            self._file_stats = {}
+            self._settle_time = None
+            self._closed_files = frozenset()
             self.set_latest_timestamp_to_process()
 
     """
         Generate a list of directories to check for our files
     """
     def my_directories(self):
-        dirlist = [self.source_dir]
-        for (root, dirs, files) in os.walk(self.source_dir):
-            dirlist += [ os.path.join(root,dir) for dir in dirs ]
-        return dirlist
+        return self._walker.walk(self.source_dir)
+
+    def get_walker(self):
+        return self._walker
+
+    """
+        Generate (directory entry, names of all entries in the same
+        directory) for each file in my_directories() whose name
+        one_of_my_files() accepts.
+    """
+    def candidate_entries(self):
+        for dn in self.my_directories():
+            entries = self._walker.entries(dn)
+            name_set = frozenset(e.name for e in entries)
+            for entry in entries:
+                if self.one_of_my_files(entry.name):
+                    yield (entry, name_set)
 
     """
         Given a file name, is this a file that this file lister should process?
@@ -76,35 +131,174 @@ class FileLister(object):
     def one_of_my_files(self, name):
         return self.get_filespec_pattern().match(name)
 
+    """
+        The name under which this lister's files are
+        recorded in the file state table.
+    """
+    def get_file_type(self):
+        return self.get_file_class().__name__
+
     """
         Generate two lists of files: 1) files that still need
         to be processed, and 2) files that are done.
+        The state of all the files is read from the file state table
+        with a single query. Directories are read with the lister's
+        DirectoryWalker, which gets file types from the directory
+        entries, so only the candidate files themselves are stat'ed;
+        the result is kept for load_pending_file_objects()
+        and record_progress().
     """
     def load_file_name_lists(self):
         self._pending_file_names = []
         self._done_file_names = []
-        for dn in self.my_directories():
-            for name in os.listdir(dn):
-                if not self.one_of_my_files(name): continue
-                whole_path = os.path.join(dn, name)
-                if not os.path.isfile(whole_path): continue #isfile() returns True for symlinks to files.
-                if os.path.islink(whole_path): # If it is a symlink, use the actual file instead.
-                    path_to_add = os.path.realpath(whole_path)
-                else:
-                    path_to_add = whole_path
-                # Don't process the files that are there merely to mark another file as "done."
-                if FileLister.is_a_done_marker(path_to_add): continue
-                # Don't process files that have already been done - add these to the "done" list instead.
-                if self.is_done(path_to_add):
-                    self._done_file_names.append(path_to_add)
+        self._file_stats = {}
+        if self._file_state_dao is not None:
+            self._file_states = self._file_state_dao.load_states(self.get_file_type())
+        for (entry, name_set) in self.candidate_entries():
+            name = entry.name
+            # Don't process the files that are there merely to mark another file as "done."
+            if (name.endswith(FileLister.DONE_EXTENSION)
+                    and name[0:len(name) - len(FileLister.DONE_EXTENSION)] in name_set):
+                continue
+            try:
+                if entry.is_symlink(): # If it is a symlink, use the actual file instead.
+                    path_to_add = os.path.realpath(entry.path)
+                    st = self._walker.stat(path_to_add)
+                    has_marker = FileLister.is_done(path_to_add)
+                elif entry.is_file(follow_symlinks=False):
+                    path_to_add = entry.path
+                    st = self._walker.stat(entry)
+                    has_marker = FileLister.done_name(name) in name_set
                 else:
-                    self._pending_file_names.append(path_to_add)
+                    continue
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode): continue
+            self._file_stats[path_to_add] = st
+            # Don't process files that have already been done - add these to the "done" list instead.
+            state = self._file_states.get(path_to_add)
+            if has_marker or (state is not None and state.done and FileLister.state_matches(state, st)):
+                self._done_file_names.append(path_to_add)
+            else:
+                self._pending_file_names.append(path_to_add)
         # Eliminate duplicates -- possible with symlinks:
         self._pending_file_names = list(set(self._pending_file_names))
         self._pending_file_names.sort() # simple ascending sort of names
         self._done_file_names = list(set(self._done_file_names))
         self._done_file_names.sort()
 
+    """
+        How many of this file's records were committed by an earlier,
+        interrupted run? Those records can be skipped.
+    """
+    def resume_point(self, stretch_file_object):
+        name = stretch_file_object.name()
+        if self.GROWING_FILES:
+            state = self.growing_file_state(name)
+            return state.records_done if state is not None else 0
+        state = self._file_states.get(name)
+        if state is None or state.records_done == 0:
+            return 0
+        st = self._file_stats[name]
+        if FileLister.state_matches(state, st):
+            return 0 if state.done else state.records_done
+        if self.APPENDED_RECORDS and state.inode == st.st_ino and st.st_size >= state.size:
+            logging.info("%s was added to after %s of its records were saved; carrying on from there",
+                         name, state.records_done)
+            return state.records_done
+        logging.warning("%s changed after %s of its records were saved; starting over",
+                        name, state.records_done)
+        return 0
+
+    """
+        For a file that HonSSH is adding to: the saved state of the file,
+        as long as it's still the same file and hasn't been cut short, so
+        that reading can carry on from the saved offset. The state is
+        looked for under the file's inode as well as its path, so a
+        renamed (rotated) file carries on where it left off too.
+        None if the file has to be read from the start.
+    """
+    def growing_file_state(self, name):
+        st = self._file_stats[name]
+        state = self._file_states.get(name)
+        if state is None or state.inode != st.st_ino:
+            state = None
+            for s in self._file_states.itervalues():
+                if s.inode == st.st_ino:
+                    state = s
+                    break
+        if state is None or state.byte_offset > st.st_size:
+            return None
+        return state
+
+    """
+        The records in this file that haven't been saved yet: those after
+        the first start records, or for a file HonSSH adds to, those after
+        the saved byte offset -- only up to the last complete record, if
+        the file is still being added to.
+    """
+    def iter_new_records(self, stretch_file_object, start=0):
+        name = stretch_file_object.name()
+        if self.GROWING_FILES:
+            state = self.growing_file_state(name)
+            offset = state.byte_offset if state is not None else 0
+            if offset > 0:
+                logging.info("Resuming %s at byte %s", name, offset)
+            return stretch_file_object.iter_records(offset, self.is_growing(name))
+        records = stretch_file_object.iter_records()
+        if start > 0:
+            logging.info("Resuming %s after record %s", name, start)
+            records = itertools.islice(records, start, None)
+        return records
+
+    """
+        Is HonSSH still adding to this file? Only files of a type
+        that grows, and that have been modified today, are.
+    """
+    def is_growing(self, name):
+        return self.GROWING_FILES and self._file_stats[name].st_mtime >= self._latest_timestamp_to_process
+
+    """
+        Once all the new records in a file have been saved,
+        is the file done with?
+    """
+    def finished_with(self, stretch_file_object):
+        return not self.is_growing(stretch_file_object.name())
+
+    """
+        Record, using the cursor of the transaction that saved them,
+        that records_done of the file's records are in the local
+        database, and whether that's all of them. A file HonSSH is
+        still adding to is never done. byte_offset is the offset reached
+        in the file, if not the one the file was last read up to.
+    """
+    def record_progress(self, cursor, stretch_file_object, records_done, finished, byte_offset=None):
+        name = stretch_file_object.name()
+        done = finished and not self.is_growing(name)
+        if self._file_state_dao is None:
+            if done:
+                FileLister.mark_as_done(stretch_file_object)
+            return
+        if byte_offset is None:
+            byte_offset = stretch_file_object.consumed_offset
+        self._file_state_dao.record_progress(cursor, name, self.get_file_type(),
+                                             self._file_stats[name], records_done, done,
+                                             byte_offset)
+
+    """
+        The os.stat() result for one of the files found by
+        load_file_name_lists().
+    """
+    def file_stat(self, stretch_file_object):
+        return self._file_stats[stretch_file_object.name()]
+
+    """
+        The files that have already been done with,
+        as found by load_file_name_lists().
+    """
+    def done_file_names(self):
+        return list(self._done_file_names)
+
 
     @abc.abstractmethod
     def get_file_class(self):
@@ -131,33 +325,92 @@ class FileLister(object):
         mn_last_night= datetime.datetime.combine(date_yesterday, datetime.time(23,59,59) )
         self._latest_timestamp_to_process = time.mktime(mn_last_night.timetuple())
 
+    """
+        Process files as soon as they've been closed and then left
+        alone for settle_time seconds, rather than waiting until the
+        next day. Used by daemon mode. closed_files are the paths of the
+        files that have been closed since they were last written to, as
+        DirectoryWatcher.closed_files() gives them. A file that merely
+        goes quiet, like the log of an idle SSH session, may still be
+        written to, so it waits until the next day as usual. This doesn't
+        apply to listers whose files are appended to all day
+        (GROWING_FILES); those are read as they grow anyway.
+    """
+    def set_settle_time(self, settle_time, closed_files=()):
+        if self.GROWING_FILES:
+            return
+        self._settle_time = settle_time
+        self._closed_files = frozenset(closed_files)
+
+    """
+        Has this file been closed and then left alone for settle_time
+        seconds? Only ever True if set_settle_time() was used.
+    """
+    def is_settled(self, name):
+        return (os.path.abspath(name) in self._closed_files
+                and self._file_stats[name].st_mtime < time.time() - self._settle_time)
+
+    """
+        The number of pending files that were left out by
+        load_pending_file_objects() because, though they've been closed,
+        they haven't settled yet. Always 0 unless set_settle_time() was used.
+    """
+    def count_unsettled(self):
+        if self._settle_time is None:
+            return 0
+        loaded = set(f.name() for f in self._pending_file_objects)
+        return len([ name for name in self._pending_file_names
+                     if name not in loaded and os.path.abspath(name) in self._closed_files ])
+
     def load_pending_file_objects(self):
-        # Don't process files from today...
+        # Don't process files from today -- except those HonSSH adds
+        # to all day, which are read up to their last complete record,
+        # and in daemon mode, those that have been closed and settled.
         file_class = self.get_file_class()
         self._pending_file_objects = []
         for name in self._pending_file_names:
-            file_mtime = os.stat(name).st_mtime
-            if file_mtime < self._latest_timestamp_to_process:
+            file_mtime = self._file_stats[name].st_mtime
+            if (self.GROWING_FILES or file_mtime < self._latest_timestamp_to_process
+                    or (self._settle_time is not None and self.is_settled(name))):
                 self._pending_file_objects.append(file_class(name))
 
     def delete_done_files(self):
+        return FileLister.delete_files(self._done_file_names, self._file_state_dao)
+
+    """
+        Delete the given files, along with any .DONE markers left for
+        them by older versions, and their rows in the file state table
+        if file_state_dao is given. Returns the number of files deleted.
+    """
+    @staticmethod
+    def delete_files(file_names, file_state_dao=None):
         count_removed = 0
-        for name in self._done_file_names:
+        removed = []
+        for name in file_names:
             try:
                 os.remove(name)
-                os.remove(self.done_name(name))
                 count_removed += 1
+                removed.append(name)
             except OSError, e:  ## if failed, report it back to the user ##
                 print "Error: {0} - {1}.".format(e.filename,e.strerror)
+                continue
+            # Marker files are only there for files done by older versions:
+            try:
+                os.remove(FileLister.done_name(name))
+            except OSError:
+                pass
+        if file_state_dao is not None and removed:
+            file_state_dao.delete_states(removed)
         return count_removed
 
 
 class AttemptFileLister(FileLister):
 
     FILESPEC_PATTERN=re.compile('^\d{8}$')
+    GROWING_FILES = True
 
-    def __init__(self, source_dir, honssh_type):
-        super( AttemptFileLister, self ).__init__(source_dir, honssh_type)
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None):
+        super( AttemptFileLister, self ).__init__(source_dir, honssh_type, file_state_dao, walker)
 
     def get_file_class(self):
         return AttemptFile
@@ -168,9 +421,10 @@ class AttemptFileLister(FileLister):
 
 class LogFileLister(FileLister):
     FILESPEC_PATTERN = re.compile('^honssh\.log.*')
+    GROWING_FILES = True
 
-    def __init__(self, source_dir, honssh_type):
-        super( LogFileLister, self ).__init__(source_dir, honssh_type)
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None):
+        super( LogFileLister, self ).__init__(source_dir, honssh_type, file_state_dao, walker)
 
     def get_file_class(self):
         return LogFile
@@ -180,10 +434,33 @@ class LogFileLister(FileLister):
 
 
 
-class SessionLogFileLister(FileLister):
+"""
+    Base class for the listers of files in the sessions directory.
+    If given a SessionTree, a session lister takes its candidate files
+    from the tree, so that all three session listers share a single
+    read of the sessions directory.
+"""
+class SessionFileLister(FileLister):
+    SESSION_KIND = None
+
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None, session_tree=None):
+        if session_tree is not None and walker is None:
+            walker = session_tree.get_walker()
+        super( SessionFileLister, self ).__init__(source_dir, honssh_type, file_state_dao, walker)
+        self._session_tree = session_tree
+
+    def candidate_entries(self):
+        if self._session_tree is None:
+            return super( SessionFileLister, self ).candidate_entries()
+        return iter(self._session_tree.candidates(self.SESSION_KIND))
+
+
+class SessionLogFileLister(SessionFileLister):
     FILESPEC_PATTERN = re.compile('.*\.log') # This regex pattern will stop working in 3000 AD!
-    def __init__(self, source_dir, honssh_type):
-        super( SessionLogFileLister, self ).__init__(source_dir, honssh_type)
+    SESSION_KIND = 'log'
+    APPENDED_RECORDS = True
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None, session_tree=None):
+        super( SessionLogFileLister, self ).__init__(source_dir, honssh_type, file_state_dao, walker, session_tree)
 
     """
         Override my_directories because we don't search recursively for this kind of file.
@@ -213,15 +490,10 @@ class SessionLogFileLister(FileLister):
             return self.my_directories_multi()
     
     def my_directories_single(self):
-        dirs = [ os.path.join(self.source_dir, d) for d in os.listdir(self.source_dir) if os.path.isdir(os.path.join(self.source_dir, d)) ]
-        return dirs
+        return self._walker.session_directories(self.source_dir, 'SINGLE')
     
     def my_directories_multi(self):
-        workstation_dirs = [ os.path.join(self.source_dir, d) for d in os.listdir(self.source_dir) if os.path.isdir(os.path.join(self.source_dir, d)) ]
-        dirs = []
-        for w in workstation_dirs:
-            dirs += [ os.path.join(w,d) for d in os.listdir(w) if os.path.isdir(os.path.join(w,d))]
-        return dirs
+        return self._walker.session_directories(self.source_dir, 'MULTI')
 
     def get_file_class(self):
         return SessionLogFile
@@ -230,10 +502,11 @@ class SessionLogFileLister(FileLister):
         return SessionLogFileLister.FILESPEC_PATTERN
 
 
-class SessionRecordingFileLister(FileLister):
+class SessionRecordingFileLister(SessionFileLister):
     FILESPEC_PATTERN = re.compile('.*\.tty')
-    def __init__(self, source_dir, honssh_type):
-        super( SessionRecordingFileLister, self ).__init__(source_dir, honssh_type)
+    SESSION_KIND = 'recording'
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None, session_tree=None):
+        super( SessionRecordingFileLister, self ).__init__(source_dir, honssh_type, file_state_dao, walker, session_tree)
 
     def get_file_class(self):
         return SessionRecordingFile
@@ -270,15 +543,10 @@ class SessionRecordingFileLister(FileLister):
             return self.my_directories_multi()
     
     def my_directories_single(self):
-        dirs = [ os.path.join(self.source_dir, d) for d in os.listdir(self.source_dir) if os.path.isdir(os.path.join(self.source_dir, d)) ]
-        return dirs
+        return self._walker.session_directories(self.source_dir, 'SINGLE')
     
     def my_directories_multi(self):
-        workstation_dirs = [ os.path.join(self.source_dir, d) for d in os.listdir(self.source_dir) if os.path.isdir(os.path.join(self.source_dir, d)) ]
-        dirs = []
-        for w in workstation_dirs:
-            dirs += [ os.path.join(w,d) for d in os.listdir(w) if os.path.isdir(os.path.join(w,d))]
-        return dirs
+        return self._walker.session_directories(self.source_dir, 'MULTI')
 
 
 
@@ -291,10 +559,12 @@ class SessionRecordingFileLister(FileLister):
 
     
 
-class SessionDownloadFileLister(FileLister):
+class SessionDownloadFileLister(SessionFileLister):
     FILESPEC_PATTERN = None # This pattern is not relevant for htis class
-    def __init__(self, source_dir, honssh_type):
-        super( SessionDownloadFileLister, self ).__init__(source_dir, honssh_type)
+    SESSION_KIND = 'download'
+    DOWNLOADS_DIR = 'downloads'
+    def __init__(self, source_dir, honssh_type, file_state_dao=None, walker=None, session_tree=None):
+        super( SessionDownloadFileLister, self ).__init__(source_dir, honssh_type, file_state_dao, walker, session_tree)
 
     def get_file_class(self):
         return SessionDownloadFile
@@ -340,20 +610,12 @@ class SessionDownloadFileLister(FileLister):
 
     
     def my_directories_single(self):
-        dirs = [ os.path.join(self.source_dir, d, 'downloads') for d in os.listdir(self.source_dir)
-                 if os.path.isdir(os.path.join(self.source_dir, d, 'downloads')) ]
-        return dirs
+        return self._walker.session_directories(self.source_dir, 'SINGLE', SessionDownloadFileLister.DOWNLOADS_DIR)
 
         
         
     def my_directories_multi(self):
-        workstation_dirs = [ os.path.join(self.source_dir, d) for d in os.listdir(self.source_dir)
-                             if os.path.isdir(os.path.join(self.source_dir, d)) ]
-        dirs = []
-        for w in workstation_dirs:
-            dirs += [ os.path.join(w,d, 'downloads') for d in os.listdir(w)
-                      if os.path.isdir(os.path.join(w,d, 'downloads'))]
-        return dirs
+        return self._walker.session_directories(self.source_dir, 'MULTI', SessionDownloadFileLister.DOWNLOADS_DIR)
 
 
 
@@ -364,3 +626,69 @@ class SessionDownloadFileLister(FileLister):
     def one_of_my_files(self, name):
         return True
 
+
+"""
+    A single read of the sessions directory, shared by the session log,
+    session recording and session download listers. The tree is walked
+    once, the first time any lister asks for its files, and each entry
+    is classified then: files in a source ip directory are session logs
+    or recordings, according to the listers' file name patterns, and
+    everything in a downloads directory is a download.
+"""
+class SessionTree(object):
+    def __init__(self, source_dir, honssh_type, walker=None):
+        self.source_dir = source_dir
+        self._honssh_type = honssh_type
+        self._walker = walker or DirectoryWalker()
+        self._candidates = None
+        self._lock = threading.Lock()
+
+    def get_walker(self):
+        return self._walker
+
+    def scan(self):
+        logs = []
+        recordings = []
+        downloads = []
+        for ip_dir in self._walker.session_directories(self.source_dir, self._honssh_type):
+            entries = self._walker.entries(ip_dir)
+            name_set = frozenset(e.name for e in entries)
+            for e in entries:
+                if e.name == SessionDownloadFileLister.DOWNLOADS_DIR and e.is_dir():
+                    dl_entries = self._walker.entries(e.path)
+                    dl_name_set = frozenset(d.name for d in dl_entries)
+                    downloads += [ (d, dl_name_set) for d in dl_entries ]
+                    continue
+                if SessionLogFileLister.FILESPEC_PATTERN.match(e.name):
+                    logs.append( (e, name_set) )
+                if SessionRecordingFileLister.FILESPEC_PATTERN.match(e.name):
+                    recordings.append( (e, name_set) )
+        self._candidates = {
+            SessionLogFileLister.SESSION_KIND: logs,
+            SessionRecordingFileLister.SESSION_KIND: recordings,
+            SessionDownloadFileLister.SESSION_KIND: downloads
+            }
+
+    """
+        The (entry, names in same directory) pairs for one kind
+        of session file: 'log', 'recording' or 'download'.
+    """
+    def candidates(self, kind):
+        with self._lock:
+            if self._candidates is None:
+                self.scan()
+        return self._candidates[kind]
+
+    """
+        A SessionTree with the same files as this one, found without
+        reading the sessions directory again, but whose walker stat()s
+        each of them afresh, since they may have grown or gone since
+        this tree was read. Files that have appeared since aren't in it.
+    """
+    def restat(self):
+        with self._lock:
+            if self._candidates is None:
+                self.scan()
+        tree = SessionTree(self.source_dir, self._honssh_type, DirectoryWalker(entry_stats=False))
+        tree._candidates = self._candidates
+        return tree
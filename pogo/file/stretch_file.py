@@ -1,7 +1,14 @@
 """
-    A StretchFile reads disk files into RAM and creates Record objects from their contents.
+    A StretchFile reads disk files and creates Record objects from their contents.
+    iter_records() produces the records one at a time, so that a file of any size
+    can be processed without holding all its records in RAM; load() reads them all
+    into the StretchFile's entry list.
 """
 import abc
+import binascii
+import hashlib
+import logging
+import mmap
 import os
 import os.path
 import re
@@ -10,12 +17,71 @@ from pogo.dto.record import LogRecord, AttemptRecord, SessionLogRecord, SessionD
 from pogo.dto.record import SessionRecordingRecord
 from pogo.util.util import get_geo_info
 
+# Files bigger than this are stored without their contents; 0 means no limit.
+_max_blob_size = 0
+
+# Bytes of a file encoded at a time by encode_base64_file(). This must
+# be a multiple of 3, so that no chunk but the last needs padding.
+BASE64_CHUNK_SIZE = 3 * 256 * 1024
+
+def configure_max_blob_size(size):
+    global _max_blob_size
+    _max_blob_size = int(size)
+
+"""
+    Generate the size bytes of the open file f, BASE64_CHUNK_SIZE
+    bytes at a time. The file is mapped into memory rather than
+    read, so the chunks are the only copies of it made.
+"""
+def map_file_chunks(f, size):
+    if size == 0:
+        return
+    m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        for start in xrange(0, size, BASE64_CHUNK_SIZE):
+            yield m[start:start + BASE64_CHUNK_SIZE]
+    finally:
+        m.close()
+
+"""
+    Base64-encode the size bytes of the open file f, a chunk at a
+    time, into a buffer allocated up front for the whole result, so
+    the file itself is never read into RAM, and no more than a chunk
+    of it is held alongside the encoded data. Turning the buffer into
+    the str that's returned copies it once, at the end. The result is
+    a single line, without the line breaks every 76 characters that
+    str.encode('base64') adds.
+"""
+def encode_base64_file(f, size):
+    buf = bytearray(4 * ((size + 2) // 3))
+    pos = 0
+    for chunk in map_file_chunks(f, size):
+        encoded = binascii.b2a_base64(chunk)
+        end = pos + len(encoded) - 1 # leaving out the newline
+        buf[pos:end] = buffer(encoded, 0, len(encoded) - 1)
+        pos = end
+    return str(buf)
+
+"""
+    Hex SHA-256 hash of the size bytes of the open file f.
+"""
+def sha256_file(f, size):
+    h = hashlib.sha256()
+    for chunk in map_file_chunks(f, size):
+        h.update(chunk)
+    return h.hexdigest()
+
 class StretchFile(object):
     __metaclass__ = abc.ABCMeta
     def __init__(self, file_name):
         self._name = file_name
         self._entry_list = []
         self._loaded = False
+        # Offset in the file just past the last record
+        # handed out by iter_records():
+        self.consumed_offset = 0
+        # Bytes of the file read so far:
+        self.bytes_read = 0
     
     def name(self):
         return self._name
@@ -28,41 +94,69 @@ class StretchFile(object):
     def __len__(self):
         return len(self._entry_list)
     
-    @abc.abstractmethod
+    """
+        Read all of this file's records into the entry list.
+        Returns True if successful, False if there was an
+        i/o error.
+    """
     def load(self):
+        if not os.path.isfile(self.name()):
+            raise ValueError(self.name() + " is not a file.")
+        try:
+            self._entry_list = list(self.iter_records())
+            self._loaded = True
+            return True
+        except IOError:
+            logging.error("Failed to load file ", exc_info = True)
+            print "Error during loading of file " + self.name()
+            self._entry_list = []
+            self._loaded = False
+            return False
+
+    """
+        Generator yielding the records in this file, one at
+        a time. Raises IOError if the file can't be read.
+    """
+    @abc.abstractmethod
+    def iter_records(self):
         pass
 
+    """
+        Generate (line, end offset of line) for each line of the
+        file, starting at byte start_offset. If complete_only is set,
+        stop before a last line that doesn't end with a newline yet.
+    """
+    def iter_lines(self, start_offset=0, complete_only=False):
+        offset = start_offset
+        try:
+            with open(self.name(), "rb") as f:
+                if start_offset:
+                    f.seek(start_offset)
+                for line in iter(f.readline, ''):
+                    if complete_only and not line.endswith('\n'):
+                        return
+                    offset += len(line)
+                    yield (line, offset)
+        finally:
+            self.bytes_read += offset - start_offset
+
+
 
 class AttemptFile(StretchFile):
     def __init__(self, file_name):
         super(AttemptFile, self).__init__(file_name)
 
-    def load(self):
-        if os.path.isfile(self.name()):
-            try:
-                f = open(self.name(), "rt")
-                try:
-                    for line in f:
-                        r = AttemptRecord(line.rstrip())
-                        self._entry_list.append(r)
-                    f.close()
-                    self._loaded = True
-                    return True
-                except IOError:
-                    if f is not None:
-                        f.close()
-                    logging.error("Failed to load file ", exc_info = True)
-                    print "During loading of " + self.name() + " encountered i/o error reading line " + line
-                    self._loaded = False
-                    return False
-            except IOError:
-                logging.error("Could not open file", exc_info = True)
-                self._loaded = False
-                return False
-        else: 
-            raise ValueError(self.name() + " is not a file.")
-            self._loaded = False
-            return False
+    """
+        HonSSH adds to the current day's attempt file all day, so this
+        can start part way into the file, at start_offset, and if the
+        file is still growing, stop at the last complete line.
+    """
+    def iter_records(self, start_offset=0, growing=False):
+        self.consumed_offset = start_offset
+        for (line, end) in self.iter_lines(start_offset, growing):
+            r = AttemptRecord(line.rstrip())
+            self.consumed_offset = end
+            yield r
     
 
 class LogFile(StretchFile):
@@ -71,44 +165,39 @@ class LogFile(StretchFile):
     def __init__(self, file_name):
         super(LogFile, self).__init__(file_name)
         
-    def load(self):
-        if os.path.isfile(self.name()):
-            try:
-                f = open(self.name(), "rt")
-                try:
-                    for line in f:
-                        if LogFile.EXTRA_LINE_PATTERN.match(line):
-                            # Don't use this to construct a
-                            # LogRecord. Instead, tack it on to
-                            # the end of the last entry's message
-                            # field.
-                            if len(self._entry_list) > 0:
-                                r = self._entry_list.pop()
-                                r.message += ' -- ' + line.strip()
-                        else:
-                            r = LogRecord(line.rstrip()) 
-                        self._entry_list.append(r)
-                        
-                    f.close()
-                    self._loaded = True
-                    return True
-                except IOError:
-                    if f is not None:
-                        f.close()
-                    logging.error("Could not read a line in file", exc_info = True)    
-                    print "During loading of " + self.name() + " encountered i/o error reading line " + line
-                    self._loaded = False
-                    return False
-            except IOError:
-                logging.error("Failed to load file ", exc_info = True)
-                print "Error during loading of file " + self.name()
-                self._loaded = False
-                return False
-        else: 
-            raise ValueError(self.name() + " is not a file.")
-            self._loaded = False
-            return False
-# end of LogFile.load())
+    """
+        Like AttemptFile.iter_records(), this can start at start_offset,
+        and stop early if the file is still growing. In that case the
+        last record isn't handed out at all, since HonSSH may not have
+        written all its continuation lines yet; consumed_offset is left
+        at its start, so it's read again, whole, next time.
+    """
+    def iter_records(self, start_offset=0, growing=False):
+        # A record can't be handed out until we've seen the line
+        # after it, since that line may be a continuation of it.
+        r = None
+        self.consumed_offset = start_offset
+        line_start = start_offset
+        for (line, end) in self.iter_lines(start_offset, growing):
+            if LogFile.EXTRA_LINE_PATTERN.match(line):
+                # Don't use this to construct a
+                # LogRecord. Instead, tack it on to
+                # the end of the last entry's message
+                # field.
+                if r is not None:
+                    r.message += ' -- ' + line.strip()
+                else:
+                    self.consumed_offset = end
+            else:
+                if r is not None:
+                    self.consumed_offset = line_start
+                    yield r
+                r = LogRecord(line.rstrip())
+            line_start = end
+        if r is not None and not growing:
+            self.consumed_offset = line_start
+            yield r
+# end of LogFile.iter_records()
 
 
 class SessionLogFile(StretchFile):
@@ -130,43 +219,30 @@ class SessionLogFile(StretchFile):
             self.country_name = ''
 
         
-    def load(self):
-        if os.path.isfile(self.name()):
-            try:
-                f = open(self.name(), "rt")
-                try:
-                    for line in f:
-                        r = SessionLogRecord(line)
-                        r.set_source_ip(self.source_ip)
-                        r.set_country_info(self.country_code, self.country_name)
-                        self._entry_list.append(r)
-                    f.close()
-                    self._loaded = True
-                    return True
-                except IOError:
-                    if f is not None:
-                        f.close()
-                        logging.error("Failed to load file ", exc_info = True)
-                        print "During loading of " + self.name() + " encountered i/o error reading line " + line
-                    self._loaded = False
-                    return False
-            except IOError:
-                logging.error("Failed to load file ", exc_info = True)
-                print "Error during loading of file " + self.name()
-                self._loaded = False
-                return False
-        else: 
-            raise ValueError(self.name() + " is not a file.")
-            self._loaded = False
-            return False
-# end of SessionLogFile.load())
+    def iter_records(self):
+        with open(self.name(), "rt") as f:
+            for line in f:
+                self.bytes_read += len(line)
+                r = SessionLogRecord(line)
+                r.set_source_ip(self.source_ip)
+                r.set_country_info(self.country_code, self.country_name)
+                yield r
+# end of SessionLogFile.iter_records()
 
 
-class SessionDownloadFile(StretchFile):
+"""
+    Base class for the session files whose whole contents
+    are stored in a single record, base64-encoded: session
+    recordings and downloads.
+    Files bigger than the maximum blob size (see
+    configure_max_blob_size()) are recorded without their
+    contents -- just the name, size, time and source.
+"""
+class SessionBlobFile(StretchFile):
+    __metaclass__ = abc.ABCMeta
     def __init__(self, file_name):
-        super(SessionDownloadFile, self).__init__(file_name)
-        # IP is third-to-last element of filespec
-        source_ip = file_name.split(os.sep)[-3]
+        super(SessionBlobFile, self).__init__(file_name)
+        source_ip = file_name.split(os.sep)[self.get_source_ip_position()]
         self.set_source_ip(source_ip)
         
     def set_source_ip(self, source_ip):
@@ -180,98 +256,80 @@ class SessionDownloadFile(StretchFile):
             self.country_code = ''
             self.country_name = ''
 
-        
-    def load(self):
-        if os.path.isfile(self.name()):
-            try:
-                with open(self.name(), "rb") as f:
-                    data = f.read()
-                    if data:
-                        data64 = data.encode("base64")
-                    else:
-                        data64 = ''
-                    r = SessionDownloadFileRecord(self.name(), data64)
-                    # Part of file name is a datetime stamp. Extract it
-                    namepart = self.name().split(os.sep)[-1] # get last element of filespec
-                    # datetime string in format expected by set_timestamp():
-                    normalized_namepart = ( namepart[0:4] + '-'
-                                             + namepart[4:6] + '-'
-                                             + namepart[6:8] + ' '
-                                             + namepart[9:11] + ':'
-                                             + namepart[11:13] + ':'
-                                             + namepart[13:15] )
-                    r.set_timestamp(normalized_namepart)
-                    r.set_source_ip(self.source_ip)
-                    r.set_country_info(self.country_code, self.country_name)
-                    self._entry_list.append(r)
-                    self._loaded = True
-                    return True
-            except IOError:
-                logging.error("Failed to load file ", exc_info = True)
-                print "During loading of " + self.name() + " encountered i/o error"
-                self._loaded = False
-                return False
-        else: 
-            raise ValueError(self.name() + " is not a file.")
-            self._loaded = False
-            return False
-# end of SessionDownloadFile.load())
+    """
+        Index of the source ip directory in the
+        file's path, split on os.sep.
+    """
+    @abc.abstractmethod
+    def get_source_ip_position(self):
+        pass
+
+    @abc.abstractmethod
+    def get_record_class(self):
+        pass
+
+    """
+        Hook to set anything else about record r that needs
+        the open file f.
+    """
+    def add_file_info(self, r, f, file_size):
+        pass
 
+    def iter_records(self):
+        with open(self.name(), "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if _max_blob_size and file_size > _max_blob_size:
+                logging.warning("%s is %s bytes, more than max_blob_size (%s); storing it without its contents",
+                                self.name(), file_size, _max_blob_size)
+                data64 = ''
+            else:
+                data64 = encode_base64_file(f, file_size)
+                self.bytes_read += file_size
+            r = self.get_record_class()(self.name(), data64, file_size)
+            self.add_file_info(r, f, file_size)
+        # Part of file name is a datetime stamp. Extract it
+        namepart = self.name().split(os.sep)[-1] # get last element of filespec
+        # datetime string in format expected by set_timestamp():
+        normalized_namepart = ( namepart[0:4] + '-'
+                                 + namepart[4:6] + '-'
+                                 + namepart[6:8] + ' '
+                                 + namepart[9:11] + ':'
+                                 + namepart[11:13] + ':'
+                                 + namepart[13:15] )
+        r.set_timestamp(normalized_namepart)
+        r.set_source_ip(self.source_ip)
+        r.set_country_info(self.country_code, self.country_name)
+        yield r
+# end of SessionBlobFile.iter_records()
 
-class SessionRecordingFile(StretchFile):
+
+class SessionDownloadFile(SessionBlobFile):
     def __init__(self, file_name):
-        super(SessionRecordingFile, self).__init__(file_name)
-        # IP is second-to-last element of filespec
-        source_ip = file_name.split(os.sep)[-2]
-        self.set_source_ip(source_ip)
-        
-    def set_source_ip(self, source_ip):
-        if source_ip:
-            self.source_ip = source_ip
-            gpi = get_geo_info(self.source_ip)
-            self.country_code = gpi.country_code
-            self.country_name = gpi.country_name
-        else:
-            self.source_ip = ''
-            self.country_code = ''
-            self.country_name = ''
+        super(SessionDownloadFile, self).__init__(file_name)
 
-        
-    def load(self):
-        if os.path.isfile(self.name()):
-            try:
-                with open(self.name(), "rb") as f:
-                    data = f.read()
-                    if data:
-                        data64 = data.encode("base64")
-                    else:
-                        data64 = ''
-                    r = SessionRecordingRecord(self.name(), data64)
-                    # Part of file name is a datetime stamp. Extract it
-                    namepart = self.name().split(os.sep)[-1] # get last element of filespec
-                    # datetime string in format expected by set_timestamp():
-                    normalized_namepart = ( namepart[0:4] + '-'
-                                             + namepart[4:6] + '-'
-                                             + namepart[6:8] + ' '
-                                             + namepart[9:11] + ':'
-                                             + namepart[11:13] + ':'
-                                             + namepart[13:15] )
-                    r.set_timestamp(normalized_namepart)
-                    r.set_source_ip(self.source_ip)
-                    r.set_country_info(self.country_code, self.country_name)
-                    self._entry_list.append(r)
-                    self._loaded = True
-                    return True
-            except IOError:
-                logging.error("Failed to load file ", exc_info = True)
-                print "During loading of " + self.name() + " encountered i/o error"
-                self._loaded = False
-                return False
-        else: 
-            raise ValueError(self.name() + " is not a file.")
-            self._loaded = False
-            return False
-# end of SessionRecordingFile.load())
+    def get_source_ip_position(self):
+        # IP is third-to-last element of filespec
+        return -3
+
+    def get_record_class(self):
+        return SessionDownloadFileRecord
+
+    """
+        Downloads are identified by their hash, so that each distinct
+        file's contents are stored and shipped only once. Oversized files
+        are hashed too, even though their contents aren't kept.
+    """
+    def add_file_info(self, r, f, file_size):
+        r.sha256 = sha256_file(f, file_size)
 
 
+class SessionRecordingFile(SessionBlobFile):
+    def __init__(self, file_name):
+        super(SessionRecordingFile, self).__init__(file_name)
+
+    def get_source_ip_position(self):
+        # IP is second-to-last element of filespec
+        return -2
 
+    def get_record_class(self):
+        return SessionRecordingRecord
@@ -14,85 +14,339 @@
     
     3. Cleanup. In this step, files and database records marked as done in steps
     1 and 2 are deleted.
+
+    Run as 'pogo' (or 'pogo run'), the three steps are done once, for whatever is
+    there, as from cron. Run as 'pogo daemon', pogo keeps running, watching HonSSH's
+    directories and going through the steps again whenever files appear or change.
 """
+import argparse
+import signal
 import sqlite3
 import logging
 import sys
+import time
+import datetime
 import os
+import collections
+import functools
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
 
 # from pogo.dao.record_dao_es import AttemptRecordDaoES, LogRecordDaoES
 # from pogo.dao.record_dao_es import SessionLogDaoES, SessionRecordingDaoES, SessionDownloadDaoES
+# from pogo.dao.record_dao_es import DownloadContentDaoES
 # from pogo.dao.record_dao_local import AttemptRecordDaoLocal, LogRecordDaoLocal
 # from pogo.dao.record_dao_local import SessionLogDaoLocal, SessionRecordingDaoLocal, SessionDownloadDaoLocal
 # from pogo.dao.local_db_access import LocalDBAccessor
+# from pogo.dao.geo_cache_dao_local import GeoCacheDaoLocal
+# from pogo.dao.file_state_dao_local import FileStateDaoLocal
+# from pogo.dao.file_journal import FileJournal
+# from pogo.dao.download_content_dao_local import DownloadContentDaoLocal
 # from pogo.dto.record import AttemptRecord, LogRecord
 # from pogo.dto.record import SessionLogRecord, SessionRecordingRecord, SessionDownloadFileRecord
+# from pogo.dto.record import DownloadContentRecord
 # from pogo.file.file_lister import AttemptFileLister, LogFileLister
 # from pogo.file.file_lister import SessionLogFileLister, SessionRecordingFileLister, SessionDownloadFileLister
+# from pogo.file.file_lister import FileLister, SessionFileLister, SessionTree
+# from pogo.file.stretch_file import configure_max_blob_size
+# from pogo.file.dir_watcher import DirectoryWatcher
 # from pogo.service.service_local import ServiceLocal
+# from pogo.service.bulk_shipper import BulkShipper
+# from pogo.service.pipeline import Pipeline
 # from pogo.util.config import StretchConfig
 # from pogo.util.util import logging_level_from_string, configure_logging
-# from pogo.util.util import generate_archive_name, archive_file_list
+# from pogo.util.archive import Archiver, find_members, extract_member
+# from pogo.util.util import configure_geo_cache, geo_database_stamp, get_time_converter
+# from pogo.util.metrics import get_metrics
 
 from dao.record_dao_es import AttemptRecordDaoES, LogRecordDaoES
 from dao.record_dao_es import SessionLogDaoES, SessionRecordingDaoES, SessionDownloadDaoES
+from dao.record_dao_es import DownloadContentDaoES
 from dao.record_dao_local import AttemptRecordDaoLocal, LogRecordDaoLocal
 from dao.record_dao_local import SessionLogDaoLocal, SessionRecordingDaoLocal, SessionDownloadDaoLocal
 from dao.local_db_access import LocalDBAccessor
+from dao.geo_cache_dao_local import GeoCacheDaoLocal
+from dao.file_state_dao_local import FileStateDaoLocal
+from dao.file_journal import FileJournal
+from dao.download_content_dao_local import DownloadContentDaoLocal
 from dto.record import AttemptRecord, LogRecord
 from dto.record import SessionLogRecord, SessionRecordingRecord, SessionDownloadFileRecord
+from dto.record import DownloadContentRecord
 from file.file_lister import AttemptFileLister, LogFileLister
 from file.file_lister import SessionLogFileLister, SessionRecordingFileLister, SessionDownloadFileLister
+from file.file_lister import FileLister, SessionFileLister, SessionTree
+from file.stretch_file import configure_max_blob_size
+from file.dir_watcher import DirectoryWatcher
 from service.service_local import ServiceLocal
+from service.bulk_shipper import BulkShipper
+from service.pipeline import Pipeline
 from util.config import StretchConfig
 from util.util import logging_level_from_string, configure_logging
-from util.util import generate_archive_name, archive_file_list
+from util.archive import Archiver, find_members, extract_member
+from util.util import configure_geo_cache, geo_database_stamp, get_time_converter
+from util.metrics import get_metrics
 
 
 
 import os.path
 
 
+"""
+    The methods that handle one type of HonSSH data; see
+    Pogo.record_type_pipelines().
+"""
+RecordPipeline = collections.namedtuple('RecordPipeline', 'scrape arc_prefix put prune iter_scrape prune_files direct')
+
+
 class Pogo(object ):
+    # Files scraped but not yet shipped, or shipped but not yet archived,
+    # that run_pipelined() lets build up before the step ahead waits.
+    PIPELINE_QUEUE_SIZE = 16
+
     def __init__(self):
         self._cfg = StretchConfig()
         self._logger = configure_logging(self._cfg.get_logging_info)
         self._dba = LocalDBAccessor(self._cfg.get_db_info())
         self._dba.initialize_database()
+        # Set up the cache of geoip lookup results:
+        geo_cfg = self._cfg.get_geoip_info()
+        geo_store = None
+        if int(geo_cfg['persistent_cache']):
+            geo_store = GeoCacheDaoLocal(self._dba, geo_database_stamp())
+        self._geo_cache = configure_geo_cache(int(geo_cfg['cache_size']), geo_store)
+        # Session recordings and downloads bigger than this are stored without their contents:
+        configure_max_blob_size(self._cfg.get_max_blob_size())
+        # One read of the sessions directory per phase, shared by the session listers:
+        self._session_trees = {}
+        self._session_tree_lock = threading.Lock()
+        # Elasticsearch daos, kept so their connections can be reused:
+        self._es_links = {}
+        self._es_link_lock = threading.Lock()
+        # In daemon mode, files are processed once they've been closed and
+        # left alone for this many seconds, instead of waiting until the
+        # next day; the watcher says which have been closed:
+        self._settle_time = None
+        self._watcher = None
+        self._unsettled_files = {}
+        self._stopping = False
         # Create directory to store archived data files, if it doesn't already exist:
         self._arc_dir = self._cfg.get_locations()['archive_dir']
         if not os.path.isdir(self._arc_dir):
             os.makedirs(self._arc_dir)
+        self._archiver = Archiver.from_config(self._cfg.get_archive_info())
+        # In direct mode, records go straight from HonSSH's files to
+        # Elasticsearch, and how far each file has got is kept in a journal:
+        self._journal = None
+        if self._cfg.get_direct():
+            self._journal = FileJournal(self._cfg.get_db_info()['journal'])
         
-    def scrape_honssh_files(self, loc_type, lister_class, dao_local_class):
+    """
+        The SessionTree for the given phase ('scrape' or 'prune'), created
+        the first time a session lister asks for it. The session log,
+        recording and download listers all share the scrape tree, so the
+        sessions directory is only read once per run. The prune tree has
+        the same files, but stat()s them again: a file that has grown
+        since it was scraped mustn't look done and be deleted. Files that
+        appear after the scrape can't be done yet, so prune can do without
+        them until the next run.
+    """
+    def get_session_tree(self, phase):
+        with self._session_tree_lock:
+            tree = self._session_trees.get(phase)
+            if tree is None:
+                scrape_tree = self._session_trees.get('scrape')
+                if scrape_tree is None:
+                    scrape_tree = SessionTree(self._cfg.get_locations()['session_dir'], self._cfg.get_honssh_type())
+                    self._session_trees['scrape'] = scrape_tree
+                tree = scrape_tree if phase == 'scrape' else scrape_tree.restat()
+                self._session_trees[phase] = tree
+            return tree
+
+    def make_lister(self, loc_type, lister_class, phase, file_state_dao=None):
         source_dir = self._cfg.get_locations()[loc_type]
         honssh_type = self._cfg.get_honssh_type()
-        lister = lister_class(source_dir, honssh_type)
+        if file_state_dao is None:
+            file_state_dao = FileStateDaoLocal(self._dba)
+        if issubclass(lister_class, SessionFileLister):
+            lister = lister_class(source_dir, honssh_type, file_state_dao,
+                                  session_tree=self.get_session_tree(phase))
+        else:
+            lister = lister_class(source_dir, honssh_type, file_state_dao)
+        if self._settle_time is not None:
+            lister.set_settle_time(self._settle_time, self._watcher.closed_files())
+        return lister
+
+    """
+        The Elasticsearch dao of the given class. Each is made once,
+        and kept, so that a long-running pogo reuses its connections.
+    """
+    def get_es_link(self, esclass):
+        with self._es_link_lock:
+            es_link = self._es_links.get(esclass)
+            if es_link is None:
+                es_link = esclass(self._cfg.get_es_info())
+                self._es_links[esclass] = es_link
+            return es_link
+
+    def scrape_honssh_files(self, loc_type, lister_class, dao_local_class):
+        return list(self.iter_scraped_files(loc_type, lister_class, dao_local_class))
+
+    """
+        Scrape the pending files of one type into the local database,
+        generating the name of each file once all its records have
+        been committed.
+    """
+    def iter_scraped_files(self, loc_type, lister_class, dao_local_class):
+        lister = self.make_lister(loc_type, lister_class, 'scrape')
         lister.load_file_name_lists()
         lister.load_pending_file_objects()
+        self._unsettled_files[lister_class] = lister.count_unsettled()
+        self.log_walker_counts(lister)
         self._logger.info("File lister loaded with %s files", len(lister))
         print "File lister loaded with " + str(len(lister)) + " files"
+        metrics = get_metrics()
+        file_type = lister.get_file_type()
+        metrics.inc('files_listed_total', len(lister), file_type=file_type)
         dao_obj = dao_local_class(self._dba)
         aservice = ServiceLocal(dao_obj)
+        commit_every = int(self._cfg.get_db_info()['insert_chunk_size'])
         total_num_saved = 0
-        done_files = []
         for f in lister:
-            if f.load():
-                self._logger.info("loaded %s, containing %s records", f.name(), len(f) )
-                print "loaded " + f.name() + " containing " + str(len(f)) + " records"
-                if len(f) > 0:
-                    num_saved = aservice.write_new_records(f._entry_list)
-                    self._logger.info("Saved %s records", num_saved)
-                    print "Number saved: " + str(num_saved)
-                    total_num_saved += num_saved
-                    if num_saved is None or num_saved != len(f):
-                        raise Exception("Only " + num_saved + "records written from file " + f._name + ". File contains " + len(f) + " + records.")
-                    else:
-                        lister.mark_as_done(f)
-                        done_files.append(f._name)
-        return done_files
+            # Records are streamed from the file into the local
+            # database, committing every commit_every records,
+            # rather than being loaded into RAM all at once.
+            # Each commit also records how far into the file we've
+            # got, so if an earlier run was interrupted we can skip
+            # the records it already saved.
+            start = lister.resume_point(f)
+            records = lister.iter_new_records(f, start)
+            on_commit = lambda cursor, count, finished, f=f, start=start: lister.record_progress(cursor, f, start + count, finished)
+            started = time.time()
+            try:
+                num_saved = aservice.write_new_records(records, commit_every, on_commit)
+            except IOError:
+                self._logger.error("Failed to load file %s", f.name(), exc_info = True)
+                print "Error during loading of file " + f.name()
+                continue
+            self._geo_cache.flush()
+            metrics.observe('file_seconds', time.time() - started, file_type=file_type)
+            metrics.inc('records_parsed_total', num_saved, file_type=file_type)
+            metrics.inc('bytes_read_total', f.bytes_read, file_type=file_type)
+            self._logger.info("Saved %s records from %s", num_saved, f.name())
+            print "Number saved from " + f.name() + ": " + str(num_saved)
+            total_num_saved += num_saved
+            # Files HonSSH is still adding to aren't finished with yet,
+            # so they aren't to be archived or deleted:
+            if lister.finished_with(f):
+                yield f._name
+        self._logger.info("Geoip cache: %s hits, %s misses (%s found in local database)",
+                          self._geo_cache.hits, self._geo_cache.misses, self._geo_cache.store_hits)
     
     
+    """
+        Direct mode: send the records in the pending files of one type
+        straight to Elasticsearch, without putting them in the local
+        database first. Each file's records are read and sent in batches
+        of es_bulk_docs, up to es_in_flight batches at a time, and as
+        each batch is acknowledged, how far into the file it went is
+        added to the journal. Each record's document _id comes from its
+        file and its position there, so records sent again after a crash
+        replace the copies already in Elasticsearch.
+        Files whose records have all been acknowledged are archived and
+        deleted, along with any left from an interrupted run. If any
+        record is refused, the file it's in gets no further in the
+        journal, so it's sent again, from there, next time.
+        prepare, if given, is called with each batch before it's sent.
+    """
+    def ship_direct(self, loc_type, lister_class, esclass, arc_prefix, prepare=None):
+        lister = self.make_lister(loc_type, lister_class, 'scrape', self._journal)
+        lister.load_file_name_lists()
+        lister.load_pending_file_objects()
+        self._unsettled_files[lister_class] = lister.count_unsettled()
+        self.log_walker_counts(lister)
+        self._logger.info("File lister loaded with %s files", len(lister))
+        metrics = get_metrics()
+        file_type = lister.get_file_type()
+        metrics.inc('files_listed_total', len(lister), file_type=file_type)
+        es_link = self.get_es_link(esclass)
+        finished_names = lister.done_file_names()
+        failed_names = set()
+        counts = { 'into_es': 0 }
+        def batches():
+            for f in lister:
+                ordinal = lister.resume_point(f)
+                key = self._journal.file_key(f.name(), lister.file_stat(f))
+                records = lister.iter_new_records(f, ordinal)
+                finished = False
+                while not finished:
+                    batch = list(itertools.islice(records, es_link.bulk_docs))
+                    finished = len(batch) < es_link.bulk_docs
+                    for r in batch:
+                        r.es_id = FileJournal.document_id(key, ordinal)
+                        ordinal += 1
+                    metrics.inc('records_parsed_total', len(batch), file_type=file_type)
+                    if prepare is not None and batch:
+                        prepare(batch)
+                    yield ( (f, ordinal, f.consumed_offset, finished), batch )
+                self._geo_cache.flush()
+                metrics.inc('bytes_read_total', f.bytes_read, file_type=file_type)
+        def on_results(progress, results):
+            (f, records_done, byte_offset, finished) = progress
+            if f.name() in failed_names:
+                return
+            errors = [ result for (ok, result) in results if not ok ]
+            if errors:
+                self._logger.error("Could not add %s records from %s to ES: %s", len(errors), f.name(), errors[0])
+                failed_names.add(f.name())
+                return
+            lister.record_progress(None, f, records_done, finished, byte_offset)
+            counts['into_es'] += len(results)
+            if finished:
+                self._logger.info("Added %s records from %s to ES", records_done, f.name())
+                if lister.finished_with(f):
+                    finished_names.append(f.name())
+        try:
+            BulkShipper(es_link, self._cfg.get_es_info().get('es_in_flight')).ship(batches(), on_results)
+        finally:
+            # Whatever happened, files that were finished with are done with:
+            if finished_names:
+                self._archiver.archive(arc_prefix, finished_names)
+                count_files_removed = FileLister.delete_files(finished_names, self._journal)
+                self._logger.info("Archived and removed %s files", count_files_removed)
+        if failed_names:
+            raise Exception("Could not add all the records from " + ', '.join(sorted(failed_names))
+                            + " to ElasticSearch!")
+        return counts['into_es']
+
+    """
+        Direct mode: before a batch of download records is sent, send
+        the contents of the downloaded files that aren't in Elasticsearch
+        yet, under their hashes, and take the contents out of the
+        records, as SessionDownloadDaoLocal does when they're saved.
+    """
+    def ship_download_contents(self, records):
+        contents = {}
+        for r in records:
+            if r.sha256 and (r.contents or not r.file_size):
+                contents[r.sha256] = (r.file_size, r.contents)
+                r.contents = ''
+        if not contents:
+            return
+        es_link = self.get_es_link(DownloadContentDaoES)
+        already_there = es_link.existing_ids(contents.keys())
+        to_send = [ DownloadContentRecord(h, *contents[h]) for h in sorted(contents) if h not in already_there ]
+        failed = [ result for (ok, result) in es_link.insert_bulk(to_send) if not ok ]
+        if failed:
+            raise Exception("Could not add the contents of " + str(len(failed)) + " downloads to ElasticSearch: "
+                            + str(failed[0]))
+
+    def log_walker_counts(self, lister):
+        walker = lister.get_walker()
+        self._logger.info("%s: scanned %s directories, %s entries; %s files stat'ed",
+                          lister.__class__.__name__, walker.dirs_scanned,
+                          walker.entries_scanned, walker.stats_done)
+
     def scrape_session_log_records(self):
         return self.scrape_honssh_files('session_dir', SessionLogFileLister, SessionLogDaoLocal)
     
@@ -111,41 +365,101 @@ class Pogo(object ):
     def put_records_into_es(self, localdaoclass, esclass, recordclass):
             db_local = localdaoclass(self._dba)
             aservice = ServiceLocal(db_local)
-            es_link = esclass(self._cfg.get_es_info())
-            rows = aservice.get_non_processed()
-            total_to_add = len(rows)
+            es_link = self.get_es_link(esclass)
+            total_to_add = aservice.count_non_processed()
             self._logger.info("Found %s records not yet put into ES", total_to_add)
             print "Found " + str(total_to_add) + " records not yet put into ES"
-            num_into_es = 0
-            for row in rows:
-                r = recordclass()
-                i = 0
-                for fld in db_local.get_insert_fields():
-                    setattr(r, fld, row[i+2])
-                    i += 1
-                es_id = es_link.insert_single(r)
-                if es_id:
-                    try:
-                        db_id = row[0]
-                        aservice.update_with_es_id(db_id, es_id)
-                    except sqlite3.Error as e:
-                        self._logger.error("Could not update record in local db", exc_info = True)
-                        print "Could not update record with database id " + str(row[0]) + " in local database!"
-                        raise e
-                    num_into_es += 1
-                    # emit progress indication...
-                    if (self._logger.isEnabledFor(logging.INFO)):
-                        if num_into_es % 50 == 0:
-                            self._logger.info("Added to ES: %s of %s...", num_into_es, total_to_add)
-                else:
-                    raise Exception("Could not add record with database id " + str(row[0]) + " to ElasticSearch!")
-            return num_into_es
+            counts = { 'into_es': 0 }
+            failed_db_ids = []
+            # Ship the rows in batches; each batch is a single _bulk request
+            # (or a few, if the documents are large). Batches are read from
+            # the database as they're needed, and up to es_in_flight of them
+            # are sent at the same time; the reading waits for answers, so
+            # only a few batches are ever in memory at once.
+            batches = ( ( [ row[0] for row in batch ],
+                          [ self.record_from_row(db_local, recordclass, row) for row in batch ] )
+                        for batch in aservice.iter_non_processed(es_link.bulk_docs) )
+            def on_results(db_ids, results):
+                es_ids = []
+                for db_id, (ok, result) in zip(db_ids, results):
+                    if not ok:
+                        self._logger.error("Could not add record with database id %s to ES: %s", db_id, result)
+                        failed_db_ids.append(db_id)
+                        continue
+                    es_ids.append( (db_id, result) )
+                # Record the whole batch's ES ids in one transaction:
+                try:
+                    aservice.update_with_es_ids(es_ids)
+                except sqlite3.Error as e:
+                    self._logger.error("Could not update records in local db", exc_info = True)
+                    print "Could not update records with database ids " + ', '.join(str(i) for (i, _) in es_ids) + " in local database!"
+                    raise e
+                counts['into_es'] += len(es_ids)
+                # emit progress indication...
+                self._logger.info("Added to ES: %s of %s...", counts['into_es'], total_to_add)
+            BulkShipper(es_link, self._cfg.get_es_info().get('es_in_flight')).ship(batches, on_results)
+            if failed_db_ids:
+                raise Exception("Could not add " + str(len(failed_db_ids)) + " records to ElasticSearch! "
+                                + "Database ids: " + ', '.join(str(i) for i in failed_db_ids))
+            return counts['into_es']
+
+    """
+        Make a dto record from a row read from the local database.
+        The first two columns of the row are db_id and es_id; the
+        rest are in the same order as the dao's insert fields.
+    """
+    @staticmethod
+    def record_from_row(db_local, recordclass, row):
+        r = recordclass()
+        i = 0
+        for fld in db_local.get_insert_fields():
+            setattr(r, fld, row[i+2])
+            i += 1
+        return r
         
     def put_session_log_records_into_es(self):
         return self.put_records_into_es(SessionLogDaoLocal, SessionLogDaoES, SessionLogRecord)
         
     def put_session_download_records_into_es(self):
+        self.put_download_contents_into_es()
         return self.put_records_into_es(SessionDownloadDaoLocal, SessionDownloadDaoES, SessionDownloadFileRecord)
+
+    """
+        Ship the contents of downloaded files that aren't in Elasticsearch
+        yet, each under its hash. Any that turn out to be there already
+        (shipped by an earlier run, or by another honeypot) are just
+        marked as shipped, without being sent.
+    """
+    def put_download_contents_into_es(self):
+        content_local = DownloadContentDaoLocal(self._dba)
+        es_link = self.get_es_link(DownloadContentDaoES)
+        num_sent = 0
+        num_already_there = 0
+        failed = []
+        last_hash = ''
+        while True:
+            hashes = content_local.list_unshipped(last_hash, es_link.bulk_docs)
+            if not hashes:
+                break
+            last_hash = hashes[-1]
+            already_there = es_link.existing_ids(hashes)
+            to_send = [ h for h in hashes if h not in already_there ]
+            # Read the contents one file at a time, as they're sent:
+            records = ( DownloadContentRecord(h, *content_local.get(h)) for h in to_send )
+            shipped = list(already_there)
+            for h, (ok, result) in zip(to_send, es_link.insert_bulk(records)):
+                if ok:
+                    shipped.append(h)
+                else:
+                    self._logger.error("Could not add contents with hash %s to ES: %s", h, result)
+                    failed.append(h)
+            content_local.mark_shipped(shipped)
+            num_sent += len(shipped) - len(already_there)
+            num_already_there += len(already_there)
+        self._logger.info("Download contents: %s sent to ES, %s were already there", num_sent, num_already_there)
+        if failed:
+            raise Exception("Could not add the contents of " + str(len(failed)) + " downloads to ElasticSearch!")
+        return num_sent
         
     def put_session_recordings_into_es(self):
         return self.put_records_into_es(SessionRecordingDaoLocal, SessionRecordingDaoES, SessionRecordingRecord)
@@ -158,13 +472,12 @@ class Pogo(object ):
     
     
     def prune_honssh_records(self, loc_type, lister_class, dao_local_class):
-        source_dir = self._cfg.get_locations()[loc_type]
-        honssh_type = self._cfg.get_honssh_type()
-        lister = lister_class(source_dir, honssh_type)
+        lister = self.make_lister(loc_type, lister_class, 'prune')
         #source_dir = self._cfg.get_locations()[loc_type]
         #lister = lister_class(source_dir)
 #         lister = lister_class(self._cfg, loc_type)
         lister.load_file_name_lists()
+        self.log_walker_counts(lister)
         self._logger.info("Found %s files to prune", len(lister._done_file_names) )
         print "Found {0} files to prune".format(len(lister._done_file_names))
         count_files_removed = lister.delete_done_files()
@@ -184,7 +497,10 @@ class Pogo(object ):
         return self.prune_honssh_records('session_dir', SessionLogFileLister, SessionLogDaoLocal)
     
     def prune_session_download_records(self):
-        return self.prune_honssh_records('session_dir', SessionDownloadFileLister, SessionDownloadDaoLocal)
+        result = self.prune_honssh_records('session_dir', SessionDownloadFileLister, SessionDownloadDaoLocal)
+        count_pruned = DownloadContentDaoLocal(self._dba).prune()
+        self._logger.info("Removed the contents of %s downloaded files from local database", count_pruned)
+        return result
     
     def prune_session_recordings(self):
         return self.prune_honssh_records('session_dir', SessionRecordingFileLister, SessionRecordingDaoLocal)
@@ -194,45 +510,338 @@ class Pogo(object ):
     
     def prune_log_records(self):
         return self.prune_honssh_records('log_dir', LogFileLister, LogRecordDaoLocal)
+
+    """
+        Archive and delete files whose records have all been put into
+        Elasticsearch, then remove the shipped records from the local
+        database. Used by run_pipelined(), as each group of files is shipped.
+    """
+    def archive_and_prune_files(self, arc_prefix, dao_local_class, file_names):
+        self._archiver.archive(arc_prefix, file_names)
+        count_files_removed = FileLister.delete_files(file_names, FileStateDaoLocal(self._dba))
+        count_db_rows_deleted = ServiceLocal(dao_local_class(self._dba)).delete_finished_records()
+        self._logger.info("Archived and removed %s files; removed %s records from local database",
+                          count_files_removed, count_db_rows_deleted)
+        return file_names
     
-    def main(self):
-        td = self._arc_dir
-        files_scraped = self.scrape_attempt_records()
-        if len(files_scraped) > 0:
-            arc_name = generate_archive_name(td + os.sep + 'HonSSH_Attempts-')
-            archive_file_list(arc_name, files_scraped)
-#         self.scrape_log_records()
-        files_scraped = self.scrape_session_download_files()
-        if len(files_scraped) > 0:
-            arc_name = generate_archive_name(td + os.sep + 'HonSSH_Session_Downloads-')
-            archive_file_list(arc_name, files_scraped)
+    """
+        One entry for each type of HonSSH data: the scrape, ship
+        and prune methods for that type, plus the prefix for its
+        archive files. Scraping of log records is turned off for now,
+        but any log records already in the local database are still
+        shipped and pruned.
+        iter_scrape and prune_files are the versions of scrape and
+        prune used by run_pipelined(), which work a file at a time.
+    """
+    def record_type_pipelines(self):
+        td = self._arc_dir + os.sep
+        def pipeline(scrape, arc_prefix, put, prune, loc_type, lister_class, dao_local_class,
+                     esclass, prepare=None):
+            scrape = self.timed('scrape', esclass, scrape)
+            put = self.timed('ship', esclass, put)
+            prune = self.timed('prune', esclass, prune)
+            if scrape is None:
+                iter_scrape = None
+                direct = None
+            else:
+                iter_scrape = functools.partial(self.iter_scraped_files, loc_type, lister_class, dao_local_class)
+                direct = self.timed('direct', esclass,
+                    functools.partial(self.ship_direct, loc_type, lister_class, esclass, arc_prefix, prepare))
+            prune_files = functools.partial(self.archive_and_prune_files, arc_prefix, dao_local_class)
+            return RecordPipeline(scrape, arc_prefix, put, prune, iter_scrape, prune_files, direct)
+        return [
+            pipeline(self.scrape_attempt_records, td + 'HonSSH_Attempts-',
+                self.put_attempt_records_into_es, self.prune_attempt_records,
+                'attempt_dir', AttemptFileLister, AttemptRecordDaoLocal, AttemptRecordDaoES),
+            pipeline(None, None,
+                self.put_log_records_into_es, self.prune_log_records,
+                'log_dir', LogFileLister, LogRecordDaoLocal, LogRecordDaoES),
+            pipeline(self.scrape_session_download_files, td + 'HonSSH_Session_Downloads-',
+                self.put_session_download_records_into_es, self.prune_session_download_records,
+                'session_dir', SessionDownloadFileLister, SessionDownloadDaoLocal, SessionDownloadDaoES,
+                self.ship_download_contents),
+            pipeline(self.scrape_session_log_records, td + 'HonSSH_Session_Logs-',
+                self.put_session_log_records_into_es, self.prune_session_log_records,
+                'session_dir', SessionLogFileLister, SessionLogDaoLocal, SessionLogDaoES),
+            pipeline(self.scrape_session_recordings, td + 'HonSSH_Session_Recordings-',
+                self.put_session_recordings_into_es, self.prune_session_recordings,
+                'session_dir', SessionRecordingFileLister, SessionRecordingDaoLocal, SessionRecordingDaoES),
+            ]
 
-        files_scraped = self.scrape_session_log_records()
-        if len(files_scraped) > 0:
-            arc_name = generate_archive_name(td + os.sep + 'HonSSH_Session_Logs-')
-            archive_file_list(arc_name, files_scraped)
+    """
+        Wrap one step (stage) for one type of data so
+        that the time it takes is added to the metrics.
+    """
+    @staticmethod
+    def timed(stage, esclass, step):
+        if step is None:
+            return None
+        doc_type = esclass.DOCUMENT_TYPE
+        def timed_step(*args):
+            with get_metrics().timer('stage_seconds', stage=stage, doc_type=doc_type):
+                return step(*args)
+        return timed_step
 
-        files_scraped = self.scrape_session_recordings()
+    def scrape_and_archive(self, scrape, arc_prefix):
+        if scrape is None:
+            return
+        files_scraped = scrape()
         if len(files_scraped) > 0:
-            arc_name = generate_archive_name(td + os.sep + 'HonSSH_Session_Recordings-')
-            archive_file_list(arc_name, files_scraped)
-        
-        self.put_attempt_records_into_es()
-        self.put_log_records_into_es()
-        self.put_session_download_records_into_es()
-        self.put_session_log_records_into_es()
-        self.put_session_recordings_into_es()
-        
-        self.prune_attempt_records()
-        self.prune_log_records()
-        self.prune_session_download_records()
-        self.prune_session_log_records()
-        self.prune_session_recordings()
+            self._archiver.archive(arc_prefix, files_scraped)
+
+    """
+        Scrape, ship and prune a single type of data.
+    """
+    def run_pipeline(self, pipeline):
+        if self._journal is not None:
+            return self.run_direct(pipeline)
+        if self._cfg.get_pipelined():
+            return self.run_pipelined(pipeline)
+        self.scrape_and_archive(pipeline.scrape, pipeline.arc_prefix)
+        pipeline.put()
+        pipeline.prune()
+
+    """
+        Direct mode: send a single type of data straight to Elasticsearch.
+        Anything left in the local database from before direct mode was
+        turned on is then shipped and pruned as usual.
+    """
+    def run_direct(self, pipeline):
+        if pipeline.direct is not None:
+            pipeline.direct()
+        pipeline.put()
+        pipeline.prune()
+
+    """
+        Scrape, ship and prune a single type of data, with the three
+        steps overlapping: each file's records are shipped as soon as the
+        file has been scraped, while the next files are being scraped, and
+        files are archived and deleted as soon as their records are shipped.
+        Each step runs in its own thread (see service.pipeline.Pipeline).
+        Files that pile up while a step is busy are handled together the
+        next time round, so shipping and archiving happen in groups.
+        Once all the files have been through, the usual ship and prune
+        steps are run once, for anything left from earlier runs.
+    """
+    def run_pipelined(self, pipeline):
+        def ship(file_names):
+            pipeline.put()
+            return file_names
+        stages = [ ship, pipeline.prune_files ]
+        source = pipeline.iter_scrape() if pipeline.iter_scrape is not None else []
+        Pipeline(stages, Pogo.PIPELINE_QUEUE_SIZE).run(source)
+        pipeline.put()
+        pipeline.prune()
+
+    """
+        Run the pipelines for all types of data at the same time, in
+        a pool of worker threads. Each pipeline spends most of its time
+        waiting for the disk or for Elasticsearch, so the run takes
+        about as long as the slowest pipeline, rather than the sum of
+        them all. The local database connection is shared, and
+        LocalDBAccessor.lock makes sure only one thread writes to it
+        at a time.
+    """
+    def main_concurrent(self, workers):
+        pool = ThreadPool(workers)
+        try:
+            pool.map(self.run_pipeline, self.record_type_pipelines())
+        finally:
+            pool.close()
+            pool.join()
+
+    """
+        Go through all the steps once, for whatever's there, then
+        write out the metrics for the run.
+    """
+    def main(self):
+        metrics = get_metrics()
+        snapshot = metrics.snapshot()
+        try:
+            with metrics.timer('run_seconds'):
+                self.run_all()
+        finally:
+            self.write_metrics(snapshot)
 
+    """
+        Write the metrics to the files named in the [metrics] config
+        section: a Prometheus text file with the totals since pogo
+        started, and a line of JSON summing up the run that began at
+        snapshot. Failing to write them doesn't fail the run.
+    """
+    def write_metrics(self, snapshot):
+        metrics = get_metrics()
+        tz = get_time_converter()
+        for (cache, hits, misses) in (('geo', self._geo_cache.hits, self._geo_cache.misses),
+                                      ('timezone', tz.hits, tz.misses)):
+            metrics.set('cache_hits', hits, cache=cache)
+            metrics.set('cache_misses', misses, cache=cache)
+            metrics.set('cache_hit_ratio', float(hits) / (hits + misses) if hits + misses else 0.0, cache=cache)
+        metrics.set('geo_cache_store_hits', self._geo_cache.store_hits)
+        metrics.set('last_run_timestamp_seconds', time.time())
+        m = self._cfg.get_metrics_info()
+        try:
+            if m['prometheus_file']:
+                metrics.write_prometheus(m['prometheus_file'])
+            if m['json_file']:
+                metrics.write_json(m['json_file'], snapshot)
+        except (IOError, OSError):
+            self._logger.error("Could not write metrics", exc_info = True)
+
+    def run_all(self):
+        self._session_trees = {}
+        if self._journal is not None:
+            self._journal.compact()
+        workers = self._cfg.get_workers()
+        if workers > 1:
+            return self.main_concurrent(workers)
+        pipelines = self.record_type_pipelines()
+        if self._journal is not None:
+            for p in pipelines:
+                self.run_direct(p)
+            return
+        if self._cfg.get_pipelined():
+            for p in pipelines:
+                self.run_pipelined(p)
+            return
+        for p in pipelines:
+            self.scrape_and_archive(p.scrape, p.arc_prefix)
+        for p in pipelines:
+            p.put()
+        for p in pipelines:
+            p.prune()
+
+
+    """
+        Keep running, going through all the steps each time files appear
+        in or change in HonSSH's directories. After the first change,
+        pogo waits batch_window seconds for more, so that a burst of
+        activity is handled in one go, with fewer, bigger requests to
+        Elasticsearch. Session files are processed once inotify has seen
+        them closed, and they haven't changed for settle_time seconds
+        since; while there are files waiting to settle, pogo checks back
+        every settle_time seconds even if nothing else happens. Anything
+        else is processed the next day, so pogo also runs when the day
+        changes. If a run fails (for instance because Elasticsearch
+        can't be reached), it's tried again after retry_interval seconds.
+        Runs until SIGTERM or SIGINT.
+    """
+    def daemon(self):
+        d = self._cfg.get_daemon_info()
+        self._settle_time = float(d['settle_time'])
+        batch_window = float(d['batch_window'])
+        retry_interval = float(d['retry_interval'])
+        locations = self._cfg.get_locations()
+        watcher = DirectoryWatcher([ locations['attempt_dir'], locations['log_dir'], locations['session_dir'] ],
+                                   d['poll_interval'], appended_dirs=[ locations['attempt_dir'], locations['log_dir'] ])
+        self._watcher = watcher
+        def stop(signum, frame):
+            self._logger.info("Got signal %s; stopping", signum)
+            self._stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self._logger.info("Starting daemon mode")
+        run_due = True # catch up with anything left from before we started
+        last_run_day = None
+        try:
+            while not self._stopping:
+                if run_due:
+                    try:
+                        last_run_day = datetime.date.today()
+                        self.main()
+                        run_due = False
+                    except Exception:
+                        self._logger.error("Run failed; will try again in %s seconds", retry_interval, exc_info = True)
+                        self.sleep(retry_interval)
+                        continue
+                unsettled = sum(self._unsettled_files.values())
+                timeout = self._settle_time if unsettled else watcher.poll_interval
+                changed = watcher.wait(timeout)
+                if changed:
+                    self._logger.info("%s files changed", len(changed))
+                    # Let more changes pile up before doing anything:
+                    deadline = time.time() + batch_window
+                    while not self._stopping and time.time() < deadline:
+                        changed |= watcher.wait(deadline - time.time())
+                    run_due = True
+                elif unsettled or datetime.date.today() != last_run_day:
+                    run_due = True
+        finally:
+            watcher.close()
+        self._logger.info("Daemon mode stopped")
+
+    """
+        Sleep for up to seconds, waking early if told to stop.
+    """
+    def sleep(self, seconds):
+        deadline = time.time() + seconds
+        while not self._stopping and time.time() < deadline:
+            time.sleep(min(1, deadline - time.time()))
+
+
+"""
+    'pogo lookup PATTERN': list the archived files whose
+    names match PATTERN, from the archives' manifests.
+"""
+def lookup(archive_dir, pattern):
+    count = 0
+    for (archive_name, m) in find_members(archive_dir, pattern):
+        print "%s\t%s\t%s\t%s\t%s" % (archive_name, m['path'], m['size'],
+                                         time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(m['mtime'])), m['sha256'])
+        count += 1
+    return count
+
+"""
+    'pogo extract PATTERN': copy the archived files whose names
+    match PATTERN into dest_dir, under their paths in the archives,
+    decompressing only the parts of the archives they're in. Files
+    already there (say, the same file from an earlier archive) are
+    left alone, and members whose paths would lead out of dest_dir
+    are skipped.
+"""
+def extract(archive_dir, pattern, dest_dir):
+    count = 0
+    for (archive_name, m) in find_members(archive_dir, pattern):
+        dest = os.path.join(dest_dir, os.path.normpath(m['path'].lstrip('/')))
+        if not os.path.realpath(dest).startswith(os.path.realpath(dest_dir) + os.sep):
+            print "Skipping %s from %s: it would be outside %s" % (m['path'], archive_name, dest_dir)
+            continue
+        if os.path.exists(dest):
+            print "Not extracting %s from %s: %s is already there" % (m['path'], archive_name, dest)
+            continue
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        with open(dest, 'wb') as out:
+            extract_member(archive_name, m, out)
+        print "%s -> %s" % (m['path'], dest)
+        count += 1
+    return count
 
 def main():
+    parser = argparse.ArgumentParser(prog='pogo', description='Put HonSSH data into Elasticsearch.')
+    parser.add_argument('command', nargs='?', choices=('run', 'daemon', 'lookup', 'extract'), default='run',
+                        help="'run' (the default) processes whatever is there and exits; "
+                             "'daemon' keeps running, processing files as they appear; "
+                             "'lookup' lists archived files matching PATTERN; "
+                             "'extract' copies them out of the archives")
+    parser.add_argument('pattern', nargs='?', metavar='PATTERN',
+                        help="for lookup and extract: shell-style pattern for the file names")
+    parser.add_argument('--to', default='.', metavar='DIR', help="for extract: where to put the files")
+    args = parser.parse_args()
+    if args.command in ('lookup', 'extract'):
+        if args.pattern is None:
+            parser.error(args.command + ' needs a PATTERN')
+        archive_dir = StretchConfig().get_locations()['archive_dir']
+        if args.command == 'lookup':
+            found = lookup(archive_dir, args.pattern)
+        else:
+            found = extract(archive_dir, args.pattern, args.to)
+        sys.exit(0 if found else 1)
     b = Pogo()
-    b.main()
+    if args.command == 'daemon':
+        b.daemon()
+    else:
+        b.main()
         
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+    Sends batches of records to Elasticsearch with several _bulk requests
+    in flight at once, so that the time spent waiting on the network for
+    one batch is used to read, convert and send the next ones.
+"""
+import collections
+from multiprocessing.pool import ThreadPool
+
+class BulkShipper(object):
+    DEFAULT_IN_FLIGHT = 4
+
+    """
+        es_link is the RecordDaoES to ship with. in_flight is the
+        largest number of batches sent but not yet answered.
+    """
+    def __init__(self, es_link, in_flight=None):
+        if es_link is None:
+            raise ValueError("BulkShipper needs a RecordDaoES object")
+        self._es_link = es_link
+        self.in_flight = max(1, int(in_flight or BulkShipper.DEFAULT_IN_FLIGHT))
+
+    """
+        batches is an iterable of (keys, records) pairs: a list of
+        records, and a list of something identifying each of them (for
+        instance their db_ids). For each batch, once Elasticsearch has
+        answered, on_results(keys, results) is called, in the calling
+        thread and in the same order as batches, with results as returned
+        by RecordDaoES.insert_bulk().
+        The next batch is only taken from batches when fewer than
+        in_flight are waiting for an answer, so a batch reader can't
+        get more than in_flight batches ahead of the answers.
+        Returns the number of batches shipped.
+    """
+    def ship(self, batches, on_results):
+        if self.in_flight == 1:
+            count = 0
+            for (keys, records) in batches:
+                on_results(keys, self._es_link.insert_bulk(records))
+                count += 1
+            return count
+        pool = ThreadPool(self.in_flight)
+        pending = collections.deque()
+        count = 0
+        try:
+            for (keys, records) in batches:
+                if len(pending) >= self.in_flight:
+                    self._finish_oldest(pending, on_results)
+                pending.append( (keys, pool.apply_async(self._es_link.insert_bulk, (records, ))) )
+                count += 1
+            while pending:
+                self._finish_oldest(pending, on_results)
+        finally:
+            pool.close()
+            pool.join()
+        return count
+
+    def _finish_oldest(self, pending, on_results):
+        (keys, async_result) = pending.popleft()
+        # get() re-raises any exception raised by insert_bulk() in the worker thread.
+        on_results(keys, async_result.get())
@@ -0,0 +1,93 @@
+"""
+    Runs a series of processing stages at the same time, each in its own
+    thread, connected by bounded queues: while one stage works on an item,
+    the stage before it can already be working on the next one. The queues
+    being bounded means a fast stage can only get a few items ahead of a slow
+    one after it, so the time for the whole run comes to about the time
+    taken by the slowest stage.
+"""
+import Queue
+import threading
+
+# Put on a queue after the last item:
+_END = object()
+
+class Pipeline(object):
+    DEFAULT_QUEUE_SIZE = 4
+
+    """
+        stages is a list of functions. Each is called with a list of
+        one or more items -- all those waiting for it, up to max_batch
+        -- and returns a list of items for the next stage. What the
+        last stage returns is ignored.
+    """
+    def __init__(self, stages, queue_size=None, max_batch=None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self._stages = list(stages)
+        self._queue_size = int(queue_size or Pipeline.DEFAULT_QUEUE_SIZE)
+        self._max_batch = max_batch
+        self._errors = []
+        self._failed = threading.Event()
+
+    """
+        Feed each item from source to the first stage, and wait for all
+        the stages to finish. source is read in the calling thread, and
+        waits whenever the first stage is more than queue_size items behind.
+        If any stage raises an exception, no more items are read from source,
+        the items already in the pipeline are dropped, and the first exception
+        is raised again here once all the stages have stopped.
+    """
+    def run(self, source):
+        queues = [ Queue.Queue(self._queue_size) for stage in self._stages ]
+        threads = []
+        for i, stage in enumerate(self._stages):
+            out_queue = queues[i + 1] if i + 1 < len(queues) else None
+            t = threading.Thread(target=self._run_stage, args=(stage, queues[i], out_queue))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        try:
+            for item in source:
+                if self._failed.is_set():
+                    break
+                queues[0].put(item)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            queues[0].put(_END)
+            for t in threads:
+                t.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def _fail(self, e):
+        self._errors.append(e)
+        self._failed.set()
+
+    def _run_stage(self, stage, in_queue, out_queue):
+        finished = False
+        while not finished:
+            batch = []
+            item = in_queue.get()
+            while item is not _END:
+                batch.append(item)
+                if self._max_batch and len(batch) >= self._max_batch:
+                    break
+                try:
+                    item = in_queue.get_nowait()
+                except Queue.Empty:
+                    break
+            finished = item is _END
+            if not batch or self._failed.is_set():
+                continue
+            try:
+                results = stage(batch)
+            except Exception as e:
+                self._fail(e)
+                continue
+            if out_queue is not None:
+                for r in results or ():
+                    out_queue.put(r)
+        if out_queue is not None:
+            out_queue.put(_END)
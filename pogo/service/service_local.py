@@ -3,13 +3,30 @@
 """
 
 class ServiceLocal(object):
+    # Each record table has a partial index for each of these conditions
+    # (see data/migrations/003_shipping_indexes.sql). sqlite only uses a
+    # partial index for a query whose WHERE clause contains the index's
+    # condition word for word, so these must be kept the same as there.
+    PENDING = "es_id = ''"
+    SHIPPED = "es_id != ''"
+
     def __init__(self, dao_object):
         if dao_object is None:
             raise ValueError("ServiceLocal class needs a dao local object")
         self._do = dao_object
         
     def get_non_processed(self):
-        return self._do.list_where("es_id = ''")
+        return self._do.list_where(ServiceLocal.PENDING)
+
+    """
+        The records not yet shipped, in batches of at most
+        batch_size rows, read one batch at a time.
+    """
+    def iter_non_processed(self, batch_size):
+        return self._do.iter_where(ServiceLocal.PENDING, batch_size)
+
+    def count_non_processed(self):
+        return self._do.count_where(ServiceLocal.PENDING)
     
     def update_with_es_id(self, db_id, es_id):
         where_clause = "db_id = " + str(db_id)
@@ -17,11 +34,18 @@ class ServiceLocal(object):
         new_values = ( es_id, )
         self._do.update_where(fields, new_values, where_clause)
     
+    """
+        Like update_with_es_id(), for a whole batch of (db_id, es_id)
+        pairs, in one transaction.
+    """
+    def update_with_es_ids(self, es_ids):
+        return self._do.update_es_ids(es_ids)
+
     def delete_finished_records(self):
-        return self._do.delete_where("es_id != ''")
+        return self._do.delete_where(ServiceLocal.SHIPPED)
     
-    def write_new_records(self, records):
-        return self._do.insert_bulk(records)
+    def write_new_records(self, records, commit_every=None, on_commit=None):
+        return self._do.insert_bulk(records, commit_every, on_commit)
         
     def write_single_record(self, record):
         self._do.insert_single(record)
@@ -0,0 +1,461 @@
+"""
+    Creates the tar archives that scraped HonSSH files are put in before
+    they're deleted.
+
+    The tar stream is cut into blocks of BLOCK_SIZE bytes, and the blocks are
+    compressed at the same time, by a pool of threads -- zlib, lzma and
+    zstandard all let go of the GIL while they compress, so this uses as many
+    cores as there are threads. Each block is compressed on its own, as a
+    complete gzip member, xz stream or zstd frame, and the results are written
+    one after another, in order. Each of these formats allows that: gzip, xz
+    and zstd all decompress such a file as if it had been compressed in one
+    piece (this is how pigz and pixz work), and so do Python 2's gzip module
+    and backports.lzma. Python 2's bz2 module, and so tarfile, only reads the
+    first of several bzip2 streams, so bz2 archives are always compressed as
+    one stream, by one thread. With a single thread, the whole archive is
+    compressed as one stream, unless a manifest is wanted and the codec
+    allows blocks.
+
+    Next to each archive, a manifest (the archive's name plus MANIFEST_SUFFIX)
+    can be written, listing each file in the archive -- its path, size, mtime
+    and SHA-256 -- along with where to find it: the offset in the archive of
+    the compressed block its tar header starts in, and how far into that
+    block, once decompressed, the header is. Since each block can be
+    decompressed on its own, one file can be taken out of an archive by
+    decompressing only from the start of its block to its end.
+
+    The xz codec needs the optional backports.lzma package, and the zstd
+    codec the optional zstandard package.
+"""
+import bz2
+import collections
+from datetime import datetime
+import fnmatch
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import os.path
+import tarfile
+import time
+import zlib
+
+from pogo.util.metrics import get_metrics
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MANIFEST_SUFFIX = '.manifest'
+
+"""
+    A compression format: the extension of its archive files, the
+    level used if none is given, and a function that, given a level,
+    returns a new compressor object, with compress() and flush()
+    methods like those of zlib.compressobj(). make_decompressor
+    returns a new decompressor object, with a decompress() method
+    and an unused_data attribute, which holds whatever came after
+    the end of the compressed stream. concatenates is whether a file of
+    several compressed streams, one after another, can be read back, by
+    Python 2 as well as the usual tools, as if it were one.
+"""
+Codec = collections.namedtuple('Codec', 'extension default_level make_compressor make_decompressor concatenates')
+
+CODECS = {
+    # wbits of 16 + 15 makes zlib write and read a gzip header and trailer:
+    'gzip': Codec('.gz', 6, lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+                  lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), True),
+    'bz2': Codec('.bz2', 9, lambda level: bz2.BZ2Compressor(level), bz2.BZ2Decompressor, False),
+    'none': Codec('.tar', None, None, None, False),
+    }
+if lzma is not None:
+    CODECS['xz'] = Codec('.xz', 6, lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor,
+                         True)
+if zstandard is not None:
+    CODECS['zstd'] = Codec('.zst', 3, lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+                           lambda: zstandard.ZstdDecompressor().decompressobj(), True)
+
+
+def available_codecs():
+    return sorted(CODECS.keys())
+
+
+"""
+    The codec whose archive files end with this extension,
+    or 'none' if there isn't one.
+"""
+def codec_for_file_name(filename):
+    for (name, codec) in CODECS.items():
+        if codec.make_compressor is not None and filename.endswith(codec.extension):
+            return name
+    return 'none'
+
+
+"""
+    A file-like object that compresses what's written to it and writes the
+    result to out. With more than one thread, or if blocks is set, blocks of
+    block_size bytes are compressed each on its own -- with more than one
+    thread, at the same time; up to twice as many blocks as there are threads
+    are held in memory at once.
+"""
+class BlockCompressor(object):
+    def __init__(self, out, codec, level, threads, block_size, blocks=False):
+        self._out = out
+        self._codec = codec
+        self._level = level
+        self._block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Where in out each block starts:
+        self.block_starts = []
+        self._pool = None
+        self._stream = None
+        self._blocks = False
+        if codec.make_compressor is not None:
+            if threads > 1:
+                self._pool = ThreadPool(threads)
+                self._max_pending = 2 * threads
+                self._pending = collections.deque()
+                self._blocks = True
+            elif blocks:
+                self._blocks = True
+            else:
+                self._stream = codec.make_compressor(level)
+
+    def compress_block(self, data):
+        c = self._codec.make_compressor(self._level)
+        return c.compress(data) + c.flush()
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        if not self._blocks:
+            self._write_out(self._stream.compress(data) if self._stream is not None else data)
+        else:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self._block_size:
+                data = ''.join(self._buffer)
+                start = 0
+                while len(data) - start >= self._block_size:
+                    self._submit(data[start:start + self._block_size])
+                    start += self._block_size
+                self._buffer = [ data[start:] ]
+                self._buffered = len(data) - start
+
+    def _submit(self, block):
+        if self._pool is None:
+            self._write_block(self.compress_block(block))
+            return
+        if len(self._pending) >= self._max_pending:
+            self._write_block(self._pending.popleft().get())
+        self._pending.append(self._pool.apply_async(self.compress_block, (block, )))
+
+    def _write_block(self, data):
+        self.block_starts.append(self.bytes_out)
+        self._write_out(data)
+
+    def _write_out(self, data):
+        self._out.write(data)
+        self.bytes_out += len(data)
+
+    """
+        Given an offset in the uncompressed data, return the offset in
+        out of the block it's in, and the offset within that block once
+        it's been decompressed. Only valid after close().
+    """
+    def locate(self, offset):
+        if self._blocks:
+            i = offset // self._block_size
+            return (self.block_starts[i], offset - i * self._block_size)
+        if self._codec.make_compressor is None:
+            return (offset, 0)
+        return (0, offset)
+
+    """
+        Compress and write whatever hasn't been written yet.
+        This doesn't close out.
+    """
+    def close(self):
+        if self._stream is not None:
+            self._write_out(self._stream.flush())
+            self._stream = None
+        try:
+            if self._buffered:
+                self._submit(''.join(self._buffer))
+                self._buffer = []
+                self._buffered = 0
+            while self._pool is not None and self._pending:
+                # get() re-raises any exception raised while compressing.
+                self._write_block(self._pending.popleft().get())
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+"""
+    A file-like object that reads from f, which is positioned at the start
+    of a compressed block, decompressing that block and as many of the
+    following ones as are needed.
+"""
+class BlockReader(object):
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, f, codec):
+        self._f = f
+        self._codec = codec
+        self._decompressor = codec.make_decompressor()
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            data = self._f.read(BlockReader.READ_SIZE)
+            if not data:
+                break
+            self._buffer += self._decompress(data)
+        if size < 0:
+            size = len(self._buffer)
+        (result, self._buffer) = (self._buffer[:size], self._buffer[size:])
+        return result
+
+    def _decompress(self, data):
+        out = []
+        while data:
+            if getattr(self._decompressor, 'eof', False):
+                self._decompressor = self._codec.make_decompressor()
+            try:
+                out.append(self._decompressor.decompress(data))
+            except EOFError:
+                # The block ended exactly at the end of the last read, and
+                # the decompressor (Python 2's bz2 has no eof attribute)
+                # only found out when given the next block's data:
+                self._decompressor = self._codec.make_decompressor()
+                continue
+            # The block has ended, and the next one may have started:
+            data = self._decompressor.unused_data
+            if data:
+                self._decompressor = self._codec.make_decompressor()
+        return ''.join(out)
+
+
+"""
+    A file-like object that reads from f, and keeps
+    the SHA-256 and size of what's been read.
+"""
+class _HashingReader(object):
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class Archiver(object):
+    DEFAULT_CODEC = 'bz2'
+    BLOCK_SIZE = 1024 * 1024
+
+    """
+        codec is one of available_codecs(). level is the compression
+        level, or None for the codec's default. threads is the number
+        of blocks compressed at the same time; 0 means one per CPU. Codecs
+        whose streams can't be joined one after another (bz2) always use
+        one thread.
+        If split_size isn't 0, the files are spread over as many
+        archives as it takes to keep the total size of the files in
+        each one under split_size bytes (a file bigger than that gets
+        an archive to itself). If manifest is set, each archive gets a
+        manifest; for bz2, whose archives are a single stream, finding a
+        file from it still means decompressing from the start.
+    """
+    def __init__(self, codec=None, level=None, threads=0, split_size=0, manifest=False):
+        codec = codec or Archiver.DEFAULT_CODEC
+        if codec not in CODECS:
+            raise ValueError('Unsupported archive codec: ' + codec + '; available codecs are '
+                             + ', '.join(available_codecs()))
+        self.codec = codec
+        self._codec = CODECS[codec]
+        self.level = int(level) if level not in (None, '') else self._codec.default_level
+        self.threads = int(threads or 0) or multiprocessing.cpu_count()
+        if not self._codec.concatenates:
+            self.threads = 1
+        self.split_size = int(split_size or 0)
+        self.manifest = bool(int(manifest or 0))
+
+    @staticmethod
+    def from_config(arc_info):
+        return Archiver(arc_info.get('codec'), arc_info.get('level'), arc_info.get('threads'),
+                        arc_info.get('split_size'), arc_info.get('manifest'))
+
+    """
+        The name for a new archive: prefix, followed by the current date
+        and time, then the part number (if there's more than one part),
+        then the codec's extension.
+    """
+    def archive_name(self, prefix, part=None):
+        name = (prefix or '') + datetime.utcnow().isoformat()
+        if part is not None:
+            name += '.%03d' % part
+        return name + self._codec.extension
+
+    """
+        Split file_names into lists whose files add up to no more
+        than split_size bytes.
+    """
+    def split(self, file_names):
+        if not self.split_size:
+            return [ list(file_names) ] if file_names else []
+        groups = []
+        group = []
+        group_size = 0
+        for fn in file_names:
+            size = os.path.getsize(fn)
+            if group and group_size + size > self.split_size:
+                groups.append(group)
+                group = []
+                group_size = 0
+            group.append(fn)
+            group_size += size
+        if group:
+            groups.append(group)
+        return groups
+
+    """
+        Archive the given files, in one archive or (if split_size is set)
+        several, named by archive_name(prefix). Returns the archive names.
+    """
+    def archive(self, prefix, file_names):
+        groups = self.split(file_names)
+        names = []
+        for (i, group) in enumerate(groups):
+            name = self.archive_name(prefix, i + 1 if len(groups) > 1 else None)
+            self.write(name, group)
+            names.append(name)
+        return names
+
+    """
+        Create the archive filename holding the given files, and its
+        manifest if wanted, and log how fast it was compressed.
+    """
+    def write(self, filename, file_names):
+        started = time.time()
+        members = []
+        with open(filename, 'wb') as out:
+            # A manifest can point into the middle of an archive only if it's
+            # made of blocks, which codecs that can't join streams don't allow:
+            compressor = BlockCompressor(out, self._codec, self.level, self.threads,
+                                         Archiver.BLOCK_SIZE, self.manifest and self._codec.concatenates)
+            try:
+                with tarfile.open(fileobj=compressor, mode='w|') as tf:
+                    for fn in file_names:
+                        members.append(self.add_file(tf, fn))
+            finally:
+                compressor.close()
+        if self.manifest:
+            write_manifest(filename, self.codec, compressor, members)
+        elapsed = max(time.time() - started, 1e-6)
+        metrics = get_metrics()
+        metrics.observe('archive_seconds', elapsed, codec=self.codec)
+        metrics.inc('archive_files_total', len(file_names), codec=self.codec)
+        metrics.inc('archive_bytes_in_total', compressor.bytes_in, codec=self.codec)
+        metrics.inc('archive_bytes_out_total', compressor.bytes_out, codec=self.codec)
+        logging.info("Archived %s files to %s with %s: %s bytes in, %s bytes out, %.1f MB/s with %s threads",
+                     len(file_names), filename, self.codec, compressor.bytes_in, compressor.bytes_out,
+                     compressor.bytes_in / elapsed / 1e6, self.threads)
+        return compressor
+
+    """
+        Add a file to the archive, as TarFile.add() does, hashing
+        it on the way. Returns its manifest entry, with the offset
+        of its header in the uncompressed tar stream.
+    """
+    @staticmethod
+    def add_file(tf, fn):
+        offset = tf.offset
+        tarinfo = tf.gettarinfo(fn)
+        sha256 = None
+        if tarinfo.isreg():
+            with open(fn, 'rb') as f:
+                reader = _HashingReader(f)
+                tf.addfile(tarinfo, reader)
+                sha256 = reader.sha256.hexdigest()
+        else:
+            tf.addfile(tarinfo)
+        return { 'path': tarinfo.name, 'size': tarinfo.size, 'mtime': tarinfo.mtime,
+                 'sha256': sha256, 'offset': offset }
+
+
+"""
+    Write the manifest for an archive just written by compressor.
+    It's a JSON document, written under a temporary name and then
+    renamed, so a manifest is never seen half-written.
+"""
+def write_manifest(filename, codec, compressor, members):
+    for m in members:
+        (m['block_offset'], m['offset_in_block']) = compressor.locate(m.pop('offset'))
+    manifest = { 'archive': os.path.basename(filename), 'codec': codec, 'members': members }
+    manifest_name = filename + MANIFEST_SUFFIX
+    with open(manifest_name + '.tmp', 'wb') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(manifest_name + '.tmp', manifest_name)
+
+
+"""
+    Generate (archive path, manifest entry) for each file, in all the
+    manifests in archive_dir, whose path matches pattern (a shell-style
+    pattern, matched against both the whole path and its last part).
+"""
+def find_members(archive_dir, pattern):
+    for manifest_name in sorted(glob.glob(os.path.join(archive_dir, '*' + MANIFEST_SUFFIX))):
+        with open(manifest_name, 'rb') as f:
+            manifest = json.load(f)
+        archive_name = os.path.join(os.path.dirname(manifest_name), manifest['archive'])
+        for m in manifest['members']:
+            if fnmatch.fnmatch(m['path'], pattern) or fnmatch.fnmatch(os.path.basename(m['path']), pattern):
+                m['codec'] = manifest['codec']
+                yield (archive_name, m)
+
+
+"""
+    Copy one file, described by its manifest entry, from archive_name
+    to out, decompressing only from the start of the block it's in.
+    Raises IOError if the copy's SHA-256 isn't the one in the manifest.
+"""
+def extract_member(archive_name, member, out):
+    codec = CODECS.get(member['codec'])
+    if codec is None:
+        raise ValueError('Unsupported archive codec: ' + member['codec'])
+    with open(archive_name, 'rb') as f:
+        f.seek(member['block_offset'])
+        reader = f if codec.make_decompressor is None else BlockReader(f, codec)
+        reader.read(member['offset_in_block'])
+        with tarfile.open(fileobj=reader, mode='r|') as tf:
+            tarinfo = tf.next()
+            if tarinfo is None or tarinfo.name != member['path']:
+                raise IOError('Manifest for ' + archive_name + ' is wrong about ' + member['path'])
+            src = _HashingReader(tf.extractfile(tarinfo))
+            while True:
+                data = src.read(BlockReader.READ_SIZE)
+                if not data:
+                    break
+                out.write(data)
+    if member['sha256'] is not None and src.sha256.hexdigest() != member['sha256']:
+        raise IOError('SHA-256 of ' + member['path'] + ' from ' + archive_name + " doesn't match its manifest")
@@ -15,6 +15,10 @@ class StretchConfig(object):
         self._settings = {
                         'debug': 0,
                         'honssh_type': 'SINGLE',
+                        'workers': 1,
+                        'max_blob_size': 52428800,
+                        'pipelined': False,
+                        'direct': False,
                         'locations': {
                                       'top_dir': def_top_dir,
                                       'log_dir': def_top_dir + os.sep + 'logs',
@@ -25,7 +29,11 @@ class StretchConfig(object):
                         'elasticsearch': {
                                           'es_host': 'localhost',
                                           'es_port': '9200',
-                                          'hon_index': 'hon_ssh'                  
+                                          'hon_index': 'hon_ssh',
+                                          'es_content_index': 'hon_ssh_contents',
+                                          'es_bulk_docs': '500',
+                                          'es_bulk_bytes': '5242880',
+                                          'es_in_flight': '4'
                                           },
                         'db_connection': {
                                           'type': 'sqlite',
@@ -33,11 +41,39 @@ class StretchConfig(object):
                                           'port': '',
                                           'user': '',
                                           'password': '',
-                                          'name': def_db_dir + os.sep + 'pogo.db'
+                                          'name': def_db_dir + os.sep + 'pogo.db',
+                                          'journal': def_db_dir + os.sep + 'direct.journal',
+                                          'insert_chunk_size': '1000',
+                                          'journal_mode': 'WAL',
+                                          'synchronous': 'NORMAL',
+                                          'cache_size': '-16384',
+                                          'mmap_size': '268435456',
+                                          'page_size': '4096'
                                           },
                           'logging': {
                                       'filename': 'CONSOLE',
                                       'level': 'WARNING'
+                                      },
+                          'geoip': {
+                                    'cache_size': '10000',
+                                    'persistent_cache': '1'
+                                    },
+                          'daemon': {
+                                     'settle_time': '60',
+                                     'batch_window': '5',
+                                     'poll_interval': '10',
+                                     'retry_interval': '60'
+                                     },
+                          'archive': {
+                                      'codec': 'bz2',
+                                      'level': '',
+                                      'threads': '0',
+                                      'split_size': '0',
+                                      'manifest': '1'
+                                      },
+                          'metrics': {
+                                      'prometheus_file': '',
+                                      'json_file': ''
                                       }
                         }
         
@@ -53,15 +89,23 @@ class StretchConfig(object):
         if cfg.has_section('main'):
             self._settings['debug'] = cfg.getboolean('main', 'debug')
             self._settings['honssh_type'] = cfg.get('main', 'honssh_type')
+            if cfg.has_option('main', 'workers'):
+                self._settings['workers'] = cfg.getint('main', 'workers')
+            if cfg.has_option('main', 'pipelined'):
+                self._settings['pipelined'] = cfg.getboolean('main', 'pipelined')
+            if cfg.has_option('main', 'direct'):
+                self._settings['direct'] = cfg.getboolean('main', 'direct')
+            if cfg.has_option('main', 'max_blob_size'):
+                self._settings['max_blob_size'] = cfg.getint('main', 'max_blob_size')
   
-        for section in ('locations', 'db_connection', 'elasticsearch', 'logging'):
+        for section in ('locations', 'db_connection', 'elasticsearch', 'logging', 'geoip', 'daemon', 'archive', 'metrics'):
             if cfg.has_section(section):
                 for item in cfg.items(section):
                     self._settings[section][item[0]] = item[1]
 
     def __str__(self, *args, **kwargs):
         retStr = 'StretchConfig: \n\tDebug: ' + str(self._settings['debug']) + '\n'
-        for section in ('locations', 'db_connection', 'elasticsearch', 'logging'):
+        for section in ('locations', 'db_connection', 'elasticsearch', 'logging', 'geoip', 'daemon', 'archive', 'metrics'):
             retStr += '\t' + section + ' section:\n'
             for key in self._settings[section]:
                 retStr += '\t\t' + key + ': ' + self._settings[section][key] + '\n'
@@ -79,8 +123,32 @@ class StretchConfig(object):
     def get_logging_info(self):
         return self._settings['logging']
     
+    def get_geoip_info(self):
+        return self._settings['geoip']
+    
+    def get_daemon_info(self):
+        return self._settings['daemon']
+    
+    def get_archive_info(self):
+        return self._settings['archive']
+    
+    def get_metrics_info(self):
+        return self._settings['metrics']
+    
     def get_honssh_type(self):
         return self._settings['honssh_type']
+    
+    def get_workers(self):
+        return self._settings['workers']
+    
+    def get_pipelined(self):
+        return self._settings['pipelined']
+    
+    def get_direct(self):
+        return self._settings['direct']
+    
+    def get_max_blob_size(self):
+        return self._settings['max_blob_size']
             
 
 if __name__ == '__main__':
@@ -0,0 +1,216 @@
+"""
+    Counters, gauges and timing histograms for each step of a pogo run,
+    broken down by type of data, so that throughput can be followed from
+    run to run and compared between honeypots.
+
+    Each measurement has a name and a set of labels, as in Prometheus.
+    They're kept in a single Metrics object (see get_metrics()), which
+    can write them out in two forms:
+        * a Prometheus text file, for node_exporter's textfile collector,
+          holding the totals since pogo started;
+        * a JSON summary of one run -- the difference since an earlier
+          snapshot() -- with rates worked out, appended as a line to a file.
+"""
+import bisect
+import copy
+import json
+import os
+import os.path
+import socket
+import threading
+import time
+
+_HOSTNAME = socket.gethostname()
+
+
+class _Timer(object):
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.elapsed = time.time() - self._started
+        self._metrics.observe(self._name, self.elapsed, **self._labels)
+        return False
+
+
+class Metrics(object):
+    PREFIX = 'pogo_'
+    # Upper bounds, in seconds, of the histograms' buckets:
+    BUCKETS = ( 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0 )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> value, where labels is a sorted tuple of (name, value) pairs:
+        self._counters = {}
+        self._gauges = {}
+        # (name, labels) -> [ count in each bucket, plus one for +Inf; sum; count ]
+        self._histograms = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, amount=1, **labels):
+        key = Metrics._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[Metrics._key(name, labels)] = value
+
+    """
+        Add a measurement, in seconds, to a histogram.
+    """
+    def observe(self, name, seconds, **labels):
+        key = Metrics._key(name, labels)
+        i = bisect.bisect_left(Metrics.BUCKETS, seconds)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = [ [0] * (len(Metrics.BUCKETS) + 1), 0.0, 0 ]
+                self._histograms[key] = h
+            h[0][i] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    """
+        A context manager that adds the time taken
+        by the code it wraps to a histogram.
+    """
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(Metrics._key(name, labels), 0)
+
+    def histogram_sum(self, name, **labels):
+        with self._lock:
+            h = self._histograms.get(Metrics._key(name, labels))
+            return h[1] if h is not None else 0.0
+
+    """
+        A copy of everything measured so far, to be passed to
+        summary() later on.
+    """
+    def snapshot(self):
+        with self._lock:
+            return (copy.deepcopy(self._counters), copy.deepcopy(self._histograms), time.time())
+
+    """
+        Write everything measured since pogo started to path, in the
+        Prometheus text format. The file is written under another name
+        and then renamed, so node_exporter never sees half of it.
+    """
+    def write_prometheus(self, path):
+        lines = []
+        with self._lock:
+            for (kind, values) in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted(set(k[0] for k in values)):
+                    lines.append('# TYPE %s%s %s' % (Metrics.PREFIX, name, kind))
+                    for key in sorted(k for k in values if k[0] == name):
+                        lines.append('%s%s%s %s' % (Metrics.PREFIX, name, _format_labels(key[1]), _format_value(values[key])))
+            for name in sorted(set(k[0] for k in self._histograms)):
+                lines.append('# TYPE %s%s histogram' % (Metrics.PREFIX, name))
+                for key in sorted(k for k in self._histograms if k[0] == name):
+                    (buckets, total, count) = self._histograms[key]
+                    cumulative = 0
+                    for (bound, n) in zip(Metrics.BUCKETS + ('+Inf', ), buckets):
+                        cumulative += n
+                        labels = key[1] + (('le', str(bound)), )
+                        lines.append('%s%s_bucket%s %s' % (Metrics.PREFIX, name, _format_labels(labels), cumulative))
+                    lines.append('%s%s_sum%s %s' % (Metrics.PREFIX, name, _format_labels(key[1]), _format_value(total)))
+                    lines.append('%s%s_count%s %s' % (Metrics.PREFIX, name, _format_labels(key[1]), count))
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        with open(path + '.tmp', 'wb') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(path + '.tmp', path)
+
+    """
+        A summary, as a dictionary, of what's been measured since the
+        given snapshot (or since pogo started): counters, gauges and,
+        for each histogram, its count, sum and mean, plus these rates:
+            * records_per_second: for each file type, records read
+              from files divided by the time spent on those files;
+            * docs_per_second: for each document type, documents put
+              into Elasticsearch divided by the time taken by the ship
+              (or direct) step for that type;
+            * archive_mb_per_second: for each codec, megabytes archived
+              divided by the time spent compressing.
+    """
+    def summary(self, since=None):
+        (old_counters, old_histograms, since_time) = since if since is not None else ({}, {}, self.started)
+        now = time.time()
+        with self._lock:
+            counters = dict( (k, v - old_counters.get(k, 0)) for (k, v) in self._counters.items() )
+            gauges = dict(self._gauges)
+            histograms = {}
+            for (k, (buckets, total, count)) in self._histograms.items():
+                old = old_histograms.get(k, (None, 0.0, 0))
+                histograms[k] = (total - old[1], count - old[2])
+        def named(values, name):
+            return dict( (dict(k[1]).values()[0] if k[1] else '', v) for (k, v) in values.items() if k[0] == name )
+        def per_second(amounts, seconds, scale=1.0):
+            return dict( (label, round(amounts[label] / scale / seconds[label], 1))
+                         for label in amounts if seconds.get(label) )
+        stage_seconds = {}
+        for ((name, labels), (total, count)) in histograms.items():
+            if name == 'stage_seconds' and dict(labels).get('stage') in ('ship', 'direct'):
+                doc_type = dict(labels)['doc_type']
+                stage_seconds[doc_type] = stage_seconds.get(doc_type, 0.0) + total
+        file_seconds = dict( (label, v[0]) for (label, v) in named(histograms, 'file_seconds').items() )
+        archive_seconds = dict( (label, v[0]) for (label, v) in named(histograms, 'archive_seconds').items() )
+        return {
+            'host': _HOSTNAME,
+            'started': since_time,
+            'finished': now,
+            'seconds': round(now - since_time, 3),
+            'counters': [ dict(k[1], name=k[0], value=v) for (k, v) in sorted(counters.items()) if v ],
+            'gauges': [ dict(k[1], name=k[0], value=v) for (k, v) in sorted(gauges.items()) ],
+            'histograms': [ dict(k[1], name=k[0], count=c, sum=round(t, 6), mean=round(t / c, 6))
+                            for (k, (t, c)) in sorted(histograms.items()) if c ],
+            'rates': {
+                'records_per_second': per_second(named(counters, 'records_parsed_total'), file_seconds),
+                'docs_per_second': per_second(named(counters, 'es_docs_total'), stage_seconds),
+                'archive_mb_per_second': per_second(named(counters, 'archive_bytes_in_total'), archive_seconds, 1e6),
+                },
+            }
+
+    """
+        Append summary(since) to path, as a single line of JSON.
+    """
+    def write_json(self, path, since=None):
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        with open(path, 'ab') as f:
+            f.write(json.dumps(self.summary(since), sort_keys=True) + '\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for (k, v) in labels) + '}'
+
+def _format_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+_metrics = Metrics()
+
+"""
+    The Metrics object that all of pogo's measurements go into.
+"""
+def get_metrics():
+    return _metrics
@@ -1,23 +1,179 @@
 import iso8601
-import time
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from tzlocal import get_localzone
 from geoip import geolite2
 import logging
 import os.path
 import sqlite3
 import sys
-import tarfile
+import threading
+
+from pogo.util.archive import Archiver, codec_for_file_name
         
 
-# Convert timestamp in local time to GMT:
-# Requires modules iso8601 and time
+"""
+    Converts timestamps written in local time to UTC strings in the
+    'YYYY-MM-DD HH:MM:SS' format used throughout pogo.
+
+    The local time zone is looked up once, when the converter is made.
+    Timestamps in the fixed 'YYYY-MM-DD HH:MM:SS' layout are taken apart
+    by slicing rather than by strptime, and the zone's UTC offset is
+    cached for each local hour, so that only the first timestamp in a
+    given hour pays for a time zone calculation. That relies on the
+    offset being the same all through the hour, which is true of most
+    zones, whose daylight savings transitions fall on the hour, but not
+    of those (like Australia/Lord_Howe or Pacific/Chatham) whose
+    transitions fall at :30 or :45. So the offset is looked up at both
+    ends of each hour, and an hour with a transition in it isn't cached:
+    each timestamp in it is converted on its own. Times that are
+    ambiguous because they fall in the repeated hour at the end of
+    daylight savings time are taken to be standard time, as before.
+"""
+class LocalTimeConverter(object):
+    UTC_FORMAT = '%04d-%02d-%02d %02d:%02d:%02d'
+    MAX_CACHED_HOURS = 100000
+
+    def __init__(self, tz=None):
+        self._tz = tz or get_localzone()
+        self._offsets = {}
+        # Local hours with a change of offset part way through:
+        self._transition_hours = set()
+        self.hits = 0
+        self.misses = 0
+
+    """
+        Return the UTC offset (a timedelta) of the local zone
+        at the given local time.
+    """
+    def _utc_offset(self, year, month, day, hour, minute, second):
+        key = (year, month, day, hour)
+        offset = self._offsets.get(key)
+        if offset is not None:
+            self.hits += 1
+            return offset
+        self.misses += 1
+        if key not in self._transition_hours:
+            offset = self._tz.localize(datetime(year, month, day, hour)).utcoffset()
+            if self._tz.localize(datetime(year, month, day, hour, 59, 59)).utcoffset() == offset:
+                if len(self._offsets) >= LocalTimeConverter.MAX_CACHED_HOURS:
+                    self._offsets.clear()
+                self._offsets[key] = offset
+                return offset
+            self._transition_hours.add(key)
+        return self._tz.localize(datetime(year, month, day, hour, minute, second)).utcoffset()
+
+    """
+        Split 'YYYY-MM-DD HH:MM:SS' (or 'YYYY-MM-DDTHH:MM:SS') into
+        a tuple of six ints. Anything else raises ValueError.
+    """
+    @staticmethod
+    def _split(s):
+        if (len(s) < 19 or s[4] != '-' or s[7] != '-' or s[10] not in ' T'
+                or s[13] != ':' or s[16] != ':'):
+            raise ValueError("Unrecognized date/time: " + s)
+        return ( int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                 int(s[11:13]), int(s[14:16]), int(s[17:19]) )
+
+    @staticmethod
+    def _format(dt):
+        return LocalTimeConverter.UTC_FORMAT % (dt.year, dt.month, dt.day,
+                                                dt.hour, dt.minute, dt.second)
+
+    def _local_to_utc(self, year, month, day, hour, minute, second):
+        local = datetime(year, month, day, hour, minute, second)
+        return local - self._utc_offset(year, month, day, hour, minute, second)
+
+    """
+        Convert 'YYYY-MM-DD HH:MM:SS' in local time to UTC.
+        Used for attempt files and session files, whose
+        timestamps carry no zone information.
+    """
+    def to_utc(self, datetime_string):
+        if not datetime_string:
+            return None
+        if len(datetime_string) == 19:
+            try:
+                return self._format(self._local_to_utc(*self._split(datetime_string)))
+            except ValueError:
+                pass
+        # Not in the usual layout -- let strptime sort it out:
+        d = datetime.strptime(datetime_string, "%Y-%m-%d %H:%M:%S")
+        return self._format(self._local_to_utc(d.year, d.month, d.day, d.hour, d.minute, d.second))
+
+    """
+        Convert a list of 'YYYY-MM-DD HH:MM:SS' strings at once.
+    """
+    def to_utc_many(self, datetime_strings):
+        to_utc = self.to_utc
+        return [ to_utc(s) for s in datetime_strings ]
+
+    """
+        Convert a timestamp like those in honssh.log,
+        '2015-03-04 12:00:01-0500', to UTC. If the timestamp
+        includes a UTC offset, that offset is used; otherwise it's
+        taken to be in local time.
+    """
+    def timestamp_to_utc(self, timestamp):
+        if not timestamp:
+            return None
+        try:
+            fields = self._split(timestamp)
+            offset = LocalTimeConverter._parse_offset(timestamp[19:])
+        except ValueError:
+            # Fractional seconds or some other less common layout:
+            d = iso8601.parse_date(timestamp, default_timezone=None)
+            fields = (d.year, d.month, d.day, d.hour, d.minute, d.second)
+            offset = d.utcoffset()
+        if offset is None:
+            return self._format(self._local_to_utc(*fields))
+        return self._format(datetime(*fields) - offset)
+
+    def timestamp_to_utc_many(self, timestamps):
+        timestamp_to_utc = self.timestamp_to_utc
+        return [ timestamp_to_utc(s) for s in timestamps ]
+
+    """
+        Parse '', 'Z', '+HHMM', '-HH:MM' or '+HH' into a timedelta;
+        '' gives None, meaning local time.
+    """
+    @staticmethod
+    def _parse_offset(s):
+        if not s:
+            return None
+        if s == 'Z':
+            return timedelta(0)
+        if s[0] not in '+-':
+            raise ValueError("Unrecognized UTC offset: " + s)
+        digits = s[1:].replace(':', '')
+        if len(digits) not in (2, 4) or not digits.isdigit():
+            raise ValueError("Unrecognized UTC offset: " + s)
+        offset = timedelta(hours=int(digits[0:2]), minutes=int(digits[2:4] or 0))
+        if s[0] == '-':
+            offset = -offset
+        return offset
+
+
+_time_converter = None
+
+"""
+    The LocalTimeConverter used by local_timestamp_to_gmt()
+    and local_no_tz_to_utc(). It's made on first use, so that
+    the local zone is looked up only once per run.
+"""
+def get_time_converter():
+    global _time_converter
+    if _time_converter is None:
+        _time_converter = LocalTimeConverter()
+    return _time_converter
+
+
+# Convert timestamp in local time to GMT.
+# See LocalTimeConverter.timestamp_to_utc().
 def local_timestamp_to_gmt(localtimestamp):
     if not localtimestamp:
         return None
-    d = iso8601.parse_date(localtimestamp)
-    utc_seconds = time.mktime(d.timetuple())
-    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(utc_seconds))
+    return get_time_converter().timestamp_to_utc(localtimestamp)
 
 
 """
@@ -27,16 +183,12 @@ def local_timestamp_to_gmt(localtimestamp):
     other words, we know the offset from UTC is either -5 hours
     or - 4 hours, but we don't know which. We'd like to
     convert that date/time to UTC.
+    See LocalTimeConverter.to_utc().
 """
 def local_no_tz_to_utc(datetime_string):
     if not datetime_string:
         return None
-    lnaive = datetime.strptime(datetime_string, "%Y-%m-%d %H:%M:%S")
-    tz=get_localzone()
-    l_with_tz = tz.localize(lnaive)
-    #l_with_tz now has timezone info
-    utc_seconds = time.mktime(l_with_tz.timetuple())
-    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(utc_seconds))
+    return get_time_converter().to_utc(datetime_string)
 
 """
     Given a logging level string such as 'DEBUG' or 'INFO',
@@ -78,15 +230,11 @@ def generate_archive_name(prefix = None):
     create the archive file and add the files from the list.
     Try to figure out what kind of compression to use
     based on the archive file extension.
+    pogo itself now uses archive.Archiver, which can also
+    compress in parallel and split archives.
 """
 def archive_file_list(filename, files):
-    comp_mode = ''
-    if filename.endswith('bz2'): comp_mode = ':bz2'
-    if filename.endswith('gz'): comp_mode = ':gz'
-    open_mode_string = 'w' + comp_mode
-    with tarfile.open(filename, open_mode_string) as tf:
-        for fn in files:
-            tf.add(fn)
+    Archiver(codec_for_file_name(filename), threads=1).write(filename, files)
 
 
 class PogoGeoInfo(object):
@@ -113,16 +261,122 @@ class PogoGeoInfo(object):
                 else:
                     self.country_code = ''
 
+    """
+        Make a PogoGeoInfo from previously-saved country information,
+        without looking anything up.
+    """
+    @classmethod
+    def from_country(cls, code, name):
+        gi = cls()
+        gi.country_code = code or ''
+        gi.country_name = name or ''
+        return gi
+
+
+"""
+    An LRU cache of PogoGeoInfo objects, keyed by ip address.
+    Brute-force attempts tend to come from a small number of
+    addresses, so most lookups are answered from here without
+    touching the GeoLite2 database.
+
+    If a store is given, it's consulted on a cache miss before
+    doing a GeoLite2 lookup, and given the result of any GeoLite2
+    lookup. A store must have methods get(ip) (returning a PogoGeoInfo
+    or None) and put(ip, geo_info). GeoCacheDaoLocal is such a store.
+"""
+class GeoInfoCache(object):
+    DEFAULT_MAX_SIZE = 10000
+
+    def __init__(self, max_size=None, store=None):
+        self.max_size = max_size or GeoInfoCache.DEFAULT_MAX_SIZE
+        self._store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ipaddress):
+        with self._lock:
+            try:
+                # Move to the most-recently-used end:
+                gi = self._entries.pop(ipaddress)
+                self._entries[ipaddress] = gi
+                self.hits += 1
+                return gi
+            except KeyError:
+                pass
+            self.misses += 1
+            gi = None
+            if self._store is not None:
+                gi = self._store.get(ipaddress)
+                if gi is not None:
+                    self.store_hits += 1
+            if gi is None:
+                gi = PogoGeoInfo(geolite2.lookup(ipaddress))
+                if self._store is not None:
+                    self._store.put(ipaddress, gi)
+            self._entries[ipaddress] = gi
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False) # discard least recently used
+            return gi
+
+    """
+        Write any pending entries to the store, if there is one.
+    """
+    def flush(self):
+        if self._store is not None:
+            self._store.flush()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+
+_geo_cache = GeoInfoCache()
+
+"""
+    Replace the cache used by get_geo_info() with a new one
+    of the given size, optionally backed by a persistent store.
+"""
+def configure_geo_cache(max_size=None, store=None):
+    global _geo_cache
+    _geo_cache = GeoInfoCache(max_size, store)
+    return _geo_cache
+
+def get_geo_cache():
+    return _geo_cache
+
+"""
+    Return a string identifying the GeoLite2 database in use.
+    It changes whenever the database is updated, so it can
+    be used to invalidate saved lookup results.
+"""
+def geo_database_stamp():
+    try:
+        info = geolite2.get_info()
+        return info.internal_name + '@' + info.date.isoformat()
+    except Exception:
+        logging.warning("Could not get GeoLite2 database information", exc_info = True)
+        return ''
+
 """
     Return an object holding information about
     location of given ip address. If no ip address
     is given, instantiate a PgooGeoInfo object with None,
     which will set country_code and country_name to ''.
+    Results are cached (see GeoInfoCache), so callers
+    must not modify the returned object.
 """
 def get_geo_info(ipaddress):
     if not ipaddress:
         return PogoGeoInfo()
     else:
-        return PogoGeoInfo(geolite2.lookup(ipaddress))
+        return _geo_cache.get(ipaddress)
     
      
\ No newline at end of file
@@ -29,7 +29,7 @@ class PyTest(TestCommand):
         sys.exit(pytest.main(self.test_args))
 
 
-version = "0.9.5.1"
+version = "0.9.6.0"
 
 class install(_install):
     def install_config_file(self):
@@ -70,7 +70,7 @@ setup(name="pogo",
       author_email="boing.to.elasticsearch@gmail.com",
       url="https://github.com/tonyrein/pogo.git",
       license="MIT",
-      packages=find_packages(exclude=['examples', 'tests']),
+      packages=find_packages(exclude=['examples', 'tests', 'benchmarks']),
       include_package_data=True,
       zip_safe=True,
       tests_require=['pytest'],
@@ -79,9 +79,19 @@ setup(name="pogo",
       #		* pogo_schema.sql to initialize the app's "staging" database
       #		* pogo.cfg, a default configuration file
       #		* logrotate.cfg, a default control file for logrotate
+      #		* migrations/*.sql, changes to the "staging" database's tables since
+      #		  pogo_schema.sql was first released
       #
-      package_data = {'pogo': ['data/pogo_schema.sql', 'data/pogo.cfg', 'data/logrotate.cfg']},
+      package_data = {'pogo': ['data/pogo_schema.sql', 'data/pogo.cfg', 'data/logrotate.cfg',
+                               'data/migrations/*.sql']},
       install_requires=['iso8601', 'tzlocal', 'python-geoip-geolite2', 'elasticsearch'],
+      # Optional: scandir makes reading HonSSH's directories faster under Python 2,
+      # pyinotify lets 'pogo daemon' hear about new files without polling, and
+      # backports.lzma and zstandard add the xz and zstd archive codecs;
+      # pytest-benchmark is needed to run the benchmarks.
+      extras_require={'fast': ['scandir'], 'daemon': ['pyinotify'],
+                      'xz': ['backports.lzma'], 'zstd': ['zstandard'],
+                      'bench': ['pytest-benchmark']},
 
       # The entry_points entry results in an executable script called 'pogo'
       # in the PATH, which invokes the main() method in the 'main' module.
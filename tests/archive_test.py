@@ -0,0 +1,109 @@
+'''
+pogo: tests for util.archive.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+
+from pogo.util.archive import CODECS, Archiver, BlockReader, find_members, extract_member
+
+
+def make_files(tmpdir, sizes):
+    names = []
+    for i, size in enumerate(sizes):
+        p = tmpdir.join('file%d' % i)
+        p.write(''.join(chr(65 + (j * 7 + i) % 26) for j in range(size)))
+        names.append(str(p))
+    return names
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_gzip_archive_reads_back(tmpdir, monkeypatch, threads):
+    monkeypatch.setattr(Archiver, 'BLOCK_SIZE', 4096)
+    names = make_files(tmpdir, [10000, 30000, 5])
+    arc = Archiver('gzip', threads=threads)
+    [name] = arc.archive(str(tmpdir.join('arc-')), names)
+    assert name.endswith('.gz')
+    with tarfile.open(name, 'r:gz') as tf:
+        members = tf.getmembers()
+        assert [ m.size for m in members ] == [10000, 30000, 5]
+        assert tf.extractfile(members[1]).read() == open(names[1]).read()
+
+
+def test_bz2_is_one_stream_whatever_the_threads(tmpdir, monkeypatch):
+    monkeypatch.setattr(Archiver, 'BLOCK_SIZE', 4096)
+    names = make_files(tmpdir, [20000, 20000, 20000])
+    arc = Archiver('bz2', threads=4)
+    assert arc.threads == 1
+    [name] = arc.archive(str(tmpdir.join('arc-')), names)
+    # Python 2's tarfile only reads the first of several bzip2 streams:
+    with tarfile.open(name, 'r:bz2') as tf:
+        assert [ m.size for m in tf.getmembers() ] == [20000, 20000, 20000]
+        assert tf.extractfile(tf.getmembers()[2]).read() == open(names[2]).read()
+
+
+def test_split_size(tmpdir):
+    names = make_files(tmpdir, [600, 600, 300, 2000])
+    arc = Archiver('none', split_size=1000)
+    assert arc.split(names) == [ names[0:1], names[1:3], names[3:4] ]
+    archives = arc.archive(str(tmpdir.join('arc-')), names)
+    assert [ os.path.splitext(a)[0][-4:] for a in archives ] == ['.001', '.002', '.003']
+    with tarfile.open(archives[1]) as tf:
+        assert len(tf.getmembers()) == 2
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        Archiver('rar')
+
+
+@pytest.mark.parametrize('codec,threads', [('gzip', 3), ('bz2', 1), ('none', 1)])
+def test_manifest_finds_and_extracts_one_file(tmpdir, monkeypatch, codec, threads):
+    monkeypatch.setattr(Archiver, 'BLOCK_SIZE', 4096)
+    src = tmpdir.mkdir('src')
+    names = make_files(src, [10000, 30000, 7000])
+    arcdir = tmpdir.mkdir('archives')
+    [name] = Archiver(codec, threads=threads, manifest=True).archive(str(arcdir.join('arc-')), names)
+    assert os.path.exists(name + '.manifest')
+    [(archive_name, m)] = list(find_members(str(arcdir), 'file2'))
+    assert archive_name == name
+    assert m['size'] == 7000
+    assert m['sha256'] == hashlib.sha256(open(names[2]).read()).hexdigest()
+    if codec != 'bz2':
+        # The last file starts well into the archive, in a later block
+        # (for an uncompressed archive, at its own offset):
+        assert m['block_offset'] > 0
+    else:
+        # bz2 archives are a single stream, so there's only one block:
+        assert m['block_offset'] == 0
+    out = io.BytesIO()
+    extract_member(archive_name, m, out)
+    assert out.getvalue() == open(names[2]).read()
+
+
+def test_extract_checks_sha256(tmpdir):
+    names = make_files(tmpdir, [100])
+    [name] = Archiver('gzip', manifest=True).archive(str(tmpdir.join('arc-')), names)
+    [(archive_name, m)] = list(find_members(str(tmpdir), '*file0'))
+    m['sha256'] = '0' * 64
+    with pytest.raises(IOError):
+        extract_member(archive_name, m, io.BytesIO())
+
+
+@pytest.mark.parametrize('codec', [ c for c in ('gzip', 'bz2', 'xz') if c in CODECS ])
+def test_block_ending_on_a_read_boundary(monkeypatch, codec):
+    blocks = []
+    for text in ('first block ' * 500, 'second block ' * 500):
+        c = CODECS[codec].make_compressor(CODECS[codec].default_level)
+        blocks.append(c.compress(text) + c.flush())
+    # The first block's end is at the end of a read, so the next read
+    # starts exactly at the start of the second block:
+    monkeypatch.setattr(BlockReader, 'READ_SIZE', len(blocks[0]))
+    reader = BlockReader(io.BytesIO(''.join(blocks)), CODECS[codec])
+    assert reader.read() == 'first block ' * 500 + 'second block ' * 500
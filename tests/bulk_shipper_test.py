@@ -0,0 +1,61 @@
+'''
+pogo: tests for service.bulk_shipper.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import threading
+import time
+
+import pytest
+
+from pogo.service.bulk_shipper import BulkShipper
+
+
+class FakeESLink(object):
+    """
+        Stands in for a RecordDaoES; answers each batch after a
+        short wait, and keeps track of how many were being
+        answered at the same time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.most_active = 0
+
+    def insert_bulk(self, records):
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if 'boom' in records:
+            raise IOError('connection reset')
+        return [ (True, 'es-' + r) for r in records ]
+
+
+@pytest.mark.parametrize('in_flight', [1, 3])
+def test_batches_are_answered_in_order_with_bounded_in_flight(in_flight):
+    es_link = FakeESLink()
+    taken = []
+    answered = []
+    def batches():
+        for i in range(10):
+            # The reader is never more than in_flight batches ahead of the answers:
+            assert len(taken) - len(answered) <= in_flight
+            taken.append(i)
+            yield ([i], [str(i)])
+    def on_results(keys, results):
+        answered.append( (keys, results) )
+    assert BulkShipper(es_link, in_flight).ship(batches(), on_results) == 10
+    assert answered == [ ([i], [(True, 'es-' + str(i))]) for i in range(10) ]
+    assert es_link.most_active == in_flight
+
+
+def test_errors_in_requests_are_raised():
+    batches = [ ([1], ['a']), ([2], ['boom']), ([3], ['c']) ]
+    answered = []
+    with pytest.raises(IOError):
+        BulkShipper(FakeESLink(), 2).ship(batches, lambda keys, results: answered.append(keys))
+    assert answered == [[1]]
@@ -0,0 +1,105 @@
+'''
+pogo: tests for file.dir_walker.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import os
+
+import pytest
+
+from pogo.file import dir_walker
+from pogo.file.dir_walker import DirectoryWalker
+from pogo.file.file_lister import SessionLogFileLister, SessionDownloadFileLister
+from pogo.file.file_lister import SessionRecordingFileLister, SessionTree
+
+
+def make_session_tree(top, multi):
+    for ws in (['ws1', 'ws2'] if multi else [None]):
+        base = top.mkdir(ws) if ws else top
+        for ip in ('10.0.0.1', '10.0.0.2'):
+            d = base.mkdir(ip)
+            d.join('20150301_120000_1.log').write('x')
+            d.join('20150301_120000_1_TERM0.tty').write('x')
+            if ip == '10.0.0.1':
+                d.mkdir('downloads').join('20150301_120001_wget.sh').write('x')
+
+
+@pytest.fixture(params=[False, True], ids=['SINGLE', 'MULTI'])
+def session_tree(request, tmpdir):
+    top = tmpdir.mkdir('sessions')
+    make_session_tree(top, request.param)
+    return str(top), ('MULTI' if request.param else 'SINGLE')
+
+
+def test_session_directories(session_tree):
+    top, honssh_type = session_tree
+    walker = DirectoryWalker()
+    ip_dirs = walker.session_directories(top, honssh_type)
+    assert len(ip_dirs) == (4 if honssh_type == 'MULTI' else 2)
+    assert set(os.path.basename(d) for d in ip_dirs) == set(['10.0.0.1', '10.0.0.2'])
+    downloads = walker.session_directories(top, honssh_type, 'downloads')
+    assert all(d.endswith(os.sep + os.path.join('10.0.0.1', 'downloads')) for d in downloads)
+    # Everything's cached now; asking again reads nothing:
+    scanned = walker.dirs_scanned
+    walker.session_directories(top, honssh_type, 'downloads')
+    assert walker.dirs_scanned == scanned
+
+
+def test_listers_with_and_without_scandir(session_tree, monkeypatch):
+    top, honssh_type = session_tree
+    results = []
+    for impl in (dir_walker.scandir, None):
+        monkeypatch.setattr(dir_walker, 'scandir', impl)
+        logs = SessionLogFileLister(top, honssh_type)
+        logs.load_file_name_lists()
+        downloads = SessionDownloadFileLister(top, honssh_type)
+        downloads.load_file_name_lists()
+        results.append((logs._pending_file_names, downloads._pending_file_names))
+        # Only the matching files are stat'ed:
+        assert logs.get_walker().stats_done == len(logs._pending_file_names)
+    assert results[0] == results[1]
+    assert len(results[0][0]) == len(results[0][1]) * 2
+
+
+def test_session_tree_is_read_once(session_tree):
+    top, honssh_type = session_tree
+    tree = SessionTree(top, honssh_type)
+    found = {}
+    for lister_class in (SessionLogFileLister, SessionRecordingFileLister, SessionDownloadFileLister):
+        lister = lister_class(top, honssh_type, session_tree=tree)
+        lister.load_file_name_lists()
+        separate = lister_class(top, honssh_type)
+        separate.load_file_name_lists()
+        assert sorted(lister._pending_file_names) == sorted(separate._pending_file_names)
+        found[lister_class] = lister._pending_file_names
+    assert len(found[SessionLogFileLister]) == len(found[SessionRecordingFileLister])
+    assert all(n.endswith('.tty') for n in found[SessionRecordingFileLister])
+    # Each directory was read exactly once, for all three listers:
+    num_dirs = 1 + (2 if honssh_type == 'MULTI' else 0) + len(found[SessionLogFileLister]) + len(found[SessionDownloadFileLister])
+    assert tree.get_walker().dirs_scanned == num_dirs
+
+
+@pytest.mark.parametrize('impl', [dir_walker.scandir, None], ids=['scandir', 'listdir'])
+def test_restat_tree_reads_no_directories_but_sees_changes(session_tree, monkeypatch, impl):
+    monkeypatch.setattr(dir_walker, 'scandir', impl)
+    top, honssh_type = session_tree
+    tree = SessionTree(top, honssh_type)
+    lister = SessionLogFileLister(top, honssh_type, session_tree=tree)
+    lister.load_file_name_lists()
+    [grown, gone] = sorted(lister._pending_file_names)[:2]
+    with open(grown, 'a') as f:
+        f.write('more')
+    os.remove(gone)
+    again = SessionLogFileLister(top, honssh_type, session_tree=tree.restat())
+    again.load_file_name_lists()
+    assert again.get_walker().dirs_scanned == 0
+    assert again._file_stats[grown].st_size == lister._file_stats[grown].st_size + 4
+    assert sorted(again._pending_file_names) == sorted(set(lister._pending_file_names) - set([gone]))
+
+
+def test_walk_counts_directories(tmpdir):
+    tmpdir.mkdir('a').mkdir('b').join('f').write('x')
+    walker = DirectoryWalker()
+    assert len(walker.walk(str(tmpdir))) == 3
+    assert (walker.dirs_scanned, walker.entries_scanned) == (3, 3)
@@ -0,0 +1,65 @@
+'''
+pogo: tests for file.dir_watcher and daemon mode's settle time.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import os
+import time
+
+from pogo.file.dir_watcher import DirectoryWatcher
+from pogo.file.file_lister import AttemptFileLister, SessionLogFileLister
+
+OLD = 1425168000 # 2015-03-01
+
+
+def test_polling_reads_only_changed_directories(tmpdir):
+    logs = tmpdir.mkdir('logs')
+    attempts = logs.join('20150301')
+    attempts.write('x')
+    sub = tmpdir.mkdir('sessions').mkdir('10.0.0.1')
+    old = sub.join('old.log')
+    old.write('x')
+    for d in (logs, tmpdir.join('sessions'), sub):
+        os.utime(str(d), (OLD, OLD))
+    watcher = DirectoryWatcher([ str(logs), str(tmpdir.join('sessions')), str(logs) ], poll_interval=0.05,
+                               use_inotify=False, appended_dirs=[ str(logs) ])
+    assert watcher.dirs_read == 3
+    assert watcher.wait(0.1) == set()
+    assert watcher.dirs_read == 3
+    # A new session file, and an attempt file being added to, are seen;
+    # a session file being added to isn't, as it takes a stat() per file:
+    new = sub.join('new.log')
+    new.write('y')
+    old.write('xx')
+    attempts.write('xx')
+    assert watcher.wait(1) == set([ str(new), str(attempts) ])
+    assert watcher.dirs_read == 4
+
+
+def test_settle_time(tmpdir):
+    sub = tmpdir.mkdir('10.0.0.1')
+    names = [ str(sub.join('20150301_1%d0000_1.log' % i)) for i in range(4) ]
+    (settled, settling, quiet, busy) = names
+    for (name, age) in zip(names, (120, 10, 120, 10)):
+        open(name, 'w').write('x')
+        os.utime(name, (time.time() - age, time.time() - age))
+    lister = SessionLogFileLister(str(tmpdir), 'SINGLE')
+    # Only files seen to be closed are processed, once they've settled;
+    # the others may still be written to, however quiet they've been:
+    lister.set_settle_time(60, [ settled, settling ])
+    lister.load_file_name_lists()
+    lister.load_pending_file_objects()
+    assert [ f.name() for f in lister ] == [ settled ]
+    assert lister.count_unsettled() == 1
+    # Attempt files grow all day, so they're read as they grow,
+    # and aren't finished with until the next day:
+    tmpdir.join('20150301').write('x')
+    os.utime(str(tmpdir.join('20150301')), (time.time() - 120, time.time() - 120))
+    lister = AttemptFileLister(str(tmpdir), 'SINGLE')
+    lister.set_settle_time(60)
+    lister.load_file_name_lists()
+    lister.load_pending_file_objects()
+    assert len(lister) == 1
+    assert not lister.finished_with(list(lister)[0])
+    assert lister.count_unsettled() == 0
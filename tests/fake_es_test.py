@@ -0,0 +1,84 @@
+'''
+pogo: tests for dao.record_dao_es against the stand-in
+Elasticsearch server in benchmarks.fake_es.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import pytest
+from elasticsearch import TransportError
+
+from benchmarks.fake_es import FakeElasticsearch
+from pogo.dao.record_dao_es import AttemptRecordDaoES, DownloadContentDaoES
+from pogo.dto.record import AttemptRecord, DownloadContentRecord
+from pogo.service.bulk_shipper import BulkShipper
+
+
+@pytest.fixture
+def fake_es():
+    with FakeElasticsearch(keep_documents=True) as fake:
+        yield fake
+
+
+def make_records(count):
+    return [ AttemptRecord('2015-03-01 12:00:%02d,10.0.0.1,root,pw%d,0' % (i % 60, i)) for i in range(count) ]
+
+
+def test_dao_creates_index_and_mapping_once(fake_es):
+    AttemptRecordDaoES(fake_es.es_cfg())
+    assert 'HonSSH_Attempt' in fake_es.indices['hon_ssh']['mappings']
+    requests = fake_es.stats['requests']
+    AttemptRecordDaoES(fake_es.es_cfg())
+    # Just the exists and get_mapping calls the second time:
+    assert fake_es.stats['requests'] == requests + 2
+
+
+def test_insert_bulk_and_single(fake_es):
+    dao = AttemptRecordDaoES(fake_es.es_cfg(es_bulk_docs=7))
+    results = dao.insert_bulk(make_records(20))
+    assert [ ok for (ok, result) in results ] == [True] * 20
+    assert fake_es.stats['bulk_requests'] == 3
+    assert dao.insert_single(make_records(1)[0])
+    assert fake_es.count('hon_ssh', 'HonSSH_Attempt') == 21
+    doc = fake_es.indices['hon_ssh']['docs']['HonSSH_Attempt'][results[3][1]]
+    assert doc['password'] == 'pw3'
+
+
+def test_failed_and_rejected_documents_are_reported(fake_es):
+    fake_es.error_rate = 0.1
+    fake_es.reject_rate = 0.1
+    dao = AttemptRecordDaoES(fake_es.es_cfg())
+    results = dao.insert_bulk(make_records(200))
+    failures = [ result for (ok, result) in results if not ok ]
+    assert len(failures) == fake_es.stats['docs_failed'] + fake_es.stats['docs_rejected'] > 0
+    assert any('EsRejectedExecutionException' in f for f in failures)
+    assert len(results) - len(failures) == fake_es.count('hon_ssh') == fake_es.stats['docs_indexed']
+
+
+def test_throttled_bulk_request_raises(fake_es):
+    dao = AttemptRecordDaoES(fake_es.es_cfg())
+    fake_es.throttle_rate = 1.0
+    with pytest.raises(TransportError) as e:
+        dao.insert_bulk(make_records(3))
+    assert e.value.status_code == 429
+    assert fake_es.count('hon_ssh') == 0
+
+
+def test_existing_ids_and_repeated_ids(fake_es):
+    dao = DownloadContentDaoES(fake_es.es_cfg())
+    records = [ DownloadContentRecord('ab' * 32, 3, 'YWJj'), DownloadContentRecord('cd' * 32, 3, 'ZGVm') ]
+    dao.insert_bulk(records)
+    dao.insert_bulk(records[:1])
+    assert fake_es.count('hon_ssh_contents') == 2
+    assert dao.existing_ids(['ab' * 32, 'ef' * 32]) == set(['ab' * 32])
+
+
+def test_shipper_with_latency(fake_es):
+    fake_es.latency = 0.05
+    dao = AttemptRecordDaoES(fake_es.es_cfg(es_bulk_docs=10))
+    records = make_records(80)
+    batches = [ (range(i, i + 10), records[i:i + 10]) for i in range(0, 80, 10) ]
+    shipped = []
+    BulkShipper(dao, in_flight=8).ship(iter(batches), lambda keys, results: shipped.extend(keys))
+    assert shipped == range(80)
+    assert fake_es.count('hon_ssh') == 80
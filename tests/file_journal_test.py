@@ -0,0 +1,62 @@
+'''
+pogo: tests for dao.file_journal.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import os
+
+from pogo.dao.file_journal import FileJournal
+
+
+def record(journal, path, records_done, done=False, byte_offset=0):
+    journal.record_progress(None, path, 'AttemptFile', os.stat(path), records_done, done, byte_offset)
+
+
+def test_journal_survives_reopening_and_a_torn_line(tmpdir):
+    data = tmpdir.join('20150301')
+    data.write('x' * 100)
+    path = str(tmpdir.join('direct.journal'))
+    journal = FileJournal(path)
+    record(journal, str(data), 3, byte_offset=30)
+    record(journal, str(data), 6, byte_offset=60)
+    journal.close()
+    with open(path, 'ab') as f:
+        f.write('{"path": "half a li')
+    journal = FileJournal(path)
+    state = journal.load_states('AttemptFile')[str(data)]
+    assert (state.records_done, state.byte_offset, state.done) == (6, 60, False)
+    assert journal.load_states('LogFile') == {}
+    # The torn line was cut off, so new lines can be read back:
+    record(journal, str(data), 10, done=True, byte_offset=100)
+    journal.close()
+    assert FileJournal(path).load_states('AttemptFile')[str(data)].done
+
+
+def test_key_follows_renamed_file_and_forget(tmpdir):
+    log = tmpdir.join('honssh.log')
+    log.write('x')
+    journal = FileJournal(str(tmpdir.join('direct.journal')))
+    key = journal.file_key(str(log), os.stat(str(log)))
+    record(journal, str(log), 1)
+    rotated = tmpdir.join('honssh.log.1')
+    log.rename(rotated)
+    assert journal.file_key(str(rotated), os.stat(str(rotated))) == key
+    assert FileJournal.document_id(key, 0) != FileJournal.document_id(key, 1)
+    journal.delete_states([str(log)])
+    assert journal.load_states('AttemptFile') == {}
+
+
+def test_compact(tmpdir, monkeypatch):
+    monkeypatch.setattr(FileJournal, 'COMPACT_MIN_LINES', 10)
+    data = tmpdir.join('20150301')
+    data.write('x')
+    path = str(tmpdir.join('direct.journal'))
+    journal = FileJournal(path)
+    for i in range(20):
+        record(journal, str(data), i)
+    assert journal.compact()
+    assert len(open(path).readlines()) == 1
+    record(journal, str(data), 20)
+    journal.close()
+    assert FileJournal(path).load_states('AttemptFile')[str(data)].records_done == 20
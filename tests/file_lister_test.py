@@ -0,0 +1,150 @@
+'''
+pogo: tests for file.file_lister and the file state table.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import os
+
+import pytest
+
+from pogo.dao.file_state_dao_local import FileStateDaoLocal
+from pogo.dao.local_db_access import LocalDBAccessor
+from pogo.dao.record_dao_local import AttemptRecordDaoLocal, LogRecordDaoLocal, SessionLogDaoLocal
+from pogo.file.file_lister import AttemptFileLister, LogFileLister, SessionLogFileLister
+
+OLD = 1425168000 # 2015-03-01
+
+
+def write_attempt_file(path, count):
+    path.write(''.join("2015-03-01 12:00:%02d,10.0.0.1,root,pw%d,0\n" % (i % 60, i) for i in range(count)))
+    os.utime(str(path), (OLD, OLD))
+
+
+@pytest.fixture
+def setup(tmpdir):
+    logs = tmpdir.mkdir('logs')
+    write_attempt_file(logs.join('20150301'), 5)
+    write_attempt_file(logs.join('20150302'), 5)
+    write_attempt_file(logs.join('20150303'), 5)
+    logs.join('20150303.DONE').write('') # marker left by an older version
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    return logs, dba
+
+
+def make_lister(logs, dba):
+    lister = AttemptFileLister(str(logs), 'SINGLE', FileStateDaoLocal(dba))
+    lister.load_file_name_lists()
+    lister.load_pending_file_objects()
+    return lister
+
+
+def scrape(lister, dba, f, records=None, commit_every=2, dao_class=AttemptRecordDaoLocal):
+    dao = dao_class(dba)
+    start = lister.resume_point(f)
+    on_commit = lambda cursor, count, finished: lister.record_progress(cursor, f, start + count, finished)
+    return dao.insert_bulk(records or f.iter_records(), commit_every, on_commit)
+
+
+def test_done_files_come_from_state_table_and_markers(setup):
+    logs, dba = setup
+    lister = make_lister(logs, dba)
+    assert [os.path.basename(n) for n in lister._pending_file_names] == ['20150301', '20150302']
+    assert [os.path.basename(n) for n in lister._done_file_names] == ['20150303']
+    assert scrape(lister, dba, list(lister)[0]) == 5
+    lister = make_lister(logs, dba)
+    assert [os.path.basename(n) for n in lister._pending_file_names] == ['20150302']
+    # A file that changes after it's done is picked up again:
+    write_attempt_file(logs.join('20150301'), 6)
+    lister = make_lister(logs, dba)
+    assert len(lister._pending_file_names) == 2
+
+
+def test_interrupted_scrape_resumes(setup):
+    logs, dba = setup
+    lister = make_lister(logs, dba)
+    f = list(lister)[0]
+
+    def failing_records():
+        for i, r in enumerate(f.iter_records()):
+            if i == 4:
+                raise IOError('disk went away')
+            yield r
+
+    with pytest.raises(IOError):
+        scrape(lister, dba, f, failing_records())
+    lister = make_lister(logs, dba)
+    f = list(lister)[0]
+    assert lister.resume_point(f) == 4
+
+
+def test_delete_done_files_forgets_state(setup):
+    logs, dba = setup
+    lister = make_lister(logs, dba)
+    for f in lister:
+        scrape(lister, dba, f)
+    lister = make_lister(logs, dba)
+    assert lister.delete_done_files() == 3
+    assert logs.listdir() == []
+    assert FileStateDaoLocal(dba).load_states('AttemptFile') == {}
+
+
+def test_growing_file_is_read_from_its_offset(setup):
+    logs, dba = setup
+    today = logs.join('20150304')
+    today.write("2015-03-04 12:00:00,10.0.0.1,root,a,0\n"
+                "2015-03-04 12:00:01,10.0.0.1,root,b,0\n"
+                "2015-03-04 12:00:02,10.")
+    lister = make_lister(logs, dba)
+    f = [ f for f in lister if f.name() == str(today) ][0]
+    assert not lister.finished_with(f)
+    assert scrape(lister, dba, f, lister.iter_new_records(f)) == 2
+    today.write("0.0.1,root,c,0\n", mode='a')
+    lister = make_lister(logs, dba)
+    f = [ f for f in lister if f.name() == str(today) ][0]
+    assert lister.resume_point(f) == 2
+    assert [ r.password for r in lister.iter_new_records(f) ] == ['c']
+
+
+def test_rotated_log_carries_on_from_its_offset(tmpdir):
+    logs = tmpdir.mkdir('logs')
+    log = logs.join('honssh.log')
+    log.write("2015-03-04 12:00:01-0500 [-] one\n2015-03-04 12:00:02-0500 [-] two\n")
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    lister = LogFileLister(str(logs), 'SINGLE', FileStateDaoLocal(dba))
+    lister.load_file_name_lists()
+    lister.load_pending_file_objects()
+    f = list(lister)[0]
+    assert scrape(lister, dba, f, lister.iter_new_records(f), dao_class=LogRecordDaoLocal) == 1
+    log.write("2015-03-04 12:00:03-0500 [-] three\n", mode='a')
+    log.rename(logs.join('honssh.log.1'))
+    lister = LogFileLister(str(logs), 'SINGLE', FileStateDaoLocal(dba))
+    lister.load_file_name_lists()
+    lister.load_pending_file_objects()
+    f = list(lister)[0]
+    assert [ r.message for r in lister.iter_new_records(f) ] == ['two']
+
+
+def test_session_log_added_to_after_it_was_done_carries_on(tmpdir):
+    log = tmpdir.join('sessions', '10.0.0.1', '20150301_120000_1.log')
+    line = '2015-03-01 12:00:%02d - [session] ls\n'
+    log.write(''.join(line % i for i in range(3)), ensure=True)
+    os.utime(str(log), (OLD, OLD))
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    def lister():
+        l = SessionLogFileLister(str(tmpdir.join('sessions')), 'SINGLE', FileStateDaoLocal(dba))
+        l.load_file_name_lists()
+        l.load_pending_file_objects()
+        return l
+    l = lister()
+    assert scrape(l, dba, list(l)[0], dao_class=SessionLogDaoLocal) == 3
+    assert len(lister()) == 0
+    # The session wasn't over after all:
+    log.write(''.join(line % i for i in range(3, 5)), mode='a')
+    os.utime(str(log), (OLD + 60, OLD + 60))
+    l = lister()
+    [f] = list(l)
+    assert l.resume_point(f) == 3
+    assert scrape(l, dba, f, l.iter_new_records(f, 3), dao_class=SessionLogDaoLocal) == 2
+    assert len(SessionLogDaoLocal(dba).list_all()) == 5
+    assert len(lister()) == 0
@@ -0,0 +1,56 @@
+'''
+pogo: tests for the geoip lookup cache.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+from pogo.dao.local_db_access import LocalDBAccessor
+from pogo.dao.geo_cache_dao_local import GeoCacheDaoLocal
+from pogo.util.util import GeoInfoCache, PogoGeoInfo
+
+
+class DictStore(object):
+    def __init__(self, entries):
+        self.entries = dict(entries)
+        self.puts = []
+
+    def get(self, ip):
+        return self.entries.get(ip)
+
+    def put(self, ip, gi):
+        self.puts.append(ip)
+
+    def flush(self):
+        pass
+
+
+def test_cache_counts_hits_and_misses():
+    store = DictStore({'10.0.0.1': PogoGeoInfo.from_country('US', 'United States')})
+    cache = GeoInfoCache(10, store)
+    for i in range(5):
+        assert cache.get('10.0.0.1').country_code == 'US'
+    assert (cache.hits, cache.misses, cache.store_hits) == (4, 1, 1)
+    assert store.puts == []
+
+
+def test_cache_evicts_least_recently_used():
+    store = DictStore(dict(('10.0.0.' + str(i), PogoGeoInfo.from_country(str(i), '')) for i in range(4)))
+    cache = GeoInfoCache(2, store)
+    cache.get('10.0.0.1')
+    cache.get('10.0.0.2')
+    cache.get('10.0.0.1')
+    cache.get('10.0.0.3') # evicts 10.0.0.2
+    assert len(cache) == 2
+    cache.get('10.0.0.1')
+    assert cache.hits == 2
+    cache.get('10.0.0.2')
+    assert cache.misses == 4
+
+
+def test_persistent_store_is_invalidated_by_new_database(tmpdir):
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    store = GeoCacheDaoLocal(dba, 'GeoLite2-City@2015-03-03')
+    store.put('1.2.3.4', PogoGeoInfo.from_country('AU', 'Australia'))
+    assert store.flush() == 1
+    assert GeoCacheDaoLocal(dba, 'GeoLite2-City@2015-03-03').get('1.2.3.4').country_name == 'Australia'
+    assert GeoCacheDaoLocal(dba, 'GeoLite2-City@2015-04-07').get('1.2.3.4') is None
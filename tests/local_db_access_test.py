@@ -0,0 +1,127 @@
+'''
+pogo: tests for dao.local_db_access.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import pytest
+
+from pogo.dao.download_content_dao_local import DownloadContentDaoLocal
+from pogo.dao.local_db_access import LocalDBAccessor
+from pogo.dao.record_dao_local import AttemptRecordDaoLocal, RecordDaoLocal, SessionDownloadDaoLocal
+from pogo.dao.record_dao_local import SessionRecordingDaoLocal
+from pogo.dto.record import AttemptRecord, SessionDownloadFileRecord, SessionRecordingRecord
+from pogo.service.service_local import ServiceLocal
+
+
+def columns(dba, table):
+    return [ row[1] for row in dba.db.execute('PRAGMA table_info(' + table + ')') ]
+
+
+def test_migrations_are_applied_once(tmpdir):
+    cfg = {'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))}
+    dba = LocalDBAccessor(cfg)
+    assert dba.db.execute('PRAGMA user_version').fetchone()[0] == len(LocalDBAccessor.MIGRATIONS)
+    assert 'file_size' in columns(dba, 'session_downloads')
+    dba.db_close()
+    # Opening it again applies nothing, so doesn't fail adding the columns twice:
+    dba = LocalDBAccessor(cfg)
+    assert columns(dba, 'session_recordings').count('file_size') == 1
+    dao = SessionRecordingDaoLocal(dba)
+    r = SessionRecordingRecord('/x/10.0.0.1/f.tty', '', 123)
+    r.set_timestamp('')
+    r.set_source_ip('10.0.0.1')
+    r.set_country_info('', '')
+    dao.insert_single(r)
+    assert dao.list_all()[0][-2:] == (u'', 123)
+
+
+def test_download_contents_are_stored_once(tmpdir):
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    dao = SessionDownloadDaoLocal(dba)
+    records = []
+    for (name, sha256) in (('a', 'f00d'), ('b', 'f00d'), ('c', 'beef')):
+        r = SessionDownloadFileRecord('/x/10.0.0.1/downloads/' + name, 'Y29udGVudHM=', 8)
+        r.set_timestamp('')
+        r.set_source_ip('10.0.0.1')
+        r.set_country_info('', '')
+        r.sha256 = sha256
+        records.append(r)
+    assert dao.insert_bulk(records) == 3
+    assert [ row[-3:] for row in dao.list_all() ] == [(u'', 8, u'f00d'), (u'', 8, u'f00d'), (u'', 8, u'beef')]
+    contents = DownloadContentDaoLocal(dba)
+    assert contents.list_unshipped() == [u'beef', u'f00d']
+    assert contents.list_unshipped(u'beef') == [u'f00d']
+    contents.mark_shipped([u'beef', u'f00d'])
+    assert contents.prune() == 2
+    assert contents.get(u'f00d') == (8, None)
+    # Shipped and pruned contents are neither stored nor shipped again:
+    dao.insert_bulk(records[:1])
+    assert contents.list_unshipped() == []
+    assert contents.get(u'f00d') == (8, None)
+
+
+def test_performance_pragmas(tmpdir):
+    cfg = {'type': 'sqlite', 'name': str(tmpdir.join('pogo.db')),
+           'journal_mode': 'WAL', 'synchronous': 'normal', 'cache_size': '-2048', 'page_size': '8192',
+           'mmap_size': ''}
+    dba = LocalDBAccessor(cfg)
+    pragma = lambda name: dba.db.execute('PRAGMA ' + name).fetchone()[0]
+    assert (pragma('journal_mode'), pragma('synchronous'), pragma('cache_size'), pragma('page_size')) == \
+        (u'wal', 1, -2048, 8192)
+    dba.db_close()
+    cfg['synchronous'] = 'sometimes'
+    with pytest.raises(ValueError):
+        LocalDBAccessor(cfg)
+
+
+def test_pending_and_shipped_rows_are_found_by_index(tmpdir):
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    for table in ('attempts', 'log_msg', 'session_downloads', 'session_recordings', 'session_log_records'):
+        for (condition, index) in ((ServiceLocal.PENDING, '_pending'), (ServiceLocal.SHIPPED, '_shipped')):
+            plan = dba.db.execute('EXPLAIN QUERY PLAN SELECT * FROM ' + table + ' WHERE ' + condition).fetchall()
+            assert (table + index) in plan[0][-1]
+
+
+def test_unshipped_rows_are_read_a_batch_at_a_time(tmpdir):
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    dao = AttemptRecordDaoLocal(dba)
+    dao.insert_bulk(AttemptRecord('2015-03-04 12:00:%02d,10.0.0.1,root,pw,0' % i) for i in range(7))
+    service = ServiceLocal(dao)
+    service.update_with_es_id(3, 'shipped')
+    batches = service.iter_non_processed(2)
+    assert [ row[0] for row in next(batches) ] == [1, 2]
+    # Rows shipped while the batches are being read don't upset the paging:
+    service.update_with_es_id(5, 'shipped')
+    assert [ [ row[0] for row in b ] for b in batches ] == [[4, 6], [7]]
+    assert service.count_non_processed() == 5
+    assert service.update_with_es_ids([(1, 'a'), (2, 'b'), (4, 'c')]) == 3
+    assert [ row[:2] for row in dao.list_where("db_id < 5") ] == [(1, u'a'), (2, u'b'), (3, u'shipped'), (4, u'c')]
+
+
+def test_one_transaction_is_written_a_chunk_at_a_time(tmpdir, monkeypatch):
+    monkeypatch.setattr(RecordDaoLocal, 'INSERT_CHUNK_SIZE', 3)
+    dba = LocalDBAccessor({'type': 'sqlite', 'name': str(tmpdir.join('pogo.db'))})
+    dao = AttemptRecordDaoLocal(dba)
+    read = []
+    def records(count, fail=False):
+        for i in range(count):
+            read.append(i)
+            yield AttemptRecord('2015-03-04 12:00:%02d,10.0.0.1,root,pw,0' % i)
+        if fail:
+            raise IOError('unreadable')
+    chunks = []
+    insert_chunk = dao.insert_chunk
+    def insert_chunk_spy(cursor, sql, chunk):
+        chunks.append((len(chunk), len(read)))
+        insert_chunk(cursor, sql, chunk)
+    dao.insert_chunk = insert_chunk_spy
+    assert dao.insert_bulk(records(7)) == 7
+    # Each chunk is written before the next records are read:
+    assert chunks == [(3, 3), (3, 6), (1, 7)]
+    # It's still a single transaction, rolled back as a whole:
+    with pytest.raises(IOError):
+        dao.insert_bulk(records(5, fail=True))
+    assert len(dao.list_all()) == 7
+    # and not left open, so the next can begin:
+    assert dao.insert_bulk(records(1)) == 1
@@ -0,0 +1,358 @@
+'''
+pogo: tests for main.Pogo.
+
+Each test gets a Pogo configured, by a pogo.cfg in the current
+directory, to work on a HonSSH tree and database under tmpdir.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import hashlib
+import json
+import os
+import signal
+import time
+
+import pytest
+
+from pogo.dao.file_journal import FileJournal
+from pogo.dao import record_dao_es
+from pogo.dao.download_content_dao_local import DownloadContentDaoLocal
+from pogo.dao.record_dao_es import AttemptRecordDaoES
+from pogo.file.file_lister import AttemptFileLister
+from pogo.main import Pogo, extract
+from pogo.util.archive import Archiver
+from tests.record_dao_es_test import FakeConnection, make_dao
+
+OLD = 1425168000 # 2015-03-01
+
+CONFIG = '''
+[main]
+debug=0
+honssh_type=SINGLE
+%(main)s
+
+[locations]
+top_dir=%(top)s
+attempt_dir=%(top)s/logs
+log_dir=%(top)s/logs
+session_dir=%(top)s/sessions
+archive_dir=%(top)s/archives
+
+[db_connection]
+name=%(top)s/db/pogo.db
+journal=%(top)s/db/direct.journal
+
+[elasticsearch]
+es_in_flight=1
+
+[geoip]
+persistent_cache=0
+
+[daemon]
+settle_time=60
+batch_window=0
+poll_interval=0.05
+retry_interval=1
+
+[archive]
+threads=1
+'''
+
+
+def write_attempt_file(path, count, bad=()):
+    path.write(''.join("2015-03-01 12:00:%02d,10.0.0.1,%s,pw%d,0\n" % (i % 60, 'bad' if i in bad else 'root', i)
+                       for i in range(count)))
+    os.utime(str(path), (OLD, OLD))
+
+
+@pytest.fixture
+def make_pogo(tmpdir, monkeypatch):
+    for d in ('logs', 'sessions', 'db'):
+        tmpdir.ensure_dir(d)
+    monkeypatch.chdir(tmpdir)
+    def make(**main_options):
+        main = '\n'.join('%s=%s' % item for item in main_options.items())
+        tmpdir.join('pogo.cfg').write(CONFIG % { 'top': str(tmpdir), 'main': main })
+        return Pogo()
+    return make
+
+
+class FakeEsClass(object):
+    DOCUMENT_TYPE = 'Fake'
+    made = 0
+
+    def __init__(self, es_cfg):
+        FakeEsClass.made += 1
+        self.es_cfg = es_cfg
+
+
+def test_es_link_is_made_once(make_pogo):
+    pogo = make_pogo()
+    FakeEsClass.made = 0
+    es_link = pogo.get_es_link(FakeEsClass)
+    assert isinstance(es_link, FakeEsClass)
+    assert es_link.es_cfg['es_host'] == 'localhost'
+    assert pogo.get_es_link(FakeEsClass) is es_link
+    assert FakeEsClass.made == 1
+
+
+def test_daemon_runs_again_when_files_change(make_pogo, tmpdir, monkeypatch):
+    pogo = make_pogo()
+    monkeypatch.setattr(signal, 'signal', lambda signum, handler: None)
+    runs = []
+    def main():
+        runs.append(1)
+        if len(runs) == 1:
+            write_attempt_file(tmpdir.join('logs', '20150301'), 3)
+        else:
+            pogo._stopping = True
+    pogo.main = main
+    pogo.daemon()
+    assert len(runs) == 2
+
+
+def test_extract_keeps_paths_and_never_overwrites(tmpdir):
+    names = []
+    for ip in ('10.0.0.1', '10.0.0.2'):
+        p = tmpdir.join('sessions', ip, '20150301_120000_1.log')
+        p.write(ip, ensure=True)
+        names.append(str(p))
+    arcdir = tmpdir.mkdir('archives')
+    Archiver('gzip', manifest=True).archive(str(arcdir.join('arc-')), names)
+    dest = tmpdir.mkdir('out')
+    assert extract(str(arcdir), '20150301_120000_1.log', str(dest)) == 2
+    for (ip, name) in zip(('10.0.0.1', '10.0.0.2'), names):
+        assert dest.join(name.lstrip('/')).read() == ip
+    # Files already extracted are left as they are:
+    dest.join(names[0].lstrip('/')).write('changed')
+    assert extract(str(arcdir), '20150301_120000_1.log', str(dest)) == 0
+    assert dest.join(names[0].lstrip('/')).read() == 'changed'
+
+
+def test_extract_stays_inside_dest(tmpdir, monkeypatch):
+    # Archived by relative path, so the second member's path begins with two dots:
+    monkeypatch.chdir(tmpdir.mkdir('sessions'))
+    names = [ 'a.log', '..name.log', 'c.log' ]
+    for name in names:
+        tmpdir.join('sessions', name).write(name)
+    arcdir = tmpdir.mkdir('archives')
+    Archiver('gzip', manifest=True).archive(str(arcdir.join('arc-')), names)
+    # A manifest made elsewhere, or tampered with:
+    [manifest_name] = arcdir.listdir(lambda p: p.basename.endswith('.manifest'))
+    manifest = json.load(open(str(manifest_name)))
+    assert [ m['path'] for m in manifest['members'] ] == names
+    manifest['members'][0]['path'] = '../evil.log'
+    manifest['members'][2]['path'] = 'x/../../evil2.log'
+    json.dump(manifest, open(str(manifest_name), 'w'))
+    dest = tmpdir.mkdir('out')
+    assert extract(str(arcdir), '*', str(dest)) == 1
+    assert dest.join('..name.log').read() == '..name.log'
+    assert not tmpdir.join('evil.log').check()
+    assert not tmpdir.join('evil2.log').check()
+
+
+class LosesAnswer(FakeConnection):
+    """
+        Takes in the documents of the _bulk request number fail_at
+        (counting from 1), but then fails as if the connection had
+        dropped before the answer came back.
+    """
+    def __init__(self, fail_at):
+        super(LosesAnswer, self).__init__()
+        self.fail_at = fail_at
+
+    def bulk(self, body, index=None, doc_type=None):
+        result = super(LosesAnswer, self).bulk(body, index, doc_type)
+        if len(self.bodies) == self.fail_at:
+            raise IOError('connection dropped')
+        return result
+
+
+def ship_direct(pogo, tmpdir, connection, bulk_docs=2):
+    dao = make_dao(bulk_docs, 1000000)
+    dao._es_connection = connection
+    pogo._es_links[AttemptRecordDaoES] = dao
+    return pogo.ship_direct('attempt_dir', AttemptFileLister, AttemptRecordDaoES,
+                            str(tmpdir.join('archives', 'HonSSH_Attempts-')))
+
+
+def journal_state(pogo, path):
+    return pogo._journal.load_states('AttemptFile').get(str(path))
+
+
+def test_direct_resumes_from_journal_and_resent_batch_replaces(make_pogo, tmpdir):
+    f = tmpdir.join('logs', '20150301')
+    write_attempt_file(f, 5)
+    pogo = make_pogo(direct=1)
+    key = pogo._journal.file_key(str(f), os.stat(str(f)))
+    conn = LosesAnswer(fail_at=2)
+    with pytest.raises(IOError):
+        ship_direct(pogo, tmpdir, conn)
+    # Only the first batch was acknowledged:
+    assert journal_state(pogo, f).records_done == 2
+    assert f.check()
+    # The next run, with a fresh Pogo reading the same journal, starts from there,
+    # sending the second batch again under the same _ids:
+    pogo._journal.close()
+    pogo = make_pogo(direct=1)
+    conn.fail_at = None
+    assert ship_direct(pogo, tmpdir, conn) == 3
+    assert [ b.count('\n') / 2 for b in conn.bodies ] == [2, 2, 2, 1]
+    assert sorted(conn.docs) == sorted(FileJournal.document_id(key, i) for i in range(5))
+    assert [ conn.docs[FileJournal.document_id(key, i)]['password'] for i in range(5) ] == \
+           [ 'pw%d' % i for i in range(5) ]
+    # The file is finished with, so it's archived, deleted and forgotten:
+    assert not f.check()
+    assert journal_state(pogo, f) is None
+    assert len(tmpdir.join('archives').listdir(lambda p: p.ext == '.bz2')) == 1
+
+
+def test_direct_refused_batch_leaves_journal_alone(make_pogo, tmpdir):
+    f = tmpdir.join('logs', '20150301')
+    write_attempt_file(f, 5, bad=(3, ))
+    pogo = make_pogo(direct=1)
+    conn = FakeConnection()
+    with pytest.raises(Exception) as e:
+        ship_direct(pogo, tmpdir, conn)
+    assert '20150301' in str(e.value)
+    # The batch with the refused record, and those after it, aren't recorded:
+    assert journal_state(pogo, f).records_done == 2
+    assert f.check()
+    assert not tmpdir.join('archives').listdir()
+
+
+def test_direct_archives_finished_files_even_if_another_fails(make_pogo, tmpdir):
+    good = tmpdir.join('logs', '20150301')
+    bad = tmpdir.join('logs', '20150302')
+    write_attempt_file(good, 3)
+    write_attempt_file(bad, 3, bad=(0, ))
+    pogo = make_pogo(direct=1)
+    with pytest.raises(Exception):
+        ship_direct(pogo, tmpdir, FakeConnection())
+    assert not good.check()
+    assert bad.check()
+    assert journal_state(pogo, bad) is None
+    [archive] = tmpdir.join('archives').listdir(lambda p: p.ext == '.bz2')
+    assert [ m['path'] for m in json.load(open(str(archive) + '.manifest'))['members'] ] == \
+           [ str(good).lstrip('/') ]
+
+
+def use_fake_es(pogo, bulk_docs=100):
+    daos = {}
+    for name in ('AttemptRecordDaoES', 'LogRecordDaoES', 'SessionLogDaoES', 'SessionRecordingDaoES',
+                 'SessionDownloadDaoES', 'DownloadContentDaoES'):
+        esclass = getattr(record_dao_es, name)
+        daos[esclass] = pogo._es_links[esclass] = make_dao(bulk_docs, 1000000, esclass)
+    return daos
+
+
+def archived_paths(tmpdir):
+    paths = []
+    for archive in tmpdir.join('archives').listdir(lambda p: p.ext == '.bz2'):
+        paths += [ m['path'] for m in json.load(open(str(archive) + '.manifest'))['members'] ]
+    return sorted(paths)
+
+
+def test_concurrent_pipelines_overlap_and_ship_everything(make_pogo, tmpdir):
+    for day in ('20150301', '20150302'):
+        write_attempt_file(tmpdir.join('logs', day), 5)
+    pogo = make_pogo(workers=2)
+    daos = use_fake_es(pogo)
+    # The first two pipelines only go on once both have started,
+    # which can't happen unless they're run at the same time:
+    started = []
+    run_pipeline = pogo.run_pipeline
+    def run_pipeline_together(pipeline):
+        started.append(pipeline)
+        if len(started) <= 2:
+            assert wait_for(lambda: len(started) >= 2)
+        return run_pipeline(pipeline)
+    pogo.run_pipeline = run_pipeline_together
+    pogo.run_all()
+    assert len(started) == 5
+    assert len(daos[AttemptRecordDaoES]._es_connection.docs) == 10
+    assert tmpdir.join('logs').listdir() == []
+    assert len(tmpdir.join('archives').listdir(lambda p: p.ext == '.bz2')) == 1
+
+
+def wait_for(condition, timeout=5):
+    until = time.time() + timeout
+    while not condition():
+        if time.time() > until:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_pipelined_run_ships_and_prunes_each_file_once(make_pogo, tmpdir):
+    days = ('20150301', '20150302', '20150303')
+    for day in days:
+        write_attempt_file(tmpdir.join('logs', day), 5)
+    pogo = make_pogo(pipelined=1)
+    assert pogo._cfg.get_pipelined()
+    daos = use_fake_es(pogo, bulk_docs=2)
+    pogo.run_all()
+    conn = daos[AttemptRecordDaoES]._es_connection
+    assert len(conn.docs) == 15
+    assert sum(b.count('\n') / 2 for b in conn.bodies) == 15
+    assert sorted(d['password'] for d in conn.docs.values()) == sorted('pw%d' % i for i in range(5) for day in days)
+    assert tmpdir.join('logs').listdir() == []
+    assert archived_paths(tmpdir) == sorted(str(tmpdir.join('logs', day)).lstrip('/') for day in days)
+    assert pogo._dba.db.execute('SELECT COUNT(*) FROM attempts').fetchone()[0] == 0
+    # Nothing's left for the next run to do:
+    requests = len(conn.bodies)
+    pogo.run_all()
+    assert len(conn.bodies) == requests
+
+
+class RefusesAll(FakeConnection):
+    def bulk(self, body, index=None, doc_type=None):
+        self.bodies.append(body)
+        return {'errors': True, 'items': [ {'index': {'status': 400, 'error': 'MapperParsingException'}}
+                                           for line in body.splitlines()[0::2] ]}
+
+
+def write_downloads(tmpdir, contents):
+    downloads = tmpdir.join('sessions', '10.0.0.1', 'downloads')
+    for (i, data) in enumerate(contents):
+        p = downloads.join('20150301_1200%02d_x.sh' % i)
+        p.write(data, ensure=True)
+        os.utime(str(p), (OLD, OLD))
+    return downloads
+
+
+def content_rows(pogo):
+    return pogo._dba.db.execute('SELECT sha256, es_shipped, contents IS NULL FROM download_contents '
+                                'ORDER BY sha256').fetchall()
+
+
+def test_download_contents_are_shipped_once_per_hash(make_pogo, tmpdir):
+    downloads = write_downloads(tmpdir, [ 'same', 'same', 'different' ])
+    pogo = make_pogo()
+    daos = use_fake_es(pogo)
+    pogo.run_all()
+    contents = daos[record_dao_es.DownloadContentDaoES]._es_connection.docs
+    hashes = sorted(hashlib.sha256(data).hexdigest() for data in ('same', 'different'))
+    assert sorted(contents) == hashes
+    assert sorted(d['contents'].decode('base64') for d in contents.values()) == ['different', 'same']
+    records = daos[record_dao_es.SessionDownloadDaoES]._es_connection.docs.values()
+    assert len(records) == 3
+    assert all(r['contents'] == '' for r in records)
+    # Shipped, then emptied by pruning, but kept to recognize the same files later:
+    assert content_rows(pogo) == [ (h, 1, 1) for h in hashes ]
+    assert downloads.listdir() == []
+
+
+def test_download_contents_refused_are_neither_marked_nor_pruned(make_pogo, tmpdir):
+    write_downloads(tmpdir, [ 'same', 'same', 'different' ])
+    pogo = make_pogo()
+    daos = use_fake_es(pogo)
+    daos[record_dao_es.DownloadContentDaoES]._es_connection = RefusesAll()
+    with pytest.raises(Exception):
+        pogo.run_all()
+    hashes = sorted(hashlib.sha256(data).hexdigest() for data in ('same', 'different'))
+    assert content_rows(pogo) == [ (h, 0, 0) for h in hashes ]
+    assert daos[record_dao_es.SessionDownloadDaoES]._es_connection.docs == {}
+    assert DownloadContentDaoLocal(pogo._dba).prune() == 0
+    assert content_rows(pogo) == [ (h, 0, 0) for h in hashes ]
@@ -0,0 +1,51 @@
+'''
+pogo: tests for util.metrics.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import json
+
+from pogo.util.metrics import Metrics
+
+
+def test_prometheus_text_file(tmpdir):
+    m = Metrics()
+    m.inc('records_parsed_total', 10, file_type='AttemptFile')
+    m.inc('records_parsed_total', 5, file_type='AttemptFile')
+    m.set('cache_hit_ratio', 0.5, cache='geo')
+    m.observe('es_request_seconds', 0.02, doc_type='HonSSH_Attempt')
+    m.observe('es_request_seconds', 2.0, doc_type='HonSSH_Attempt')
+    path = tmpdir.join('textfile', 'pogo.prom')
+    m.write_prometheus(str(path))
+    lines = path.read().splitlines()
+    assert '# TYPE pogo_records_parsed_total counter' in lines
+    assert 'pogo_records_parsed_total{file_type="AttemptFile"} 15' in lines
+    assert 'pogo_cache_hit_ratio{cache="geo"} 0.5' in lines
+    assert '# TYPE pogo_es_request_seconds histogram' in lines
+    assert 'pogo_es_request_seconds_bucket{doc_type="HonSSH_Attempt",le="0.01"} 0' in lines
+    assert 'pogo_es_request_seconds_bucket{doc_type="HonSSH_Attempt",le="0.05"} 1' in lines
+    assert 'pogo_es_request_seconds_bucket{doc_type="HonSSH_Attempt",le="+Inf"} 2' in lines
+    assert 'pogo_es_request_seconds_count{doc_type="HonSSH_Attempt"} 2' in lines
+
+
+def test_json_summary_covers_one_run(tmpdir):
+    m = Metrics()
+    m.inc('records_parsed_total', 1000, file_type='AttemptFile')
+    snapshot = m.snapshot()
+    m.inc('records_parsed_total', 300, file_type='AttemptFile')
+    m.observe('file_seconds', 2.0, file_type='AttemptFile')
+    m.inc('es_docs_total', 300, doc_type='HonSSH_Attempt')
+    m.observe('stage_seconds', 3.0, stage='ship', doc_type='HonSSH_Attempt')
+    m.observe('stage_seconds', 1.0, stage='prune', doc_type='HonSSH_Attempt')
+    path = tmpdir.join('runs.json')
+    m.write_json(str(path), snapshot)
+    m.write_json(str(path))
+    runs = [ json.loads(line) for line in path.read().splitlines() ]
+    assert len(runs) == 2
+    run = runs[0]
+    assert { 'name': 'records_parsed_total', 'file_type': 'AttemptFile', 'value': 300 } in run['counters']
+    assert run['rates']['records_per_second'] == { 'AttemptFile': 150.0 }
+    assert run['rates']['docs_per_second'] == { 'HonSSH_Attempt': 100.0 }
+    # Without a snapshot, the summary covers everything since pogo started:
+    assert runs[1]['rates']['records_per_second'] == { 'AttemptFile': 650.0 }
@@ -0,0 +1,55 @@
+'''
+pogo: tests for service.pipeline.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import threading
+import time
+
+import pytest
+
+from pogo.service.pipeline import Pipeline
+
+
+def test_stages_overlap_and_batch_waiting_items():
+    first_shipped = threading.Event()
+    read = []
+    shipped = []
+    archived = []
+    def source():
+        for i in range(6):
+            if i == 3:
+                # Later items are read while earlier ones are being shipped:
+                assert first_shipped.wait(2)
+            read.append(i)
+            yield i
+    def ship(items):
+        time.sleep(0.02)
+        shipped.append(items)
+        first_shipped.set()
+        return items
+    def archive(items):
+        archived.extend(items)
+    Pipeline([ ship, archive ], queue_size=2).run(source())
+    assert archived == range(6)
+    assert sum(shipped, []) == range(6)
+    # Items that were waiting when the ship stage came round were shipped together:
+    assert len(shipped) < 6
+
+
+def test_errors_stop_the_pipeline():
+    read = []
+    def source():
+        for i in range(100):
+            read.append(i)
+            yield i
+    def ship(items):
+        if 2 in items:
+            raise IOError('ES is down')
+        return items
+    archived = []
+    with pytest.raises(IOError):
+        Pipeline([ ship, archived.extend ], queue_size=1, max_batch=1).run(source())
+    assert 2 not in archived
+    assert len(read) < 100
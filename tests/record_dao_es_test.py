@@ -0,0 +1,90 @@
+'''
+pogo: tests for the bulk insertion code in dao.record_dao_es.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import json
+
+from pogo.dao.record_dao_es import AttemptRecordDaoES, DownloadContentDaoES
+from pogo.dto.record import AttemptRecord, DownloadContentRecord
+
+
+class FakeConnection(object):
+    """
+        Stands in for an Elasticsearch connection; records the
+        bodies of _bulk requests and fails the documents whose
+        user field is 'bad'. The documents are kept in docs, by
+        _id; a document sent with an _id replaces any already
+        there under that _id.
+    """
+    def __init__(self):
+        self.bodies = []
+        self.docs = {}
+        self.next_id = 0
+
+    def bulk(self, body, index=None, doc_type=None):
+        self.bodies.append(body)
+        items = []
+        lines = body.splitlines()
+        for (action, line) in zip(lines[0::2], lines[1::2]):
+            if '"bad"' in line:
+                items.append({'index': {'status': 400, 'error': 'MapperParsingException'}})
+            else:
+                doc_id = json.loads(action)['index'].get('_id')
+                if doc_id is None:
+                    self.next_id += 1
+                    doc_id = 'id' + str(self.next_id)
+                self.docs[doc_id] = json.loads(line)
+                items.append({'index': {'status': 201, '_id': doc_id}})
+        return {'errors': False, 'items': items}
+
+    def mget(self, body, index=None, doc_type=None, _source=None):
+        return {'docs': [ {'_id': i, 'found': i.startswith('old')} for i in body['ids'] ]}
+
+
+def make_dao(bulk_docs, bulk_bytes, dao_class=AttemptRecordDaoES):
+    # Bypass __init__, which would contact a real server:
+    dao = dao_class.__new__(dao_class)
+    dao._es_index = 'hon_ssh'
+    dao._es_connection = FakeConnection()
+    dao.bulk_docs = bulk_docs
+    dao.bulk_bytes = bulk_bytes
+    return dao
+
+
+def make_record(user):
+    r = AttemptRecord()
+    r.timestamp = '2015-01-13 20:22:00'
+    r.source_ip = '192.168.0.1'
+    r.user = user
+    return r
+
+
+def test_insert_bulk_batches_by_docs():
+    dao = make_dao(2, 1000000)
+    results = dao.insert_bulk([make_record('u' + str(i)) for i in range(5)])
+    assert len(dao._es_connection.bodies) == 3
+    assert results == [(True, 'id1'), (True, 'id2'), (True, 'id3'), (True, 'id4'), (True, 'id5')]
+
+
+def test_insert_bulk_batches_by_bytes():
+    dao = make_dao(100, 1)
+    dao.insert_bulk([make_record('u1'), make_record('u2')])
+    # Each document is bigger than the byte limit, so each is sent alone:
+    assert len(dao._es_connection.bodies) == 2
+
+
+def test_insert_bulk_reports_errors_per_item():
+    dao = make_dao(100, 1000000)
+    results = dao.insert_bulk([make_record('good'), make_record('bad'), make_record('good')])
+    assert results == [(True, 'id1'), (False, 'MapperParsingException'), (True, 'id2')]
+
+
+def test_download_contents_are_indexed_by_hash():
+    dao = make_dao(100, 1000000, DownloadContentDaoES)
+    assert dao.existing_ids(['old1', 'new1', 'old2']) == set(['old1', 'old2'])
+    dao.insert_bulk([DownloadContentRecord('new1', 3, 'YWJj')])
+    lines = dao._es_connection.bodies[0].splitlines()
+    assert json.loads(lines[0]) == {'index': {'_id': 'new1'}}
+    assert json.loads(lines[1])['contents'] == 'YWJj'
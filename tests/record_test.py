@@ -0,0 +1,30 @@
+'''
+pogo: tests for dto.record.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+from pogo.dto.record import AttemptRecord, LogRecord, SessionLogRecord, SessionRecordingRecord
+
+
+def test_records_have_no_instance_dict():
+    for r in (AttemptRecord(), LogRecord(), SessionLogRecord(), SessionRecordingRecord()):
+        assert not hasattr(r, '__dict__')
+
+
+def test_equality_compares_all_fields():
+    a = AttemptRecord('2015-03-04 12:00:01,10.1.1.1,root,secret,0')
+    b = AttemptRecord('2015-03-04 12:00:01,10.1.1.1,root,secret,0')
+    assert a == b
+    b.password = 'other'
+    assert a != b
+    assert AttemptRecord() != LogRecord()
+
+
+def test_shared_strings_are_stored_once():
+    a = SessionRecordingRecord()
+    b = SessionRecordingRecord()
+    a.set_country_info(u'US', u'United ' + u'States')
+    b.set_country_info(u'US', u'United States'[:])
+    assert a.country_name is b.country_name
+    assert a.bifrozt_host is b.bifrozt_host
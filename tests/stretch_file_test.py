@@ -0,0 +1,101 @@
+'''
+pogo: tests for file.stretch_file.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+import hashlib
+import types
+
+import pytest
+
+from pogo.file import stretch_file
+from pogo.file.stretch_file import LogFile, AttemptFile, SessionDownloadFile
+
+
+LOG_LINES = [
+    "2015-03-04 12:00:01-0500 [-] HonSSH Boot Sequence Complete\n",
+    "2015-03-04 12:00:02-0500 [HonsshServerTransport,0,1.2.3.4] Traceback (most recent call last):\n",
+    "\tFile \"honssh.py\", line 1, in <module>\n",
+    "\tValueError: oops\n",
+    "2015-03-04 12:00:03-0500 [-] Stopping\n",
+]
+
+
+def test_log_file_iter_records_joins_continuation_lines(tmpdir):
+    p = tmpdir.join('honssh.log')
+    p.write(''.join(LOG_LINES))
+    lf = LogFile(str(p))
+    it = lf.iter_records()
+    assert isinstance(it, types.GeneratorType)
+    records = list(it)
+    assert len(records) == 3
+    assert records[1].message.endswith(' -- File "honssh.py", line 1, in <module> -- ValueError: oops')
+    assert records[2].server_info == '[-]'
+
+
+def test_load_matches_iter_records(tmpdir):
+    p = tmpdir.join('20150304')
+    p.write("2015-03-04 12:00:01,1.2.3.4,root,123456,0\n"
+            "2015-03-04 12:00:02,1.2.3.4,root,pass,word,1\n")
+    af = AttemptFile(str(p))
+    assert af.load()
+    assert len(af) == 2
+    assert [r.as_dict() for r in af] == [r.as_dict() for r in af.iter_records()]
+    assert list(af)[1].password == 'pass,word'
+
+
+def make_download(tmpdir, data):
+    d = tmpdir.mkdir('10.0.0.1').mkdir('downloads')
+    p = d.join('20150304_120001_payload.bin')
+    p.write(data, mode='wb')
+    return str(p)
+
+
+def test_blob_is_encoded_in_chunks(tmpdir, monkeypatch):
+    monkeypatch.setattr(stretch_file, 'BASE64_CHUNK_SIZE', 3 * 4)
+    data = ''.join(chr(i % 256) for i in range(1000))
+    [r] = list(SessionDownloadFile(make_download(tmpdir, data)).iter_records())
+    assert '\n' not in r.contents
+    assert r.contents.decode('base64') == data
+    assert r.file_size == 1000
+    assert r.source_ip == '10.0.0.1'
+    assert r.sha256 == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 11, 12, 13, 24, 1000])
+def test_encoding_fills_the_buffer_exactly(tmpdir, monkeypatch, size):
+    monkeypatch.setattr(stretch_file, 'BASE64_CHUNK_SIZE', 3 * 4)
+    data = ''.join(chr((i * 7) % 256) for i in range(size))
+    p = tmpdir.join('blob')
+    p.write(data, mode='wb')
+    with open(str(p), 'rb') as f:
+        encoded = stretch_file.encode_base64_file(f, size)
+    assert encoded == data.encode('base64').replace('\n', '')
+    assert len(encoded) == 4 * ((size + 2) // 3)
+
+
+def test_oversized_blob_is_stored_without_contents(tmpdir, monkeypatch):
+    monkeypatch.setattr(stretch_file, '_max_blob_size', 0)
+    path = make_download(tmpdir, 'x' * 100)
+    stretch_file.configure_max_blob_size(99)
+    [r] = list(SessionDownloadFile(path).iter_records())
+    assert (r.contents, r.file_size) == ('', 100)
+    stretch_file.configure_max_blob_size(100)
+    [r] = list(SessionDownloadFile(path).iter_records())
+    assert r.contents == ('x' * 100).encode('base64').replace('\n', '')
+
+
+def test_log_file_growing_holds_back_last_record(tmpdir):
+    p = tmpdir.join('honssh.log')
+    p.write(''.join(LOG_LINES[:3]))
+    lf = LogFile(str(p))
+    records = list(lf.iter_records(0, growing=True))
+    # The traceback may have more lines to come, so it isn't handed out:
+    assert len(records) == 1
+    assert lf.consumed_offset == len(LOG_LINES[0])
+    p.write(''.join(LOG_LINES[3:]), mode='a')
+    records = list(lf.iter_records(lf.consumed_offset, growing=False))
+    assert len(records) == 2
+    assert records[0].message.endswith(' -- ValueError: oops')
+    assert lf.consumed_offset == p.size()
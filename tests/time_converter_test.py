@@ -0,0 +1,65 @@
+'''
+pogo: tests for util.LocalTimeConverter.
+
+Copyright 2015, Tony Rein
+Licensed under MIT
+'''
+from datetime import datetime
+
+import pytest
+import pytz
+
+from pogo.util.util import LocalTimeConverter
+
+EASTERN = pytz.timezone('US/Eastern')
+
+
+def reference_to_utc(s, tz=EASTERN):
+    # The straightforward (slow) way to do it:
+    naive = datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+    return tz.localize(naive).astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_to_utc_across_dst_transitions():
+    conv = LocalTimeConverter(EASTERN)
+    stamps = ['2015-03-08 01:59:59', '2015-03-08 03:00:00', '2015-07-04 12:00:00',
+              '2015-11-01 00:59:59', '2015-11-01 01:30:00', '2015-11-01 02:00:00',
+              '2015-12-31 23:59:59']
+    assert conv.to_utc_many(stamps) == [reference_to_utc(s) for s in stamps]
+
+
+@pytest.mark.parametrize('zone, day', [
+    ('Australia/Lord_Howe', '2015-10-04'), # 02:00 becomes 02:30
+    ('Australia/Lord_Howe', '2015-04-05'), # 02:00 becomes 01:30
+    ('Pacific/Chatham', '2015-09-27'),     # 02:45 becomes 03:45
+    ('Pacific/Chatham', '2015-04-05'),     # 03:45 becomes 02:45
+])
+def test_to_utc_across_transitions_off_the_hour(zone, day):
+    tz = pytz.timezone(zone)
+    conv = LocalTimeConverter(tz)
+    stamps = [ '%s %02d:%02d:%02d' % (day, h, m, 30) for h in range(1, 5) for m in range(0, 60, 5) ]
+    assert conv.to_utc_many(stamps) == [ reference_to_utc(s, tz) for s in stamps ]
+
+
+def test_offsets_are_cached_per_hour():
+    conv = LocalTimeConverter(EASTERN)
+    conv.to_utc_many(['2015-07-04 12:%02d:00' % m for m in range(60)])
+    assert (conv.misses, conv.hits) == (1, 59)
+    conv.to_utc('2015-07-04 13:00:00')
+    assert conv.misses == 2
+
+
+def test_to_utc_falls_back_for_unusual_layouts():
+    conv = LocalTimeConverter(EASTERN)
+    assert conv.to_utc('2015-7-4 12:00:00') == '2015-07-04 16:00:00'
+    assert conv.to_utc('') is None
+
+
+def test_timestamp_to_utc_uses_explicit_offset():
+    conv = LocalTimeConverter(EASTERN)
+    assert conv.timestamp_to_utc('2015-03-04 12:00:01-0500') == '2015-03-04 17:00:01'
+    assert conv.timestamp_to_utc('2015-03-04 12:00:01+05:30') == '2015-03-04 06:30:01'
+    assert conv.timestamp_to_utc('2015-03-04 12:00:01Z') == '2015-03-04 12:00:01'
+    # No offset means local time:
+    assert conv.timestamp_to_utc('2015-07-04 12:00:01') == '2015-07-04 16:00:01'
+    assert conv.timestamp_to_utc('2015-03-04T12:00:01.250-0500') == '2015-03-04 17:00:01'